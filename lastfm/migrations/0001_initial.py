@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('music', '0003_tag_songtag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrichmentTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('claim_token', models.CharField(blank=True, default='', max_length=32)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='enrichment_task', to='music.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'available_at'], name='lastfm_enri_status_24987b_idx')],
+            },
+        ),
+    ]
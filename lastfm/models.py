@@ -0,0 +1,31 @@
+from django.db import models
+from django.utils import timezone
+from music.models import Song
+
+
+class EnrichmentTask(models.Model):
+    """A song waiting for Last.fm enrichment, drained by the process_enrichment_queue command"""
+    song = models.OneToOneField(Song, on_delete=models.CASCADE, related_name='enrichment_task')
+    status = models.CharField(
+        max_length=20,
+        default='pending',
+        choices=[
+            ('pending', 'Pending'),
+            ('processing', 'Processing'),
+            ('failed', 'Failed'),
+        ]
+    )
+    attempts = models.IntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # not claimed before this time
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    claim_token = models.CharField(max_length=32, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.song} ({self.status})"
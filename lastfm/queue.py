@@ -0,0 +1,108 @@
+import time
+import uuid
+import logging
+from datetime import timedelta
+from typing import Iterable, List
+from django.db.models import Q
+from django.utils import timezone
+from music.models import Song
+from .models import EnrichmentTask
+from .utils import enrich_song_with_lastfm_data
+
+logger = logging.getLogger(__name__)
+
+# Songs whose Last.fm data is older than this are enriched again
+STALE_AFTER = timedelta(days=30)
+# A processing task not finished within this time is assumed lost and claimed again
+CLAIM_TIMEOUT = timedelta(minutes=10)
+MAX_ATTEMPTS = 5
+
+
+def stale_songs_q() -> Q:
+    """Songs without Last.fm tags or with Last.fm data older than STALE_AFTER"""
+    return Q(lastfm_tags={}) | Q(lastfm_tags__isnull=True) | Q(lastfm_updated__lt=timezone.now() - STALE_AFTER)
+
+
+def enqueue_stale_playlist_songs():
+    """Queue every song in a playlist whose Last.fm data is missing or stale"""
+    enqueue_songs(
+        Song.objects.filter(stale_songs_q(), playlists__isnull=False).distinct().values_list('id', flat=True)
+    )
+
+
+def enqueue_songs(song_ids: Iterable[int]):
+    """
+    Queue songs for enrichment. Songs already queued are left as they are,
+    except failed tasks whose retry time has passed, which start over.
+    """
+    song_ids = list(song_ids)
+    if not song_ids:
+        return
+    EnrichmentTask.objects.bulk_create(
+        [EnrichmentTask(song_id=song_id) for song_id in song_ids],
+        ignore_conflicts=True
+    )
+    EnrichmentTask.objects.filter(
+        song_id__in=song_ids,
+        status='failed',
+        available_at__lte=timezone.now()
+    ).update(status='pending', attempts=0, claim_token='')
+
+
+def claim_tasks(limit: int) -> List[EnrichmentTask]:
+    """
+    Claim up to limit due tasks for this worker. The claim is a single
+    conditional UPDATE tagged with a fresh token, so concurrent workers
+    never get the same task.
+    """
+    now = timezone.now()
+    due = Q(status='pending', available_at__lte=now) | Q(status='processing', claimed_at__lt=now - CLAIM_TIMEOUT)
+    task_ids = list(EnrichmentTask.objects.filter(due).order_by('available_at').values_list('id', flat=True)[:limit])
+    
+    token = uuid.uuid4().hex
+    EnrichmentTask.objects.filter(due, id__in=task_ids).update(
+        status='processing',
+        claimed_at=now,
+        claim_token=token
+    )
+    return list(EnrichmentTask.objects.filter(claim_token=token).select_related('song'))
+
+
+def retry_task(task: EnrichmentTask, error: str):
+    """
+    Put a task back with exponential backoff, or give up after MAX_ATTEMPTS.
+    A failed task can be queued again by enqueue_songs after STALE_AFTER.
+    """
+    task.attempts += 1
+    task.last_error = error
+    if task.attempts >= MAX_ATTEMPTS:
+        task.status = 'failed'
+        task.available_at = timezone.now() + STALE_AFTER
+    else:
+        task.status = 'pending'
+        task.available_at = timezone.now() + timedelta(minutes=2 ** task.attempts)
+    task.claim_token = ''
+    task.save(update_fields=['attempts', 'last_error', 'status', 'available_at', 'claim_token'])
+
+
+def process_tasks(tasks: List[EnrichmentTask]) -> List[int]:
+    """
+    Enrich the songs of claimed tasks, pacing requests like
+    batch_enrich_songs_with_lastfm.
+    
+    Returns:
+        List[int]: Ids of the songs that were enriched
+    """
+    enriched = []
+    for i, task in enumerate(tasks):
+        if i > 0 and i % 10 == 0:
+            time.sleep(1)
+        
+        if enrich_song_with_lastfm_data(task.song):
+            enriched.append(task.song_id)
+            task.delete()
+            logger.info(f"Enriched song {task.song_id}: {task.song.name} by {task.song.artist}")
+        else:
+            retry_task(task, 'No Last.fm tags')
+    
+    return enriched
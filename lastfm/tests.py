@@ -0,0 +1,114 @@
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase
+from django.utils import timezone
+from music.models import Playlist, Song
+from accounts.models import User
+from music.utils import BoundedExecutor
+from .models import EnrichmentTask
+from .queue import CLAIM_TIMEOUT, MAX_ATTEMPTS, STALE_AFTER, claim_tasks, enqueue_songs, enqueue_stale_playlist_songs, retry_task
+from .utils import LASTFM_MAX_WORKERS, LastFMAPI
+
+
+class TestEnrichmentQueue(TestCase):
+    def setUp(self):
+        self.song = Song.objects.create(name="Song", artist="Artist", spotify_id="spotify:track:queue")
+    
+    def test_claim_is_exclusive(self):
+        """Test a claimed task is not handed out again until its claim times out."""
+        enqueue_songs([self.song.id, self.song.id])
+        self.assertEqual([task.song_id for task in claim_tasks(10)], [self.song.id])
+        self.assertEqual(claim_tasks(10), [])
+        
+        EnrichmentTask.objects.update(claimed_at=timezone.now() - CLAIM_TIMEOUT - timedelta(seconds=1))
+        self.assertEqual(len(claim_tasks(10)), 1)
+    
+    def test_retry_backs_off(self):
+        """Test a retried task waits exponentially longer before it can be claimed."""
+        enqueue_songs([self.song.id])
+        task = claim_tasks(1)[0]
+        retry_task(task, 'No Last.fm tags')
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), ('pending', 1))
+        self.assertGreater(task.available_at, timezone.now() + timedelta(minutes=1))
+        self.assertEqual(claim_tasks(1), [])
+    
+    def test_failed_task_requeued_after_stale_after(self):
+        """Test a task fails after MAX_ATTEMPTS and is only queued again once STALE_AFTER has passed."""
+        enqueue_songs([self.song.id])
+        task = EnrichmentTask.objects.get()
+        for _ in range(MAX_ATTEMPTS):
+            retry_task(task, 'No Last.fm tags')
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'failed')
+        
+        enqueue_songs([self.song.id])
+        self.assertEqual(EnrichmentTask.objects.get().status, 'failed')
+        
+        EnrichmentTask.objects.update(available_at=timezone.now() - STALE_AFTER)
+        enqueue_songs([self.song.id])
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), ('pending', 0))
+        self.assertEqual(len(claim_tasks(1)), 1)
+    
+    def test_sweep_queues_stale_playlist_songs(self):
+        """Test the sweep queues stale songs in playlists and leaves fresh and unused songs alone."""
+        fresh = Song.objects.create(name="Fresh", artist="Artist", spotify_id="spotify:track:fresh",
+                                    lastfm_tags={'rock': 1.0}, lastfm_updated=timezone.now())
+        stale = Song.objects.create(name="Stale", artist="Artist", spotify_id="spotify:track:stale",
+                                    lastfm_tags={'rock': 1.0}, lastfm_updated=timezone.now() - STALE_AFTER)
+        playlist = Playlist.objects.create(name="Sweep", user=User.objects.create(username="sweepuser"))
+        playlist.songs.add(fresh, stale)
+        EnrichmentTask.objects.all().delete()
+        
+        enqueue_stale_playlist_songs()
+        self.assertEqual(list(EnrichmentTask.objects.values_list('song_id', flat=True)), [stale.id])
+
+
+class TestSimilarTracksMany(TestCase):
+    def setUp(self):
+        """Set up the API with get_similar_tracks replaced, 'Slow' artists answer once the test ends."""
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.api = LastFMAPI()
+        patcher = mock.patch.object(self.api, 'get_similar_tracks', side_effect=self.similar_tracks)
+        self.get_similar_tracks = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def similar_tracks(self, artist, track, limit):
+        if artist == 'Slow':
+            self.release.wait(5)
+        elif artist == 'Broken':
+            raise ValueError("Bad response")
+        else:
+            time.sleep(0.2)
+        return [{'name': f"{track} similar", 'limit': limit}]
+    
+    def test_requests_run_concurrently(self):
+        """Test a full batch of requests takes about as long as one request."""
+        pairs = [(f"Artist {i}", f"Track {i}") for i in range(LASTFM_MAX_WORKERS)]
+        start = time.monotonic()
+        results = self.api.get_similar_tracks_many(pairs, limit=5, timeout=5.0)
+        
+        self.assertLess(time.monotonic() - start, 0.2 * LASTFM_MAX_WORKERS / 2)
+        self.assertEqual(set(results), set(pairs))
+        self.assertEqual(results[pairs[0]], [{'name': "Track 0 similar", 'limit': 5}])
+    
+    def test_deadline_returns_partial_results(self):
+        """Test pairs answered before the deadline are returned, slow and failed ones left out."""
+        pairs = [('Artist', 'Fast'), ('Slow', 'Track'), ('Broken', 'Track')]
+        start = time.monotonic()
+        results = self.api.get_similar_tracks_many(pairs, timeout=0.5)
+        
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(list(results), [('Artist', 'Fast')])
+    
+    def test_saturated_executor_skips_requests(self):
+        """Test pairs that find every executor slot busy are skipped instead of queued."""
+        with mock.patch('lastfm.utils._executor', BoundedExecutor(1)):
+            results = self.api.get_similar_tracks_many([('Slow', 'Track'), ('Artist', 'Fast')], timeout=0.2)
+        
+        self.assertEqual(results, {})
+        self.assertEqual(self.get_similar_tracks.call_count, 1)
@@ -3,14 +3,23 @@ import hashlib
 from typing import Dict, List, Optional, Tuple
 from django.conf import settings
 from django.core.cache import cache
+from django.utils import timezone
 import logging
 import time
+from concurrent.futures import wait
+from music.utils import BoundedExecutor, ExecutorSaturated
 
 logger = logging.getLogger(__name__)
 
 LASTFM_API_BASE_URL = 'http://ws.audioscrobbler.com/2.0/'
 LASTFM_API_KEY = getattr(settings, 'LASTFM_API_KEY', '')
 
+# Upper bound on concurrent Last.fm requests from one process, requests
+# beyond LASTFM_MAX_QUEUED waiting ones are skipped instead of queued
+LASTFM_MAX_WORKERS = 8
+LASTFM_MAX_QUEUED = 32
+_executor = BoundedExecutor(LASTFM_MAX_WORKERS, LASTFM_MAX_QUEUED, thread_name_prefix='lastfm')
+
 class LastFMAPI:    
     def __init__(self):
         self.api_key = LASTFM_API_KEY
@@ -119,6 +128,43 @@ class LastFMAPI:
             return tracks
         return []
     
+    def get_similar_tracks_many(self, pairs: List[Tuple[str, str]], limit: int = 20,
+                                timeout: float = 3.0) -> Dict[Tuple[str, str], List[Dict]]:
+        """
+        get_similar_tracks for many (artist, track) pairs at once, at most
+        LASTFM_MAX_WORKERS requests in flight.
+        
+        Args:
+            pairs (List[Tuple[str, str]]): (artist, track) pairs
+            limit (int, optional): Similar tracks per pair. Defaults to 20.
+            timeout (float, optional): Overall deadline in seconds. Defaults to 3.0.
+        
+        Returns:
+            Dict[Tuple[str, str], List[Dict]]: Similar tracks of the pairs answered before
+            the deadline. Requests still running keep going in the background and fill
+            the cache for the next call. Pairs that find the executor saturated are
+            left out.
+        """
+        futures = {}
+        for artist, track in pairs:
+            try:
+                futures[_executor.submit(self.get_similar_tracks, artist, track, limit)] = (artist, track)
+            except ExecutorSaturated:
+                logger.info(f"Last.fm similar tracks: executor saturated, skipping {len(pairs) - len(futures)} requests")
+                break
+        
+        done, not_done = wait(futures, timeout=timeout)
+        if not_done:
+            logger.info(f"Last.fm similar tracks: {len(not_done)} of {len(futures)} requests missed the deadline")
+        
+        results = {}
+        for future in done:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                logger.error(f"Error getting similar tracks for {futures[future]}: {e}")
+        return results
+    
     def get_artist_tags(self, artist: str) -> List[Dict]:
         """Get top tags for an artist"""
         cache_key = f"lastfm_artist_tags_{hashlib.md5(artist.encode()).hexdigest()}"
@@ -231,7 +277,9 @@ def enrich_song_with_lastfm_data(song) -> bool:
         tags = get_track_tags_with_weights(song.artist, song.name)
         if tags:
             song.lastfm_tags = tags
+            song.lastfm_updated = timezone.now()
             song.save()
+            song.sync_tags()
             return True
             
     except Exception as e:
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Song, Playlist
+from .models import Song, Playlist, Tag
 
 @admin.register(Song)
 class SongAdmin(admin.ModelAdmin):
@@ -10,4 +10,8 @@ class SongAdmin(admin.ModelAdmin):
 class PlaylistAdmin(admin.ModelAdmin):
     list_display = ['name', 'user', 'is_public', 'created_at']
     list_filter = ['is_public', 'created_at']
-    search_fields = ['name', 'user__username']
\ No newline at end of file
+    search_fields = ['name', 'user__username']
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ['name']
+    search_fields = ['name']
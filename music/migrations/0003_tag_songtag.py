@@ -0,0 +1,56 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_song_tags(apps, schema_editor):
+    Song = apps.get_model('music', 'Song')
+    Tag = apps.get_model('music', 'Tag')
+    SongTag = apps.get_model('music', 'SongTag')
+
+    tag_ids = {}
+    batch = []
+    for song_id, tags in Song.objects.exclude(lastfm_tags={}).exclude(lastfm_tags__isnull=True).values_list('id', 'lastfm_tags').iterator(chunk_size=2000):
+        for name, weight in tags.items():
+            if name not in tag_ids:
+                tag_ids[name] = Tag.objects.create(name=name).id
+            batch.append(SongTag(song_id=song_id, tag_id=tag_ids[name], weight=weight))
+        if len(batch) >= 5000:
+            SongTag.objects.bulk_create(batch)
+            batch = []
+    SongTag.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0002_song_lastfm_listeners_song_lastfm_playcount_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SongTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weight', models.FloatField()),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='song_tags', to='music.song')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='song_tags', to='music.tag')),
+            ],
+            options={
+                'unique_together': {('song', 'tag')},
+                'indexes': [
+                    models.Index(fields=['tag', 'weight'], name='music_songt_tag_id_a3f8cd_idx'),
+                    models.Index(fields=['song', 'weight'], name='music_songt_song_id_cddb68_idx'),
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_song_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:20
+
+from django.db import migrations, models
+from music.utils import song_match_key
+
+
+def backfill_match_keys(apps, schema_editor):
+    Song = apps.get_model('music', 'Song')
+
+    batch = []
+    for song in Song.objects.only('id', 'artist', 'name').iterator(chunk_size=2000):
+        song.match_key = song_match_key(song.artist, song.name)
+        batch.append(song)
+        if len(batch) >= 2000:
+            Song.objects.bulk_update(batch, ['match_key'])
+            batch = []
+    Song.objects.bulk_update(batch, ['match_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0003_tag_songtag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='match_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=400),
+        ),
+        migrations.RunPython(backfill_match_keys, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,16 @@
 from django.db import models
 from django.contrib.auth.models import User
+from .signals import song_tags_changed
+from .utils import song_match_key
+
+class SongQuerySet(models.QuerySet):
+    def with_tag(self, tag: str, min_weight: float = 0.0):
+        """Songs tagged with tag at weight >= min_weight, highest weight first"""
+        return self.filter(
+            song_tags__tag__name=tag,
+            song_tags__weight__gte=min_weight
+        ).order_by('-song_tags__weight')
+
 
 class Song(models.Model):
     name = models.CharField(max_length=200)
@@ -31,14 +42,41 @@ class Song(models.Model):
     lastfm_url = models.URLField(max_length=500, blank=True, null=True)
     lastfm_updated = models.DateTimeField(blank=True, null=True)
     
+    # song_match_key(artist, name), for matching Last.fm (artist, title) pairs
+    match_key = models.CharField(max_length=400, blank=True, default='', db_index=True)
+    
+    objects = SongQuerySet.as_manager()
+    
     def __str__(self):
         return f"{self.name} - {self.artist}"
     
+    def save(self, *args, **kwargs):
+        self.match_key = song_match_key(self.artist, self.name)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'match_key'}
+        super().save(*args, **kwargs)
+    
     @property
     def top_tags(self):
-        if not self.lastfm_tags:
-            return []
-        return sorted(self.lastfm_tags.items(), key=lambda x: x[1], reverse=True)[:5]
+        # Use prefetch_related('song_tags__tag') when listing many songs
+        if 'song_tags' in getattr(self, '_prefetched_objects_cache', {}):
+            song_tags = sorted(self.song_tags.all(), key=lambda x: x.weight, reverse=True)[:5]
+            return [(song_tag.tag.name, song_tag.weight) for song_tag in song_tags]
+        return list(self.song_tags.order_by('-weight').values_list('tag__name', 'weight')[:5])
+    
+    def sync_tags(self):
+        """Replace the SongTag rows of this song with the contents of lastfm_tags"""
+        tags = self.lastfm_tags or {}
+        old_tags = dict(self.song_tags.values_list('tag__name', 'weight'))
+        Tag.objects.bulk_create([Tag(name=name) for name in tags], ignore_conflicts=True)
+        tag_ids = dict(Tag.objects.filter(name__in=list(tags)).values_list('name', 'id'))
+        
+        SongTag.objects.filter(song=self).delete()
+        SongTag.objects.bulk_create([
+            SongTag(song=self, tag_id=tag_ids[name], weight=weight)
+            for name, weight in tags.items()
+        ])
+        song_tags_changed.send(sender=Song, song=self, old_tags=old_tags, new_tags=tags)
     
     @property
     def primary_tag(self):
@@ -46,6 +84,30 @@ class Song(models.Model):
         return tags[0][0] if tags else None
     
     
+class Tag(models.Model):
+    name = models.CharField(max_length=200, unique=True)
+    
+    def __str__(self):
+        return self.name
+
+
+class SongTag(models.Model):
+    """One Last.fm tag of a song, the normalized form of Song.lastfm_tags"""
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='song_tags')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='song_tags')
+    weight = models.FloatField()
+    
+    def __str__(self):
+        return f"{self.song} - {self.tag} ({self.weight})"
+    
+    class Meta:
+        unique_together = ['song', 'tag']
+        indexes = [
+            models.Index(fields=['tag', 'weight']),
+            models.Index(fields=['song', 'weight']),
+        ]
+
+    
 class Playlist(models.Model):
     name = models.CharField(max_length=200)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='playlists')
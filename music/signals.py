@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# Sent by Song.sync_tags with old_tags and new_tags, both {tag: weight}
+song_tags_changed = Signal()
@@ -0,0 +1,108 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Tuple
+
+_FEATURING = re.compile(r'\s*[\(\[]?\s*\b(feat|ft|featuring)\b\.?\s.*$')
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text or '').casefold()
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(_NON_WORD.sub(' ', text).split())
+
+
+def song_match_key(artist: str, title: str) -> str:
+    """
+    Lookup key matching the same song across Spotify and Last.fm spellings:
+    casefolded, accents stripped, featured artists dropped and only the
+    first of comma separated artists kept.
+    """
+    artist = _FEATURING.sub('', (artist or '').split(',')[0].casefold())
+    title = _FEATURING.sub('', (title or '').casefold())
+    return f"{_normalize(artist)}|{_normalize(title)}"
+
+
+class LRUCache:
+    """Small thread-safe least-recently-used mapping"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Iterable) -> Dict:
+        with self._lock:
+            found = {}
+            for key in keys:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    found[key] = self._data[key]
+            return found
+
+    def set_many(self, items: Dict):
+        with self._lock:
+            for key, value in items.items():
+                self._data[key] = value
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+class ExecutorSaturated(RuntimeError):
+    """Raised by BoundedExecutor.submit when no slot is free"""
+
+
+class BoundedExecutor:
+    """
+    Thread pool that sheds load instead of queueing it: at most
+    max_workers + max_queued tasks are running or waiting, and submit()
+    raises ExecutorSaturated beyond that. A running task cannot be
+    cancelled, so tasks abandoned by a caller's deadline still hold their
+    slot until they finish.
+    """
+
+    def __init__(self, max_workers: int, max_queued: int = 0, thread_name_prefix: str = ''):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorSaturated("All executor slots are busy")
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+# Recent match_key -> song ids resolutions, only keys that matched are kept
+_match_key_cache = LRUCache()
+
+
+def resolve_match_keys(keys: Iterable[str]) -> Dict[str, Tuple[int, ...]]:
+    """
+    Ids of the songs with each match key, resolved from the in-process
+    cache and one indexed IN query for the rest. Keys without songs are
+    left out.
+    """
+    from .models import Song
+
+    keys = set(keys)
+    resolved = _match_key_cache.get_many(keys)
+    missing = keys - resolved.keys()
+
+    if missing:
+        found = {}
+        for song_id, key in Song.objects.filter(match_key__in=missing).order_by('id').values_list('id', 'match_key'):
+            found.setdefault(key, []).append(song_id)
+        found = {key: tuple(ids) for key, ids in found.items()}
+        _match_key_cache.set_many(found)
+        resolved.update(found)
+
+    return resolved
@@ -8,8 +8,8 @@ from .models import Song, Playlist
 from spotify.utils import get_track, get_track_audio_features, search_songs as spotify_search_songs
 
 try:
-    from recommendations.hybrid_recommender import HybridRecommender
-    from recommendations.models import HybridRecommendation
+    from recommendations.hybrid_recommender import HybridRecommender, COMPONENTS
+    from recommendations.models import HybridRecommendation, RecommendationSnapshot
     RECOMMENDATIONS_AVAILABLE = True
 except ImportError:
     RECOMMENDATIONS_AVAILABLE = False
@@ -59,19 +59,27 @@ def get_playlist_recommendations(playlist, strategy='balanced', limit=8):
         return cached_recs
     
     try:
+        # Pre-rendered by the last refresh, one primary-key read; degraded
+        # snapshots are served too but not cached, the refresh endpoint
+        # recomputes them
+        payload = RecommendationSnapshot.get_payload(playlist.id, strategy, include_degraded=True)
+        if payload:
+            recommendations = payload[:limit]
+            if not recommendations[0].get('degraded'):
+                cache.set(cache_key, recommendations, 1800)
+            return recommendations
+        
         existing_recs = HybridRecommendation.objects.filter(
             playlist=playlist,
             strategy=strategy
-        ).select_related('song').order_by('-hybrid_score')[:limit]
+        ).select_related('song').prefetch_related('song__song_tags__tag').order_by('-hybrid_score')[:limit]
         
         if existing_recs.exists():
             recommendations = []
             for rec in existing_recs:
                 
-                primary_tags = []
-                if rec.song.lastfm_tags:
-                    sorted_tags = sorted(rec.song.lastfm_tags.items(), key=lambda x: x[1], reverse=True)[:3]
-                    primary_tags = [tag[0] for tag in sorted_tags]
+                primary_tags = [tag for tag, _ in rec.song.top_tags[:3]]
+                components = (rec.explanation or {}).get('components', {})
                 
                 recommendations.append({
                     'song': {
@@ -87,16 +95,17 @@ def get_playlist_recommendations(playlist, strategy='balanced', limit=8):
                         'lastfm_listeners': rec.song.lastfm_listeners,
                     },
                     'score': rec.hybrid_score,
+                    # Same keys as the snapshot payload
                     'explanation': {
-                        'collaborative': rec.collaborative_score,
-                        'content_tags': rec.content_audio_score,
-                        'content_similar': rec.content_mood_score,
-                        'popularity': rec.popularity_score,
-                    }
+                        component: components.get(component, 0.0)
+                        for component in COMPONENTS
+                    },
+                    'degraded': (rec.explanation or {}).get('degraded', []),
                 })
             
-            # Cache for 30 minutes
-            cache.set(cache_key, recommendations, 1800)
+            # Cache for 30 minutes, unless components were degraded
+            if not recommendations[0]['degraded']:
+                cache.set(cache_key, recommendations, 1800)
             return recommendations
         
         return []
@@ -0,0 +1,183 @@
+import numpy as np
+import scipy.sparse as sp
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict
+from .model_registry import model_registry, export_inference_bundle
+from .quantization import format_report
+from .utils import load_interactions, hold_out_playlists
+
+
+class ALSRecommender:
+    """
+    Implicit-feedback matrix factorization trained with weighted ALS.
+
+    Every playlist-song pair gets confidence 1 + alpha, every missing pair
+    confidence 1 with preference 0, so unobserved songs act as weak
+    negatives. Each half-step is solved with a few conjugate-gradient
+    iterations over blocks of rows spread across a thread pool. Writes the
+    same artifact layout as PlaylistRecommender, so InferenceRecommender
+    serves either engine.
+    """
+
+    def __init__(self, n_factors=50, regularization=0.01, alpha=40.0, n_iterations=15, cg_steps=3, n_threads=None, precision='float32'):
+        """
+        Initialize the ALSRecommender with hyperparameters for the model.
+
+        Args:
+            n_factors (int, optional): Number of latent factors. Defaults to 50.
+            regularization (float, optional): L2 regularization. Defaults to 0.01.
+            alpha (float, optional): Confidence given to observed interactions. Defaults to 40.0.
+            n_iterations (int, optional): Number of ALS sweeps. Defaults to 15.
+            cg_steps (int, optional): Conjugate-gradient steps per solve. Defaults to 3.
+            n_threads (int, optional): Solver threads. Defaults to the number of CPUs.
+            precision (str, optional): Storage precision of the exported embeddings. Defaults to 'float32'.
+        """
+        self.n_factors = n_factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.n_iterations = n_iterations
+        self.cg_steps = cg_steps
+        self.n_threads = n_threads or os.cpu_count() or 1
+        self.precision = precision
+        self.playlist_ids = None
+        self.song_ids = None
+        self.playlist_factors = None
+        self.song_factors = None
+        self.interactions = None
+        self.held_out = []  # song indices of each playlist left out of training, for the quantization report
+
+
+    def build_interaction_matrix(self) -> sp.csr_matrix:
+        """
+        Build the playlist x song confidence matrix from the Playlist.songs through table,
+        without the playlists held out for the quantization report.
+
+        Returns:
+            sp.csr_matrix: Confidence values (1 + alpha) for every playlist-song pair
+        """
+        playlist_ids, self.song_ids, playlist_indices, song_indices = load_interactions()
+        self.playlist_ids, playlist_indices, song_indices, self.held_out = hold_out_playlists(
+            playlist_ids, playlist_indices, song_indices
+        )
+
+        confidence = np.full(len(playlist_indices), 1.0 + self.alpha, dtype=np.float32)
+        C = sp.csr_matrix(
+            (confidence, (playlist_indices, song_indices)),
+            shape=(len(self.playlist_ids), len(self.song_ids))
+        )
+        C.sort_indices()
+        return C
+
+
+    def _solve_block(self, C: sp.csr_matrix, X: np.ndarray, Y: np.ndarray, YtY: np.ndarray) -> np.ndarray:
+        """
+        Run conjugate gradient for a block of rows at once, solving
+        (YtY + Yt (C_u - I) Y + reg I) x_u = Yt C_u p_u for every row u.
+        """
+        n_rows = C.shape[0]
+        rows = np.repeat(np.arange(n_rows), np.diff(C.indptr))
+        cols = C.indices
+        Y_nnz = Y[cols]
+
+        def matvec(P):
+            weights = (C.data - 1.0) * np.einsum('ij,ij->i', Y_nnz, P[rows])
+            return P @ YtY + sp.csr_matrix((weights, cols, C.indptr), shape=C.shape) @ Y
+
+        x = X.copy()
+        r = C @ Y - matvec(x)
+        p = r.copy()
+        rs_old = np.einsum('ij,ij->i', r, r)
+
+        for _ in range(self.cg_steps):
+            Ap = matvec(p)
+            step = rs_old / np.maximum(np.einsum('ij,ij->i', p, Ap), 1e-10)
+            x += step[:, None] * p
+            r -= step[:, None] * Ap
+            rs_new = np.einsum('ij,ij->i', r, r)
+            p = r + (rs_new / np.maximum(rs_old, 1e-10))[:, None] * p
+            rs_old = rs_new
+
+        return x
+
+
+    def _solve(self, C: sp.csr_matrix, X: np.ndarray, Y: np.ndarray, executor: ThreadPoolExecutor) -> np.ndarray:
+        """Update every row of X against fixed Y, one block per task"""
+        YtY = Y.T @ Y + self.regularization * np.eye(self.n_factors, dtype=Y.dtype)
+        bounds = np.linspace(0, C.shape[0], min(self.n_threads * 4, C.shape[0]) + 1, dtype=np.int64)
+
+        def solve_rows(start, end):
+            X[start:end] = self._solve_block(C[start:end], X[start:end], Y, YtY)
+
+        list(executor.map(solve_rows, bounds[:-1], bounds[1:]))
+        return X
+
+
+    def train(self) -> Optional[Dict]:
+        """
+        Train the ALS model on playlist-song interactions and publish it.
+
+        Returns:
+            Training stats if successful, None if there is no data
+        """
+        print("Building interaction matrix")
+        C = self.build_interaction_matrix()
+        self.interactions = C
+
+        if C.nnz == 0:
+            print("No data")
+            return None
+
+        n_playlists, n_songs = C.shape
+        print(f"Data prepared. Number of playlists: {n_playlists}\nNumber of songs: {n_songs}")
+
+        rng = np.random.default_rng(42)
+        X = (rng.standard_normal((n_playlists, self.n_factors)) * 0.01).astype(np.float32)
+        Y = (rng.standard_normal((n_songs, self.n_factors)) * 0.01).astype(np.float32)
+        C_t = C.T.tocsr()
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for iteration in range(self.n_iterations):
+                X = self._solve(C, X, Y, executor)
+                Y = self._solve(C_t, Y, X, executor)
+                print(f"Iteration {iteration + 1}/{self.n_iterations}")
+
+        self.playlist_factors = X
+        self.song_factors = Y
+        self.save_model()
+
+        return {
+            'iterations': self.n_iterations,
+            'seconds': time.time() - start,
+        }
+
+
+    def save_model(self):
+        """Write the factors into a new model version and publish it"""
+        version, path = model_registry.create_version()
+        report = export_inference_bundle(
+            path,
+            playlist_ids=self.playlist_ids,
+            song_ids=self.song_ids,
+            playlist_factors=self.playlist_factors,
+            song_factors=self.song_factors,
+            playlist_biases=np.zeros(len(self.playlist_ids), dtype=np.float32),
+            song_biases=np.zeros(len(self.song_ids), dtype=np.float32),
+            interaction_indptr=self.interactions.indptr,
+            interaction_indices=self.interactions.indices,
+            precision=self.precision,
+            held_out=self.held_out,
+            fold_in={'engine': 'als', 'alpha': self.alpha, 'regularization': self.regularization}
+        )
+        print(format_report(report))
+        model_registry.publish(
+            version,
+            engine='als',
+            n_factors=self.n_factors,
+            alpha=self.alpha,
+            regularization=self.regularization,
+            precision=self.precision,
+            quantization_report=report
+        )
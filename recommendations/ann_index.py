@@ -0,0 +1,101 @@
+import numpy as np
+import os
+from typing import Optional
+
+# Files of a persisted index, stored next to the model arrays
+ANN_ARRAYS = ('ann_centroids', 'ann_list_offsets', 'ann_list_items')
+
+
+class IVFIndex:
+    """
+    Inverted-file index over song vectors for approximate maximum inner
+    product search. Songs are clustered with k-means; a query only scores
+    the songs in the n_probe lists whose centroids score highest, so
+    n_probe trades recall for latency.
+    """
+
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_items: np.ndarray):
+        self.centroids = centroids        # (n_lists, dim)
+        self.list_offsets = list_offsets  # items of list i are list_items[offsets[i]:offsets[i + 1]]
+        self.list_items = list_items      # song rows grouped by list
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, n_lists: Optional[int] = None, n_iter: int = 10,
+              sample_size: int = 100000, seed: int = 42) -> 'IVFIndex':
+        """
+        Cluster the vectors with k-means and group them by nearest centroid.
+
+        Args:
+            vectors (np.ndarray): Vectors to index, one per row
+            n_lists (int, optional): Number of clusters. Defaults to 4 * sqrt(n).
+            n_iter (int, optional): k-means iterations. Defaults to 10.
+            sample_size (int, optional): Rows used to fit the centroids. Defaults to 100000.
+            seed (int, optional): Random seed. Defaults to 42.
+
+        Returns:
+            IVFIndex: The built index
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n = len(vectors)
+        n_lists = max(1, min(n_lists or int(4 * np.sqrt(n)), n))
+
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(n, size=min(sample_size, n), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assignment = cls._assign(sample, centroids)
+            counts = np.bincount(assignment, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            non_empty = counts > 0
+            centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+
+        assignment = cls._assign(vectors, centroids)
+        list_items = np.argsort(assignment, kind='stable').astype(np.int32)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))]).astype(np.int64)
+        return cls(centroids, list_offsets, list_items)
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        """Nearest centroid (L2) of every vector, computed in blocks"""
+        centroid_norms = (centroids ** 2).sum(axis=1)
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), block_size):
+            block = vectors[start:start + block_size]
+            assignment[start:start + block_size] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+        return assignment
+
+    def probe(self, query: np.ndarray, n_probe: int) -> np.ndarray:
+        """Rows of the songs in the n_probe lists whose centroids score highest for the query"""
+        n_probe = min(n_probe, self.n_lists)
+        centroid_scores = self.centroids @ query
+        lists = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        return np.concatenate([
+            self.list_items[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists
+        ])
+
+    def save(self, path: str):
+        np.save(os.path.join(path, 'ann_centroids.npy'), self.centroids)
+        np.save(os.path.join(path, 'ann_list_offsets.npy'), self.list_offsets)
+        np.save(os.path.join(path, 'ann_list_items.npy'), self.list_items)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = 'r') -> Optional['IVFIndex']:
+        """Load a persisted index, None if the directory has none"""
+        try:
+            return cls(*[np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in ANN_ARRAYS])
+        except OSError:
+            return None
+
+
+def augment_with_bias(factors: np.ndarray, biases: np.ndarray) -> np.ndarray:
+    """
+    Append the bias as an extra dimension, so [u, 1] . [v, b] = u . v + b
+    and biased scores become a plain inner product search.
+    """
+    return np.hstack([np.asarray(factors, dtype=np.float32), np.asarray(biases, dtype=np.float32)[:, None]])
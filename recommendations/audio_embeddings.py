@@ -0,0 +1,167 @@
+import os
+import pickle
+from typing import Iterable, List, Optional, Tuple
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from music.models import Song
+from .utils import FileStore, top_k_indices
+
+# Columns fed to the encoder, in the order scaler.pkl was fitted on, and the
+# value used for a missing column (the scaler's fitted means)
+AUDIO_FEATURES = ('tempo', 'energy', 'danceability', 'valence', 'acousticness', 'instrumentalness')
+FEATURE_DEFAULTS = np.array([0.0, 0.5, 0.5, 0.5, 0.5, 0.0], dtype=np.float32)
+# Tempo is stored in BPM, the other features in [0, 1]
+TEMPO_SCALE = 200.0
+
+AUDIO_INDEX_FILE = 'audio_embeddings.npz'
+
+
+def models_path(name: str) -> str:
+    return os.path.join(settings.MEDIA_ROOT, 'models', name)
+
+
+def audio_feature_rows(queryset, chunk_size: int = 2000):
+    """(id, *AUDIO_FEATURES) of songs with at least one audio feature, sorted by id"""
+    has_features = Q()
+    for feature in AUDIO_FEATURES:
+        has_features |= Q(**{f'{feature}__isnull': False})
+    return queryset.filter(has_features).order_by('id').values_list(
+        'id', *AUDIO_FEATURES
+    ).iterator(chunk_size=chunk_size)
+
+
+def feature_matrix(rows: Iterable) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Song ids and unscaled encoder inputs of (id, *AUDIO_FEATURES) rows,
+    missing values filled with FEATURE_DEFAULTS.
+    """
+    rows = list(rows)
+    song_ids = np.asarray([row[0] for row in rows], dtype=np.int64)
+    features = np.asarray(
+        [[np.nan if value is None else value for value in row[1:]] for row in rows],
+        dtype=np.float32
+    ).reshape(len(rows), len(AUDIO_FEATURES))
+    features[:, 0] /= TEMPO_SCALE
+    features = np.where(np.isnan(features), FEATURE_DEFAULTS, features)
+    return song_ids, features
+
+
+class AudioEmbeddingIndex:
+    """
+    Encoder embeddings of every song with audio features, L2-normalized so
+    cosine similarity against the whole catalog is one matrix-vector product.
+    """
+
+    def __init__(self, song_ids: np.ndarray, embeddings: np.ndarray):
+        self.song_ids = song_ids  # sorted, song_ids[row] = song_id
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        self.embeddings = (embeddings / np.maximum(norms, 1e-10)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.song_ids)
+
+    @classmethod
+    def build(cls, batch_size: int = 4096, chunk_size: int = 2000) -> 'AudioEmbeddingIndex':
+        """Scale and encode the audio features of every song in the database"""
+        import tensorflow as tf
+
+        with open(models_path('scaler.pkl'), 'rb') as f:
+            scaler = pickle.load(f)
+        if scaler.n_features_in_ != len(AUDIO_FEATURES):
+            raise ValueError(
+                f"scaler.pkl expects {scaler.n_features_in_} features, not {len(AUDIO_FEATURES)}"
+            )
+        encoder = tf.keras.models.load_model(models_path('encoder.keras'), compile=False)
+
+        song_ids, features = feature_matrix(audio_feature_rows(Song.objects.all(), chunk_size))
+        if not len(song_ids):
+            return cls(song_ids, np.zeros((0, encoder.output_shape[-1]), dtype=np.float32))
+
+        scaled = scaler.transform(features).astype(np.float32)
+        embeddings = encoder.predict(scaled, batch_size=batch_size, verbose=0)
+        return cls(song_ids, np.asarray(embeddings, dtype=np.float32))
+
+    def rows(self, song_ids: Iterable[int]) -> np.ndarray:
+        """Rows of the given songs, -1 for songs without an embedding"""
+        song_ids = np.asarray(list(song_ids), dtype=np.int64)
+        if not len(self.song_ids):
+            return np.full(len(song_ids), -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.song_ids, song_ids), len(self.song_ids) - 1)
+        return np.where(self.song_ids[rows] == song_ids, rows, -1)
+
+    def query_vector(self, song_ids: Iterable[int]) -> Optional[np.ndarray]:
+        """Normalized mean embedding of the given songs, None if none has one"""
+        rows = self.rows(song_ids)
+        rows = rows[rows >= 0]
+        if not len(rows):
+            return None
+        centroid = self.embeddings[rows].mean(axis=0)
+        norm = np.linalg.norm(centroid)
+        return centroid / norm if norm > 0 else None
+
+    def scores(self, query: np.ndarray, song_ids: Iterable[int]) -> dict:
+        """Cosine similarity of query to each given song that has an embedding"""
+        song_ids = list(song_ids)
+        rows = self.rows(song_ids)
+        found = rows >= 0
+        similarities = self.embeddings[rows[found]] @ query
+        return dict(zip(np.asarray(song_ids)[found].tolist(), similarities.tolist()))
+
+    def top_k(self, query: np.ndarray, n: int, exclude_ids: Iterable[int] = (),
+              candidate_ids: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """
+        Songs most similar to query by cosine similarity.
+
+        Args:
+            query (np.ndarray): Normalized query embedding
+            n (int): Number of songs to return
+            exclude_ids (Iterable[int], optional): Songs left out, usually the query songs
+            candidate_ids (Iterable[int], optional): Restrict the search to these songs
+
+        Returns:
+            List[Tuple[int, float]]: (song_id, similarity), most similar first
+        """
+        if candidate_ids is not None:
+            rows = self.rows(candidate_ids)
+            rows = np.unique(rows[rows >= 0])
+        else:
+            rows = np.arange(len(self.song_ids))
+        if not len(rows):
+            return []
+
+        similarities = self.embeddings[rows] @ query
+        exclude = np.isin(self.song_ids[rows], np.asarray(list(exclude_ids), dtype=np.int64))
+        best = top_k_indices(similarities, n, exclude)
+        return [(int(self.song_ids[rows[i]]), float(similarities[i])) for i in best]
+
+    def save(self, path: str):
+        """Write the index to one .npz file, replacing any previous one atomically"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, song_ids=self.song_ids, embeddings=self.embeddings)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'AudioEmbeddingIndex':
+        with np.load(path) as arrays:
+            return cls(arrays['song_ids'], arrays['embeddings'])
+
+
+class AudioEmbeddingStore(FileStore):
+    """Process-wide access to the persisted audio embedding index"""
+
+    def __init__(self, check_interval: float = 5.0):
+        super().__init__(os.path.join('audio_index', AUDIO_INDEX_FILE), AudioEmbeddingIndex.load, check_interval)
+
+    def rebuild(self, batch_size: int = 4096) -> AudioEmbeddingIndex:
+        """Encode every song from scratch and persist the index"""
+        index = AudioEmbeddingIndex.build(batch_size=batch_size)
+        self.publish(index)
+        return index
+
+
+audio_index_store = AudioEmbeddingStore()
@@ -1,18 +1,15 @@
 import tensorflow as tf
 import numpy as np
-import pandas as pd
-from typing import List, Dict, Tuple, Optional
-from django.db.models import Count
-from recommendations.models import PlaylistRecommendation
 import pickle
+from typing import Tuple
 import os
-from django.conf import settings
-from datetime import datetime, timedelta
-from django.utils import timezone
-from music.models import Playlist, Song
+from .inference_recommender import InferenceRecommender
+from .model_registry import model_registry, export_inference_bundle
+from .quantization import format_report
+from .utils import load_interactions, build_interaction_csr, hold_out_playlists, lookup_indices
 
-class PlaylistRecommender:
-    def __init__(self, n_factors=50, learning_rate=0.001, n_epochs=50, batch_size=128):
+class PlaylistRecommender(InferenceRecommender):
+    def __init__(self, n_factors=50, learning_rate=0.001, n_epochs=50, batch_size=128, precision='float32'):
         """
         Initialize the PlaylistRecommender with hyperparameters for the model.
 
@@ -21,23 +18,30 @@ class PlaylistRecommender:
             learning_rate (float, optional): How fast model learns. Defaults to 0.001.
             n_epochs (int, optional): How many times run trough data. Defaults to 50.
             batch_size (int, optional): Number of examples in 1 iteration. Defaults to 128.
+            precision (str, optional): Storage precision of the exported embeddings. Defaults to 'float32'.
         """
+        super().__init__()
         self.n_factors = n_factors
         self.learning_rate = learning_rate
         self.n_epochs = n_epochs
         self.batch_size = batch_size
+        self.precision = precision
         self.model = None
+        # Training-side lookups; indices follow sorted id order so they match the exported id arrays
         self.playlist_encoder = {}  # {playlist_id: index}
         self.song_encoder = {}      # {song_id: index}
         self.playlist_decoder = {}  # {index: playlist_id}
         self.song_decoder = {}      # {index: song_id}
-        self.model_path = os.path.join(settings.MEDIA_ROOT, 'recommendation_model')
+        self.held_out = []          # song indices of each playlist left out of training, for the quantization report
+        self.model_path = model_registry.base_path
+        self.version_path = None    # directory of the version this model was saved to / loaded from
         os.makedirs(self.model_path, exist_ok=True)
         
         
     def prepare_data(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
-        Prepare playlist-song interaction matrix for training.
+        Prepare playlist-song interaction matrix for training. A sample of
+        playlists is held out for the quantization report, see hold_out_playlists.
 
         Returns:
             Tuple[np.ndarray, np.ndarray, np.ndarray]: Tuple containing:
@@ -46,32 +50,20 @@ class PlaylistRecommender:
                 - ratings: Array of interaction scores (1 for interaction, 0 otherwise).
         """
         
-        playlists = Playlist.objects.prefetch_related('songs').filter(songs__isnull=False).distinct()
-        
-        interactions = []
-        for playlist in playlists:
-            for song in playlist.songs.all():
-                interactions.append({
-                    'playlist_id': playlist.id,
-                    'song_id': song.id,
-                    'rating': 1.0  # Implicit feedback: interaction exists
-                })
-        
-        df = pd.DataFrame(interactions)
-        
-        # Create encoders for playlists and songs
-        unique_playlists = df['playlist_id'].unique()
-        unique_songs = df['song_id'].unique()
+        playlist_ids, self.song_ids, playlist_indices, song_indices = load_interactions()
+        self.playlist_ids, playlist_indices, song_indices, self.held_out = hold_out_playlists(
+            playlist_ids, playlist_indices, song_indices
+        )
+        ratings = np.ones(len(playlist_indices), dtype=np.float32)  # Implicit feedback: interaction exists
+        self.interaction_indptr, self.interaction_indices = build_interaction_csr(
+            playlist_indices, song_indices, len(self.playlist_ids)
+        )
         
-        self.playlist_encoder = {pid: idx for idx, pid in enumerate(unique_playlists)}
-        self.song_encoder = {sid: idx for idx, sid in enumerate(unique_songs)}
-        self.playlist_decoder = {idx: pid for pid, idx in self.playlist_encoder.items()}
-        self.song_decoder = {idx: int(sid) for sid, idx in self.song_encoder.items()}
-
-        # Encode the data
-        playlist_indices = df['playlist_id'].map(self.playlist_encoder).values
-        song_indices = df['song_id'].map(self.song_encoder).values
-        ratings = df['rating'].values
+        # Indices follow sorted id order, so they match the exported id arrays
+        self.playlist_encoder = {int(pid): idx for idx, pid in enumerate(self.playlist_ids)}
+        self.song_encoder = {int(sid): idx for idx, sid in enumerate(self.song_ids)}
+        self.playlist_decoder = {idx: int(pid) for idx, pid in enumerate(self.playlist_ids)}
+        self.song_decoder = {idx: int(sid) for idx, sid in enumerate(self.song_ids)}
         
         return playlist_indices, song_indices, ratings
     
@@ -157,141 +149,117 @@ class PlaylistRecommender:
             verbose=1
         )
         
+        self._extract_factors()
         self.save_model()
         
         return history
         
         
-    def save_model(self):
-        self.model.save(os.path.join(self.model_path, 'model.keras'))
+    def import_legacy_model(self, path: str = None):
+        """
+        Publish a model saved before versioned bundles existed, a
+        model.keras with an encoders.pkl of {id: index} dicts next to it,
+        without retraining. Ids are re-sorted to the bundle layout and the
+        training interactions are rebuilt from the current playlists,
+        limited to playlists and songs the model knows.
+
+        Args:
+            path (str, optional): Directory holding model.keras and encoders.pkl.
+                Defaults to the model base path, where the old trainer saved them.
+        """
+        path = path or self.model_path
+        self.model = tf.keras.models.load_model(os.path.join(path, 'model.keras'))
+        with open(os.path.join(path, 'encoders.pkl'), 'rb') as f:
+            encoders = pickle.load(f)
+        self._extract_factors()
+        
+        playlist_rows = {int(pid): idx for pid, idx in encoders['playlist_encoder'].items()}
+        song_rows = {int(sid): idx for sid, idx in encoders['song_encoder'].items()}
+        self.playlist_ids = np.array(sorted(playlist_rows), dtype=np.int64)
+        self.song_ids = np.array(sorted(song_rows), dtype=np.int64)
+        playlist_order = np.array([playlist_rows[pid] for pid in self.playlist_ids.tolist()], dtype=np.int64)
+        song_order = np.array([song_rows[sid] for sid in self.song_ids.tolist()], dtype=np.int64)
+        self.playlist_factors = self.playlist_factors[playlist_order]
+        self.playlist_biases = self.playlist_biases[playlist_order]
+        self.song_factors = self.song_factors[song_order]
+        self.song_biases = self.song_biases[song_order]
+        
+        db_playlist_ids, db_song_ids, playlist_indices, song_indices = load_interactions()
+        playlist_positions, playlist_found = lookup_indices(self.playlist_ids, db_playlist_ids[playlist_indices])
+        song_positions, song_found = lookup_indices(self.song_ids, db_song_ids[song_indices])
+        known = playlist_found & song_found
+        self.interaction_indptr, self.interaction_indices = build_interaction_csr(
+            playlist_positions[known], song_positions[known], len(self.playlist_ids)
+        )
         
-        with open(os.path.join(self.model_path, 'encoders.pkl'), 'wb') as f:
-            pickle.dump({
-                'playlist_encoder': self.playlist_encoder,
-                'song_encoder': self.song_encoder,
-                'playlist_decoder': self.playlist_decoder,
-                'song_decoder': self.song_decoder
-            }, f)
+        self.save_model()
+    
+    
+    def save_model(self):
+        """
+        Save the Keras model and the NumPy inference bundle (sorted id arrays
+        and factor matrices) into a new version directory, then publish it
+        so web workers switch to it.
+        """
+        version, self.version_path = model_registry.create_version()
+        self.model.save(os.path.join(self.version_path, 'model.keras'))
+        
+        report = export_inference_bundle(
+            self.version_path,
+            playlist_ids=self.playlist_ids,
+            song_ids=self.song_ids,
+            playlist_factors=self.playlist_factors,
+            song_factors=self.song_factors,
+            playlist_biases=self.playlist_biases,
+            song_biases=self.song_biases,
+            interaction_indptr=self.interaction_indptr,
+            interaction_indices=self.interaction_indices,
+            precision=self.precision,
+            held_out=self.held_out,
+            fold_in={'engine': 'keras', 'regularization': self.fold_in_regularization}
+        )
+        print(format_report(report))
+        model_registry.publish(
+            version,
+            engine='keras',
+            n_factors=self.n_factors,
+            precision=self.precision,
+            quantization_report=report
+        )
     
     
     def load_model(self):
         """
-        Load the model and encoders from disk.
+        Load the Keras model and the exported id and factor arrays of the
+        currently published version.
         
         Returns:
             True if loading successful, False if not
         """
+        self.version_path = model_registry.current_version_path()
+        if self.version_path is None:
+            print("No published recommendation model")
+            return False
+        
         try:
-            self.model = tf.keras.models.load_model(os.path.join(self.model_path, 'model.keras'))
-            with open(os.path.join(self.model_path, 'encoders.pkl'), 'rb') as f:
-                encoders = pickle.load(f)
-                self.playlist_encoder = encoders['playlist_encoder']
-                self.song_encoder = encoders['song_encoder']
-                self.playlist_decoder = encoders['playlist_decoder']
-                self.song_decoder = encoders['song_decoder']
-            return True
+            self.model = tf.keras.models.load_model(os.path.join(self.version_path, 'model.keras'))
         except Exception as e:
             print(f"Error loading model: {e}")
             return False
+        return super().load_model()
     
     
-    def get_playlist_embedding(self, playlist_id: int) -> Optional[np.ndarray]:
-        """
-        Get the embedding vector for a specific playlist.
-
-        Args:
-            playlist_id (int): ID of the playlist
-
-        Returns:
-            np.ndarray: Embedding vector for the playlist, None if not found
-        """
-        if playlist_id in self.playlist_encoder:
-            index = self.playlist_encoder[playlist_id]
-            return self.model.get_layer('playlist_embedding').get_weights()[0][index]
-        return None
-    
-    def recommend_for_playlist(self, playlist_id: int, n_recommendations: int=10) -> List[Tuple[int, float]]:
-        """
-        Generate song recommendations for playlist with playlist_id
-
-        Args:
-            playlist_id (int): ID of the playlist
-            n_recommendations (int, optional): Number of recommendations to return. Defaults to 10
-
-        Returns:
-            List[Tuple[int, float]]:
-                List of tuples containing song IDs and their scores
-        """
-        
-        if not self.model:
-            if not self.load_model():
-                print("NEMA MODELA")
-                return []
-        
-        if playlist_id not in self.playlist_encoder:
-            print(f"Playlist {playlist_id} not in training data")
-            return []
-        
-        playlist_idx = self.playlist_encoder[playlist_id]
-        playlist = Playlist.objects.get(id=playlist_id)
-        existing_songs_ids = set(playlist.songs.values_list('id', flat=True))
-        
-        # Get predscitons for all songs
-        all_songs_indices = np.array(list(range(len(self.song_encoder))))
-        playlist_indices = np.full_like(all_songs_indices, playlist_idx)
-        
-        predictions = self.model.predict([playlist_indices, all_songs_indices], batch_size=1024)
-        predictions = predictions.flatten()
-        
-        # Sort by score and filter out existing songs
-        song_scores = []
-        for song_idx, score in enumerate(predictions):
-            if song_idx in self.song_decoder:
-                song_id = self.song_decoder[song_idx]
-                if song_id not in existing_songs_ids:
-                    song_scores.append((song_id, float(score)))
-                    
-        song_scores.sort(key=lambda x: x[1], reverse=True)
-        return song_scores[:n_recommendations]
+    def ensure_model(self) -> bool:
+        """Use the trained or loaded model as is, only load from disk if there is none"""
+        return self.playlist_factors is not None or self.load_model()
     
     
-    def update_playlist_recommendations(self, playlist_id: int, n_recommendations: int=10):
+    def _extract_factors(self):
         """
-        Update recommendations for a specific playlist
-
-        Args:
-            playlist_id (int): ID of the playlist
-            n_recommendations (int, optional): Number of recommendations to generate
+        Pull embedding and bias matrices out of the Keras model once,
+        so recommendations can be scored with plain NumPy.
         """
-        recommendations = self.recommend_for_playlist(playlist_id, n_recommendations)
-        
-        if not recommendations:
-            return
-        
-        PlaylistRecommendation.objects.filter(playlist_id=playlist_id).delete()
-        
-        for song_id, score in recommendations:
-            try:  
-                PlaylistRecommendation.objects.create(
-                    playlist_id=playlist_id,
-                    song_id=song_id,
-                    score=score,
-                    created_at=timezone.now()
-                )
-            except Song.DoesNotExist:
-                print(f"Song with ID {song_id} does not exist")
-                continue
-    
-    
-    def update_all_recommendations(self, n_recommendations: int=10):
-        """
-        Update recommendations for all playlists in the database.
-
-        Args:
-            n_recommendations (int, optional): Number of recommendations to generate for each playlist
-        """
-        playlists = Playlist.objects.all()
-        
-        for playlist in playlists:
-            self.update_playlist_recommendations(playlist.id, n_recommendations)
-            print(f"Updated recommendations for playlist {playlist.id}")
\ No newline at end of file
+        self.playlist_factors = self.model.get_layer('playlist_embedding').get_weights()[0]
+        self.song_factors = self.model.get_layer('song_embedding').get_weights()[0]
+        self.playlist_biases = self.model.get_layer('playlist_bias').get_weights()[0].ravel()
+        self.song_biases = self.model.get_layer('song_bias').get_weights()[0].ravel()
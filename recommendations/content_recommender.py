@@ -1,16 +1,19 @@
 import numpy as np
 from typing import List, Dict, Tuple, Optional
 from collections import defaultdict
-from django.db.models import Q, Count
-from django.utils import timezone
+from django.db.models import Q, Count, Sum, Case, When, Value, F, FloatField
+from django.db.models.functions import Cast, Greatest, Least
 from music.models import Song, Playlist
+from music.utils import song_match_key, resolve_match_keys
+from .models import PlaylistTagProfile, SongNeighbor, PROFILE_MIN_TAG_WEIGHT
+from .tag_matrix import TagMatrix, tag_matrix_store
+from .context import RecommendationContext
+from .utils import top_k_indices
 from spotify.utils import get_track_audio_features
 from lastfm.utils import (
     lastfm_api, 
     get_track_tags_with_weights, 
-    calculate_tag_similarity,
-    enrich_song_with_lastfm_data,
-    batch_enrich_songs_with_lastfm
+    calculate_tag_similarity
 )
 import logging
 
@@ -20,7 +23,10 @@ logger = logging.getLogger(__name__)
 class LastFMContentRecommender:
     
     def __init__(self):
-        self.min_tag_weight = 0.3
+        self.min_tag_weight = PROFILE_MIN_TAG_WEIGHT
+        self.max_postings_per_tag = 5000  # Posting list entries read per profile tag at most
+        self.posting_block = 256           # Posting list entries read per tag in the first round, doubled every round
+        self.lastfm_deadline = 3.0         # Seconds find_similar_by_lastfm_api waits for Last.fm
         self.tag_boost_factors = {
             'rock': 1.2,
             'pop': 1.1,
@@ -34,49 +40,25 @@ class LastFMContentRecommender:
             'folk': 1.3
         }
     
-    def ensure_song_has_tags(self, song: Song) -> bool:
-        if not song.lastfm_tags or (song.lastfm_updated and (timezone.now() - song.lastfm_updated).days > 30):
-            return enrich_song_with_lastfm_data(song)
-        return bool(song.lastfm_tags)
-    
-    def get_playlist_tag_profile(self, playlist: Playlist) -> Dict[str, float]:
-        """Calculate aggregated tag profile for a playlist"""
-        songs = list(playlist.songs.all())
-        if not songs:
-            return {}
-        
-        songs_with_tags = []
-        for song in songs:
-            if self.ensure_song_has_tags(song) and song.lastfm_tags:
-                songs_with_tags.append(song)
-        
-        if not songs_with_tags:
+    def get_playlist_tag_profile(self, playlist: Playlist, context: Optional[RecommendationContext] = None) -> Dict[str, float]:
+        """
+        Aggregated tag profile for a playlist, derived from the running tag
+        sums kept by the Playlist.songs signals. Only reads what is stored;
+        untagged and stale songs are queued by the signals and the
+        enrichment worker.
+        """
+        if context is not None:
+            return context.memo('tag_profile', lambda: self.get_playlist_tag_profile(playlist))
+        
+        profile = PlaylistTagProfile.objects.filter(playlist=playlist).first()
+        if profile is None:
+            profile = PlaylistTagProfile.build(playlist.id)
+        
+        if not profile.n_songs_with_tags:
             logger.warning(f"No songs with tags in playlist {playlist.id}")
             return {}
         
-        tag_scores = defaultdict(float)
-        tag_counts = defaultdict(int)
-        
-        for song in songs_with_tags:
-            for tag, weight in song.lastfm_tags.items():
-                if weight >= self.min_tag_weight:
-                    tag_scores[tag] += weight
-                    tag_counts[tag] += 1
-        
-        avg_tag_profile = {}
-        for tag, total_score in tag_scores.items():
-            avg_weight = total_score / len(songs_with_tags)
-            
-            frequency_boost = min(tag_counts[tag] / len(songs_with_tags), 1.0)
-            avg_tag_profile[tag] = avg_weight * (0.7 + 0.3 * frequency_boost)
-        
-        total_weight = sum(avg_tag_profile.values())
-        if total_weight > 0:
-            avg_tag_profile = {tag: weight/total_weight 
-                              for tag, weight in avg_tag_profile.items()}
-        
-        return dict(sorted(avg_tag_profile.items(), 
-                          key=lambda x: x[1], reverse=True)[:20])
+        return profile.profile(top_n=20)
     
     def calculate_song_playlist_similarity(self, song: Song, playlist_profile: Dict[str, float]) -> float:
         if not song.lastfm_tags or not playlist_profile:
@@ -100,60 +82,243 @@ class LastFMContentRecommender:
         
         return min(similarity, 1.0)
     
-    def recommend_by_tags(self, playlist: Playlist, n_recommendations: int = 20) -> List[Tuple[Song, float]]:
+    def _profile_columns(self, matrix: TagMatrix, playlist_profile: Dict[str, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """Matrix columns of the profile tags known to the matrix, and their profile weights"""
+        columns = [(matrix.tag_columns[tag], weight) for tag, weight in playlist_profile.items() if tag in matrix.tag_columns]
+        return (
+            np.asarray([c for c, _ in columns], dtype=np.int64),
+            np.asarray([w for _, w in columns], dtype=np.float32)
+        )
+    
+    def _tag_similarity(self, rows: np.ndarray, song_weights: np.ndarray, playlist_weights: np.ndarray,
+                        tag_boosts: np.ndarray, n_rows: int) -> np.ndarray:
+        """
+        Vectorized calculate_song_playlist_similarity from one entry per
+        (song, profile tag) pair the song is tagged with.
+        """
+        tag_similarity = np.minimum(song_weights, playlist_weights) / np.maximum(np.maximum(song_weights, playlist_weights), 1e-10)
+        similarity = np.bincount(rows, weights=tag_similarity * playlist_weights * tag_boosts, minlength=n_rows)
+        matched_tags = np.bincount(rows, minlength=n_rows)
+        
+        similarity[matched_tags < 2] *= 0.5
+        return np.minimum(similarity, 1.0)
+    
+    def score_tag_matrix(self, matrix: TagMatrix, playlist_profile: Dict[str, float]) -> np.ndarray:
+        """
+        calculate_song_playlist_similarity for every row of the tag matrix.
+        Only the posting lists of the profile's tags are read.
+        """
+        column_ids, weights = self._profile_columns(matrix, playlist_profile)
+        if not len(column_ids):
+            return np.zeros(len(matrix), dtype=np.float32)
+        
+        lengths = matrix.posting_indptr[column_ids + 1] - matrix.posting_indptr[column_ids]
+        postings = [matrix.posting_list(c) for c in column_ids]
+        return self._tag_similarity(
+            np.concatenate([rows for rows, _ in postings]),
+            np.concatenate([song_weights for _, song_weights in postings]),
+            np.repeat(weights, lengths),
+            np.repeat(matrix.boost_vector(self.tag_boost_factors)[column_ids], lengths),
+            len(matrix)
+        )
+    
+    def score_tag_rows(self, matrix: TagMatrix, rows: np.ndarray, playlist_profile: Dict[str, float]) -> np.ndarray:
+        """calculate_song_playlist_similarity for the given rows of the tag matrix, read row-wise"""
+        column_ids, weights = self._profile_columns(matrix, playlist_profile)
+        profile_weights = np.zeros(matrix.weights.shape[1], dtype=np.float32)
+        profile_weights[column_ids] = weights
+        
+        sub = matrix.weights[rows]
+        entry_rows = np.repeat(np.arange(len(rows)), np.diff(sub.indptr))
+        in_profile = profile_weights[sub.indices] > 0
+        return self._tag_similarity(
+            entry_rows[in_profile],
+            sub.data[in_profile],
+            profile_weights[sub.indices[in_profile]],
+            matrix.boost_vector(self.tag_boost_factors)[sub.indices[in_profile]],
+            len(rows)
+        )
+    
+    def _final_tag_scores(self, matrix: TagMatrix, rows: np.ndarray, similarity: np.ndarray,
+                          artist_mask: np.ndarray) -> np.ndarray:
+        """Artist bonus and popularity blend of recommend_by_tags for the given rows"""
+        similarity = np.where(artist_mask[rows], similarity * 1.15, similarity)
+        
+        # Consider popularity (normalize to 0-1 by 1M listeners), slight penalty for unknown popularity
+        listeners = matrix.listeners[rows]
+        popularity_score = np.minimum(listeners / 1000000, 1.0)
+        return np.where(listeners > 0, similarity * 0.8 + popularity_score * 0.2, similarity * 0.9)
+    
+    def retrieve_by_tags(self, matrix: TagMatrix, playlist_profile: Dict[str, float], exclude: np.ndarray,
+                         artist_mask: np.ndarray, n_recommendations: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top rows of the tag matrix for a profile, read from the posting lists
+        of the profile's tags with early termination.
+        
+        Every round takes the next block of each posting list and scores the
+        rows seen for the first time exactly. Lists are sorted by weight, so
+        an unseen song has weight at most cursor weight c in list t and can
+        gain at most boost * min(c, p) from it. Retrieval stops once the
+        k-th best score beats that bound. Lists are cut at
+        max_postings_per_tag entries.
+        
+        Args:
+            matrix (TagMatrix): Tag matrix
+            playlist_profile (Dict[str, float]): Profile from get_playlist_tag_profile
+            exclude (np.ndarray): Rows that must not be recommended
+            artist_mask (np.ndarray): Rows by artists already in the playlist
+            n_recommendations (int): Number of rows to return
+        
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Rows and scores, best first, all above the 0.3 threshold
+        """
+        column_ids, weights = self._profile_columns(matrix, playlist_profile)
+        boosts = matrix.boost_vector(self.tag_boost_factors)[column_ids]
+        postings = [matrix.posting_list(c) for c in column_ids]
+        ends = np.asarray([min(len(rows), self.max_postings_per_tag) for rows, _ in postings], dtype=np.int64)
+        cursors = np.zeros(len(column_ids), dtype=np.int64)
+        
+        seen = exclude.copy()
+        best_rows = np.array([], dtype=np.int64)
+        best_scores = np.array([], dtype=np.float64)
+        max_popularity = min(float(matrix.listeners.max(initial=0)) / 1000000, 1.0)
+        max_artist_bonus = 1.15 if artist_mask.any() else 1.0
+        block = self.posting_block
+        
+        while np.any(cursors < ends):
+            rows = np.unique(np.concatenate([
+                posting_rows[cursor:min(cursor + block, end)]
+                for (posting_rows, _), cursor, end in zip(postings, cursors, ends)
+            ]))
+            cursors = np.minimum(cursors + block, ends)
+            block *= 2
+            
+            rows = rows[~seen[rows]]
+            seen[rows] = True
+            if len(rows):
+                scores = self._final_tag_scores(matrix, rows, self.score_tag_rows(matrix, rows, playlist_profile), artist_mask)
+                keep = scores > 0.3  # Minimum threshold
+                best_rows = np.concatenate([best_rows, rows[keep]])
+                best_scores = np.concatenate([best_scores, scores[keep]])
+                top = top_k_indices(best_scores, n_recommendations)
+                best_rows, best_scores = best_rows[top], best_scores[top]
+            
+            # Best score any unseen song could still reach
+            next_weights = np.asarray([
+                song_weights[cursor] if cursor < end else 0.0
+                for (_, song_weights), cursor, end in zip(postings, cursors, ends)
+            ], dtype=np.float32)
+            bound = min(float(np.sum(boosts * np.minimum(next_weights, weights))), 1.0) * max_artist_bonus
+            bound = max(bound * 0.8 + max_popularity * 0.2, bound * 0.9)
+            if bound <= 0.3 or (len(best_rows) >= n_recommendations and best_scores[-1] >= bound):
+                break
+        
+        return best_rows, best_scores
+    
+    def recommend_by_tags(self, playlist: Playlist, n_recommendations: int = 20,
+                          context: Optional[RecommendationContext] = None) -> List[Tuple[Song, float]]:
         logger.info(f"Generating tag-based recommendations for playlist {playlist.id}")
         
-        playlist_profile = self.get_playlist_tag_profile(playlist)
+        context = context or RecommendationContext(playlist)
+        playlist_profile = self.get_playlist_tag_profile(playlist, context)
         if not playlist_profile:
             logger.warning(f"Could not generate tag profile for playlist {playlist.id}")
             return []
         
         logger.info(f"Playlist tag profile: {list(playlist_profile.items())[:5]}")
         
-        existing_song_ids = set(playlist.songs.values_list('id', flat=True))
-        existing_artists = set(playlist.songs.values_list('artist', flat=True))
+        existing_song_ids = context.existing_ids
+        existing_artists = context.existing_artists
         
-        candidates = Song.objects.exclude(
-            id__in=existing_song_ids
-        ).exclude(
-            lastfm_tags={}
-        )[:2000]
+        matrix = tag_matrix_store.get()
+        if matrix is None:
+            return self._recommend_by_tags_sql(playlist_profile, existing_song_ids, existing_artists, n_recommendations)
         
-        recommendations = []
+        rows, scores = self.retrieve_by_tags(
+            matrix,
+            playlist_profile,
+            exclude=np.isin(matrix.song_ids, list(existing_song_ids)),
+            artist_mask=matrix.artist_mask(existing_artists),
+            n_recommendations=n_recommendations
+        )
+        songs = Song.objects.in_bulk(matrix.song_ids[rows].tolist())
+        return [
+            (songs[song_id], float(score))
+            for song_id, score in zip(matrix.song_ids[rows].tolist(), scores)
+            if song_id in songs
+        ]
+    
+    def _recommend_by_tags_sql(self, playlist_profile: Dict[str, float], existing_song_ids: set,
+                               existing_artists: set, n_recommendations: int) -> List[Tuple[Song, float]]:
+        """
+        recommend_by_tags as one aggregate over the SongTag (tag, weight)
+        index, used until the tag matrix has been built.
+        """
+        tag_similarity = Sum(
+            Case(
+                *[
+                    When(
+                        song_tags__tag__name=tag,
+                        then=Value(playlist_weight * self.tag_boost_factors.get(tag, 1.0))
+                        * Least(F('song_tags__weight'), Value(playlist_weight))
+                        / Greatest(F('song_tags__weight'), Value(playlist_weight))
+                    )
+                    for tag, playlist_weight in playlist_profile.items()
+                ],
+                default=Value(0.0)
+            ),
+            output_field=FloatField()
+        )
         
-        for song in candidates:
-            if not self.ensure_song_has_tags(song):
-                continue
-                
-            similarity = self.calculate_song_playlist_similarity(song, playlist_profile)
-            
-            if song.artist in existing_artists:
-                similarity *= 1.15
-            
-            # Consider popularity (normalize to 0-1)
-            if song.lastfm_listeners:
-                popularity_score = min(song.lastfm_listeners / 1000000, 1.0)  # Normalize by 1M listeners
-                # Blend similarity and popularity
-                final_score = similarity * 0.8 + popularity_score * 0.2
-            else:
-                final_score = similarity * 0.9  # Slight penalty for unknown popularity
-            
-            if final_score > 0.3:  # Minimum threshold
-                recommendations.append((song, final_score))
+        candidates = Song.objects.filter(
+            song_tags__tag__name__in=list(playlist_profile)
+        ).exclude(
+            id__in=existing_song_ids
+        ).annotate(
+            raw_similarity=tag_similarity,
+            matched_tags=Count('song_tags')
+        ).annotate(
+            similarity=Least(
+                Case(When(matched_tags__lt=2, then=F('raw_similarity') * 0.5), default=F('raw_similarity')),
+                Value(1.0)
+            )
+        ).annotate(
+            artist_similarity=Case(
+                When(artist__in=existing_artists, then=F('similarity') * 1.15),
+                default=F('similarity')
+            )
+        ).annotate(
+            # Blend with popularity normalized by 1M listeners, slight penalty for unknown popularity
+            final_score=Case(
+                When(
+                    lastfm_listeners__gt=0,
+                    then=F('artist_similarity') * 0.8
+                    + Least(Cast('lastfm_listeners', FloatField()) / 1000000.0, Value(1.0)) * 0.2
+                ),
+                default=F('artist_similarity') * 0.9,
+                output_field=FloatField()
+            )
+        ).filter(
+            final_score__gt=0.3  # Minimum threshold
+        ).order_by('-final_score')[:n_recommendations]
         
-        recommendations.sort(key=lambda x: x[1], reverse=True)
-        return recommendations[:n_recommendations]
+        return [(song, song.final_score) for song in candidates]
     
-    def find_similar_by_lastfm_api(self, playlist: Playlist, n_recommendations: int = 20) -> List[Tuple[Song, float]]:
-        songs = list(playlist.songs.all())
+    def find_similar_by_lastfm_api(self, playlist: Playlist, n_recommendations: int = 20,
+                                   context: Optional[RecommendationContext] = None) -> List[Tuple[Song, float]]:
+        context = context or RecommendationContext(playlist)
+        songs = context.songs
         if not songs:
             return []
         
-        existing_song_ids = set(playlist.songs.values_list('id', flat=True))
+        existing_song_ids = context.existing_ids
         similar_tracks_data = defaultdict(float)
         
-        for song in songs[:10]:
-            similar_tracks = lastfm_api.get_similar_tracks(song.artist, song.name, limit=30)
+        pairs = [(song.artist, song.name) for song in songs[:10]]
+        similar_by_pair = lastfm_api.get_similar_tracks_many(pairs, limit=30, timeout=self.lastfm_deadline)
+        
+        for pair in pairs:
+            similar_tracks = similar_by_pair.get(pair, [])
             
             for i, similar in enumerate(similar_tracks):
                 if not similar or not isinstance(similar, dict):
@@ -169,24 +334,24 @@ class LastFMContentRecommender:
                 position_score = 1.0 - (i / len(similar_tracks))
                 match_score = float(similar.get('match', 0))
                 
-                key = (artist.lower(), track_name.lower())
+                key = song_match_key(artist, track_name)
                 similar_tracks_data[key] += position_score * match_score
         
-        # Find these tracks in our database
+        # Find these tracks in our database, all keys in one indexed query
+        ids_by_key = {
+            key: [song_id for song_id in ids if song_id not in existing_song_ids]
+            for key, ids in resolve_match_keys(similar_tracks_data).items()
+        }
+        songs_by_id = Song.objects.in_bulk([ids[0] for ids in ids_by_key.values() if ids])
+        
         recommendations = []
         
-        for (artist, track_name), score in similar_tracks_data.items():
-            # Try to find the song in our database
-            songs = Song.objects.filter(
-                artist__iexact=artist,
-                name__iexact=track_name
-            ).exclude(id__in=existing_song_ids)
-            
-            if songs.exists():
-                song = songs.first()
+        for key, score in similar_tracks_data.items():
+            ids = ids_by_key.get(key)
+            if ids and ids[0] in songs_by_id:
                 # Normalize score
-                normalized_score = min(score / len(songs), 1.0)
-                recommendations.append((song, normalized_score))
+                normalized_score = min(score / len(ids), 1.0)
+                recommendations.append((songs_by_id[ids[0]], normalized_score))
         
         recommendations.sort(key=lambda x: x[1], reverse=True)
         return recommendations[:n_recommendations]
@@ -194,8 +359,9 @@ class LastFMContentRecommender:
     def get_diverse_recommendations(self, playlist: Playlist, n_recommendations: int = 20) -> List[Tuple[Song, float]]:
         """Combine tag-based and API-based recommendations for diversity"""
         # Get recommendations from both methods
-        tag_recs = self.recommend_by_tags(playlist, n_recommendations)
-        api_recs = self.find_similar_by_lastfm_api(playlist, n_recommendations)
+        context = RecommendationContext(playlist)
+        tag_recs = self.recommend_by_tags(playlist, n_recommendations, context)
+        api_recs = self.find_similar_by_lastfm_api(playlist, n_recommendations, context)
         
         # Combine with weights
         combined = {}
@@ -219,6 +385,11 @@ class LastFMContentRecommender:
         
         return recommendations[:n_recommendations]
     
+    def similar_songs(self, song: Song, n_recommendations: int = 10) -> List[Tuple[Song, float]]:
+        """Most similar songs by tags, read from the precomputed neighbour table"""
+        neighbors = SongNeighbor.objects.filter(song=song).select_related('neighbor')[:n_recommendations]
+        return [(neighbor.neighbor, neighbor.similarity) for neighbor in neighbors]
+    
     def explain_recommendation(self, song: Song, playlist: Playlist) -> Dict[str, any]:
         """Explain why a song was recommended"""
         playlist_profile = self.get_playlist_tag_profile(playlist)
@@ -248,19 +419,35 @@ class LastFMContentRecommender:
         playlist_artists = set(playlist.songs.values_list('artist', flat=True))
         explanation['artist_in_playlist'] = song.artist in playlist_artists
         
-        # Find which songs in playlist are most similar
-        playlist_songs = playlist.songs.all()
-        for playlist_song in playlist_songs:
-            if playlist_song.lastfm_tags:
-                similarity = calculate_tag_similarity(
-                    song.lastfm_tags or {},
-                    playlist_song.lastfm_tags
-                )
-                if similarity > 0.5:
-                    explanation['similar_to_songs'].append({
-                        'song': f"{playlist_song.name} - {playlist_song.artist}",
-                        'similarity': similarity
-                    })
+        # Find which songs in playlist are most similar, from the precomputed neighbours when available
+        neighbors = SongNeighbor.objects.filter(
+            Q(song=song, neighbor__playlists=playlist) | Q(neighbor=song, song__playlists=playlist),
+            similarity__gt=0.5
+        ).select_related('song', 'neighbor').distinct()
+        if SongNeighbor.objects.filter(song=song).exists():
+            # Mutual neighbours match in both directions, keep each playlist song once
+            best = {}
+            for neighbor in neighbors:
+                playlist_song = neighbor.neighbor if neighbor.song_id == song.id else neighbor.song
+                if playlist_song.id not in best or neighbor.similarity > best[playlist_song.id][1]:
+                    best[playlist_song.id] = (playlist_song, neighbor.similarity)
+            for playlist_song, similarity in best.values():
+                explanation['similar_to_songs'].append({
+                    'song': f"{playlist_song.name} - {playlist_song.artist}",
+                    'similarity': similarity
+                })
+        else:
+            for playlist_song in playlist.songs.all():
+                if playlist_song.lastfm_tags:
+                    similarity = calculate_tag_similarity(
+                        song.lastfm_tags or {},
+                        playlist_song.lastfm_tags
+                    )
+                    if similarity > 0.5:
+                        explanation['similar_to_songs'].append({
+                            'song': f"{playlist_song.name} - {playlist_song.artist}",
+                            'similarity': similarity
+                        })
         
         explanation['similar_to_songs'].sort(
             key=lambda x: x['similarity'], 
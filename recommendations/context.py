@@ -0,0 +1,41 @@
+from typing import Any, Callable, Dict, Hashable, List, Set
+from music.models import Playlist, Song
+
+
+class RecommendationContext:
+    """
+    Playlist data and component results shared by everything that runs
+    for one recommendation request. Each value is computed on first use
+    and reused afterwards, so candidate generation and scoring run every
+    component once. Not meant to outlive the request.
+    """
+
+    def __init__(self, playlist: Playlist):
+        self.playlist = playlist
+        self.degraded: Set[str] = set()  # Components that failed or missed their deadline
+        self._values: Dict[Hashable, Any] = {}
+
+    def memo(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Value stored under key, computing it on first use"""
+        if key not in self._values:
+            self._values[key] = compute()
+        return self._values[key]
+
+    def set(self, key: Hashable, value: Any):
+        """Store a value computed elsewhere, e.g. in a worker thread"""
+        self._values[key] = value
+
+    @property
+    def songs(self) -> List[Song]:
+        """Songs of the playlist"""
+        return self.memo('songs', lambda: list(self.playlist.songs.all()))
+
+    @property
+    def existing_ids(self) -> Set[int]:
+        """IDs of the playlist's songs"""
+        return self.memo('existing_ids', lambda: {song.id for song in self.songs})
+
+    @property
+    def existing_artists(self) -> Set[str]:
+        """Artists of the playlist's songs"""
+        return self.memo('existing_artists', lambda: {song.artist for song in self.songs})
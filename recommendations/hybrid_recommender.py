@@ -1,48 +1,181 @@
 import numpy as np
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from typing import List, Tuple, Dict, Optional
-from django.db.models import Q, Count, Avg
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q, Count, Avg, prefetch_related_objects
 from music.models import Song, Playlist
-from .models import PlaylistRecommendation, HybridRecommendation
-from .collaborative_recommender import PlaylistRecommender
+from music.utils import BoundedExecutor, ExecutorSaturated
+from .models import PlaylistRecommendation, HybridRecommendation, RecommendationSnapshot
+from .model_registry import model_registry
+from .inference_recommender import InferenceRecommender
 from .content_recommender import LastFMContentRecommender
+from .audio_embeddings import audio_index_store
+from .context import RecommendationContext
+from .utils import top_k_rows
 from datetime import datetime
 from django.utils import timezone
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Components that rank songs for the playlist, run concurrently by recommend_hybrid
+RANKED_COMPONENTS = ('collaborative', 'content_tags', 'content_similar')
+# Columns of the component score matrix, rows of the strategy weight matrix
+COMPONENTS = ('collaborative', 'content_tags', 'content_similar', 'content_audio', 'popularity')
+# HybridRecommendation fields written by update_hybrid_recommendations_strategies
+RECOMMENDATION_FIELDS = (
+    'hybrid_score', 'collaborative_score', 'content_audio_score',
+    'content_mood_score', 'popularity_score', 'explanation',
+)
+
+# Components beyond this many running or waiting are degraded instead of queued
+HYBRID_MAX_WORKERS = 8
+HYBRID_MAX_QUEUED = 16
+_executor = BoundedExecutor(HYBRID_MAX_WORKERS, HYBRID_MAX_QUEUED, thread_name_prefix='hybrid')
+
+
+def _run_in_worker(func, *args):
+    """Run func on an executor thread, releasing the thread's stale database connections"""
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def current_model_version() -> str:
+    """Collaborative model version recorded on recommendation snapshots, '' if none is published"""
+    model = model_registry.get()
+    return model.version if model is not None else ''
+
+
 class HybridRecommender:
     def __init__(self):
-        self.collaborative_recommender = PlaylistRecommender()
+        self.collaborative_recommender = InferenceRecommender()
         self.content_recommender = LastFMContentRecommender()
         
         self.strategies = {
             'balanced' : {
-                'collaborative': 0.4,
-                'content_tags': 0.3,
-                'content_similar': 0.2,
+                'collaborative': 0.35,
+                'content_tags': 0.25,
+                'content_similar': 0.15,
+                'content_audio': 0.15,
                 'popularity': 0.1
             },
             'discovery': {
-                'collaborative': 0.2,
-                'content_tags': 0.5,
-                'content_similar': 0.2,
+                'collaborative': 0.15,
+                'content_tags': 0.4,
+                'content_similar': 0.15,
+                'content_audio': 0.2,
                 'popularity': 0.1
             },
             'popular':{
                 'collaborative': 0.1,
-                'content_tags': 0.2,
+                'content_tags': 0.15,
                 'content_similar': 0.1,
+                'content_audio': 0.05,
                 'popularity': 0.6
+            },
+            'similarity': {
+                'collaborative': 0.2,
+                'content_tags': 0.3,
+                'content_similar': 0.2,
+                'content_audio': 0.25,
+                'popularity': 0.05
             }
         }
         
-    def get_collaborative_scores(self, playlist_id: int, song_ids: List[int]) -> Dict[int, float]:
+        # Ranked outputs are computed once per request at candidate_pool_factor * n_recommendations,
+        # enough for both candidate generation and scoring every candidate
+        self.candidate_pool_factor = 6
+        
+        # Seconds recommend_hybrid waits for each ranked component before scoring it neutrally
+        self.component_deadlines = {
+            'collaborative': 2.0,
+            'content_tags': 2.0,
+            'content_similar': 4.0,
+            **settings.RECOMMENDATION_SETTINGS.get('COMPONENT_DEADLINES', {})
+        }
+        
+    def _compute_ranked(self, context: RecommendationContext, component: str, n: int) -> List[Tuple]:
+        playlist = context.playlist
+        if component == 'collaborative':
+            if not self.collaborative_recommender.load_model():
+                return []
+            try:
+                return self.collaborative_recommender.recommend_for_playlist(playlist.id, n_recommendations=n)
+            except Exception as e:
+                logger.error(f"Error in collaborative filtering for playlist {playlist.id}: {e}")
+                return []
+        if component == 'content_tags':
+            return self.content_recommender.recommend_by_tags(playlist, n, context=context)
+        if component == 'content_similar':
+            return self.content_recommender.find_similar_by_lastfm_api(playlist, n, context=context)
+        raise ValueError(f"Unknown ranked component {component}")
+    
+    def _ranked(self, context: RecommendationContext, component: str, n: int) -> List[Tuple]:
+        """
+        Ranked output of a component for the context's playlist, best first,
+        with at least n entries when the component has that many. Shared by
+        candidate generation and scoring for the rest of the request, and
+        recomputed only when more entries are asked for than were computed.
+        Degraded components stay empty.
+        """
+        key = ('ranked', component)
+        computed_n, ranked = context.memo(key, lambda: (n, self._compute_ranked(context, component, n)))
+        # A list shorter than asked for already holds everything the component has
+        if n > computed_n and len(ranked) >= computed_n and component not in context.degraded:
+            ranked = self._compute_ranked(context, component, n)
+            context.set(key, (n, ranked))
+        return ranked
+    
+    def _run_ranked_components(self, context: RecommendationContext, n: int):
+        """
+        Compute every ranked component concurrently on the shared executor.
+        A component that fails, misses its deadline or finds the executor
+        saturated ranks nothing for the rest of the request and is added to
+        context.degraded.
+        """
+        # Read in this thread so the workers share them instead of racing to load them
+        context.existing_ids
+        context.existing_artists
+        
+        start = time.monotonic()
+        futures = {}
+        for component in RANKED_COMPONENTS:
+            try:
+                futures[component] = _executor.submit(_run_in_worker, self._compute_ranked, context, component, n)
+            except ExecutorSaturated:
+                logger.warning(f"Executor saturated, skipping {component} for playlist {context.playlist.id}")
+                futures[component] = None
+        
+        for component, future in futures.items():
+            remaining = start + self.component_deadlines.get(component, 2.0) - time.monotonic()
+            try:
+                ranked = future.result(timeout=max(remaining, 0)) if future is not None else None
+            except FutureTimeoutError:
+                future.cancel()
+                logger.warning(f"{component} missed its deadline for playlist {context.playlist.id}")
+                ranked = None
+            except Exception as e:
+                logger.error(f"Error in {component} for playlist {context.playlist.id}: {e}")
+                ranked = None
+            
+            if ranked is None:
+                context.degraded.add(component)
+                ranked = []
+            context.set(('ranked', component), (n, ranked))
+        
+    def get_collaborative_scores(self, playlist_id: int, song_ids: List[int],
+                                 context: Optional[RecommendationContext] = None) -> Dict[int, float]:
         """Get collaborative filtering scores for specified songs
 
         Args:
             playlist_id (int): The ID of the playlist.
             song_ids (List[int]): A list of song IDs to get scores for.
+            context (RecommendationContext, optional): Request context to share the model's ranking through.
 
         Returns:
             Dict[int, float]: A dictionary mapping song IDs to their collaborative scores.
@@ -59,17 +192,11 @@ class HybridRecommender:
             scores[rec['song_id']] = rec['score']
             
         missing_ids = set(song_ids) - set(scores.keys())
-        if missing_ids and self.collaborative_recommender.load_model():
-            try:
-                cf_scores = self.collaborative_recommender.recommend_for_playlist(
-                    playlist_id=playlist_id,
-                    n_recommendations=len(missing_ids) + 10,
-                )
-                for song_id, score in cf_scores:
-                    if song_id in missing_ids:
-                        scores[song_id] = score
-            except Exception as e:
-                logger.error(f"Error in collaborative filtering for playlist {playlist_id}: {e}")
+        if missing_ids:
+            context = context or RecommendationContext(Playlist(id=playlist_id))
+            for song_id, score in self._ranked(context, 'collaborative', len(missing_ids) + 10):
+                if song_id in missing_ids:
+                    scores[song_id] = score
         
         if scores:
             max_score = max(scores.values())
@@ -79,26 +206,27 @@ class HybridRecommender:
         return scores
     
  
-    def get_content_tag_scores(self, playlist: Playlist, songs: List[Song]) -> Dict[int, float]:
+    def get_content_tag_scores(self, playlist: Playlist, songs: List[Song],
+                               context: Optional[RecommendationContext] = None) -> Dict[int, float]:
         """
         Get Last.fm tag-based filtering scores for specified songs
 
         Args:
             playlist (Playlist): The playlist for which to get tag scores.
             songs (List[Song]): The list of songs to get scores for.
+            context (RecommendationContext, optional): Request context to share the tag ranking through.
 
         Returns:
             Dict[int, float]: A dictionary mapping song IDs to their tag scores.
         """
         scores = {}
         
-        tag_recommendations = self.content_recommender.recommend_by_tags(
-            playlist=playlist,
-            n_recommendations=len(songs) * 2
-        )
+        context = context or RecommendationContext(playlist)
+        tag_recommendations = self._ranked(context, 'content_tags', len(songs) * 2)
+        song_ids = {song.id for song in songs}
         
         for song, score in tag_recommendations:
-            if song.id in [s.id for s in songs]:
+            if song.id in song_ids:
                 scores[song.id] = score
                 
         for song in songs:
@@ -108,26 +236,27 @@ class HybridRecommender:
         return scores
     
     
-    def get_content_similar_scores(self, playlist: Playlist, songs: List[Song]) -> Dict[int, float]:
+    def get_content_similar_scores(self, playlist: Playlist, songs: List[Song],
+                                   context: Optional[RecommendationContext] = None) -> Dict[int, float]:
         """
         Get Last.fm similarity scores 
 
         Args:
             playlist (Playlist): The playlist for which to get similariy scores.
             songs (List[Song]): The list of songs to get scores for.
+            context (RecommendationContext, optional): Request context to share the similar-track ranking through.
 
         Returns:
             Dict[int, float]: A dictionary mapping song IDs to their similarity scores.
         """
         scores = {}
         
-        mood_recommendations = self.content_recommender.find_similar_by_lastfm_api(
-            playlist=playlist,
-            n_recommendations=len(songs) * 2
-        )
+        context = context or RecommendationContext(playlist)
+        mood_recommendations = self._ranked(context, 'content_similar', len(songs) * 2)
+        song_ids = {song.id for song in songs}
         
         for song, score in mood_recommendations:
-            if song.id in [s.id for s in songs]:
+            if song.id in song_ids:
                 scores[song.id] = score
                 
         for song in songs:
@@ -137,6 +266,35 @@ class HybridRecommender:
         return scores
     
     
+    def get_content_audio_scores(self, playlist: Playlist, songs: List[Song],
+                                 context: Optional[RecommendationContext] = None) -> Dict[int, float]:
+        """
+        Get audio-feature similarity scores, the cosine similarity of each
+        song's encoder embedding to the playlist's mean embedding
+
+        Args:
+            playlist (Playlist): The playlist for which to get audio scores.
+            songs (List[Song]): The list of songs to get scores for.
+            context (RecommendationContext, optional): Request context to read the playlist's songs from.
+
+        Returns:
+            Dict[int, float]: A dictionary mapping song IDs to their audio scores.
+        """
+        scores = {}
+        context = context or RecommendationContext(playlist)
+        
+        index = audio_index_store.get()
+        if index is not None:
+            query = index.query_vector(context.existing_ids)
+            if query is not None:
+                scores = index.scores(query, [song.id for song in songs])
+        
+        for song in songs:
+            scores[song.id] = max(0.0, scores.get(song.id, 0.3))
+        
+        return scores
+    
+    
     def get_popularity_scores(self, songs: List[Song]) -> Dict[int, float]:
         """
         Get popularity scores based on Last.fm listeners and Spotify popularity
@@ -191,85 +349,157 @@ class HybridRecommender:
         return min(1.0, score)
     
     
-    def recommend_hybrid(
+    def strategy_weights(self, strategies: List[str]) -> np.ndarray:
+        """
+        Components x strategies weight matrix, columns in the order of
+        strategies; unknown strategies get the 'balanced' weights.
+        """
+        return np.array([
+            [self.strategies.get(strategy, self.strategies['balanced']).get(component, 0.0) for strategy in strategies]
+            for component in COMPONENTS
+        ], dtype=np.float64)
+    
+    
+    def score_candidates(
         self,
         playlist: Playlist,
         n_recommendations: int = 20,
-        strategy: str = 'balanced',
-    ) -> List[Tuple[Song, float, Dict[str, float]]]:
+        context: Optional[RecommendationContext] = None
+    ) -> Tuple[List[Song], np.ndarray]:
         """
-        Generate hybrid recommendations for a playlist
+        Generate candidates and score them with every component
 
         Args:
-            playlist (Playlist): The playlist to generate recommendations for.
-            n_recommendations (int, optional): The number of recommendations to generate. Defaults to 20.
-            strategy (str, optional): The strategy to use for generating recommendations. Defaults to 'balanced'.
+            playlist (Playlist): The playlist to generate candidates for.
+            n_recommendations (int, optional): The number of recommendations the candidates are for. Defaults to 20.
+            context (RecommendationContext, optional): Request context, pass one to read the degraded components.
 
         Returns:
-            List[Tuple[Song, float, Dict[str, float]]]: A list of recommended songs with their scores and component scores.
+            Tuple[List[Song], np.ndarray]: Candidates and their candidates x COMPONENTS score matrix.
         """
-        logger.info(f"Generating hybrid recommendations for playlist: {playlist.id}")
-        
-        # Get candidates
-        existing_ids = set(playlist.songs.values_list('id', flat=True))
-        candidates = self._get_candidate_songs(playlist, existing_ids, n_recommendations)
+        # Every component runs once, shared by candidate generation and scoring
+        context = context or RecommendationContext(playlist)
+        self._run_ranked_components(context, n_recommendations * self.candidate_pool_factor)
+        candidates = self._get_candidate_songs(playlist, context.existing_ids, n_recommendations, context)
         
         if not candidates:
-            logger.warning('No candidates found')
-            return []
+            return [], np.zeros((0, len(COMPONENTS)))
         
         song_ids = [song.id for song in candidates]
-
-        collaborative_scores = self.get_collaborative_scores(playlist.id, song_ids)
-        content_tag_scores = self.get_content_tag_scores(playlist, candidates)
-        content_similar_scores = self.get_content_similar_scores(playlist, candidates)
-        popularity_scores = self.get_popularity_scores(candidates)
-        
-        recommendations = []
-        
-        for song in candidates:
-            component_scores = {
-                'collaborative': collaborative_scores.get(song.id, 0.3),
-                'content_tags': content_tag_scores.get(song.id, 0.3),
-                'content_similar': content_similar_scores.get(song.id, 0.3),
-                'popularity': popularity_scores.get(song.id, 0.3)
-            }
         
-            hybrid_score = self.calculate_hybrid_score(
-                playlist, song, component_scores, strategy
-            )
+        scores_by_component = {
+            'collaborative': self.get_collaborative_scores(playlist.id, song_ids, context),
+            'content_tags': self.get_content_tag_scores(playlist, candidates, context),
+            'content_similar': self.get_content_similar_scores(playlist, candidates, context),
+            'content_audio': self.get_content_audio_scores(playlist, candidates, context),
+            'popularity': self.get_popularity_scores(candidates),
+        }
+        
+        component_matrix = np.array([
+            [
+                0.3 if component in context.degraded else scores_by_component[component].get(song_id, 0.3)
+                for component in COMPONENTS
+            ]
+            for song_id in song_ids
+        ], dtype=np.float64)
+        
+        return candidates, component_matrix
+    
+    
+    def recommend_hybrid_strategies(
+        self,
+        playlist: Playlist,
+        n_recommendations: int = 20,
+        strategies: Optional[List[str]] = None,
+        context: Optional[RecommendationContext] = None
+    ) -> Dict[str, List[Tuple[Song, float, Dict[str, float]]]]:
+        """
+        Generate hybrid recommendations for several strategies at once.
+        Candidates and component scores are computed once; the strategies
+        only differ in their weights, so all hybrid scores are one
+        candidates x components by components x strategies product.
 
-            recommendations.append((song, hybrid_score, component_scores))
+        Args:
+            playlist (Playlist): The playlist to generate recommendations for.
+            n_recommendations (int, optional): The number of recommendations per strategy. Defaults to 20.
+            strategies (List[str], optional): Strategies to generate. Defaults to every strategy.
+            context (RecommendationContext, optional): Request context, pass one to read the degraded components.
 
-        recommendations.sort(key=lambda x: x[1], reverse=True)
+        Returns:
+            Dict[str, List[Tuple[Song, float, Dict[str, float]]]]: Recommended songs with their scores and
+                component scores, per strategy.
+        """
+        logger.info(f"Generating hybrid recommendations for playlist: {playlist.id}")
+        strategies = list(strategies or self.strategies)
         
-        return recommendations[:n_recommendations]
+        candidates, component_matrix = self.score_candidates(playlist, n_recommendations, context)
+        if not candidates:
+            logger.warning('No candidates found')
+            return {strategy: [] for strategy in strategies}
+        
+        hybrid_scores = np.minimum(component_matrix @ self.strategy_weights(strategies), 1.0)
+        top_candidates = top_k_rows(hybrid_scores.T, n_recommendations)
+        
+        recommendations = {}
+        for column, strategy in enumerate(strategies):
+            recommendations[strategy] = [
+                (
+                    candidates[row],
+                    float(hybrid_scores[row, column]),
+                    dict(zip(COMPONENTS, component_matrix[row].tolist()))
+                )
+                for row in top_candidates[column]
+            ]
+        
+        return recommendations
     
     
-    def _get_candidate_songs(self, playlist: Playlist, existing_ids: set, n_needed: int) -> List[Song]:
+    def recommend_hybrid(
+        self,
+        playlist: Playlist,
+        n_recommendations: int = 20,
+        strategy: str = 'balanced',
+        context: Optional[RecommendationContext] = None
+    ) -> List[Tuple[Song, float, Dict[str, float]]]:
+        """
+        Generate hybrid recommendations for a playlist. The ranked components
+        run concurrently, each under its own deadline in component_deadlines;
+        components that miss it score every candidate 0.3 and are listed in
+        context.degraded.
+
+        Args:
+            playlist (Playlist): The playlist to generate recommendations for.
+            n_recommendations (int, optional): The number of recommendations to generate. Defaults to 20.
+            strategy (str, optional): The strategy to use for generating recommendations. Defaults to 'balanced'.
+            context (RecommendationContext, optional): Request context, pass one to read the degraded components.
+
+        Returns:
+            List[Tuple[Song, float, Dict[str, float]]]: A list of recommended songs with their scores and component scores.
+        """
+        return self.recommend_hybrid_strategies(playlist, n_recommendations, [strategy], context)[strategy]
+    
+    
+    def _get_candidate_songs(self, playlist: Playlist, existing_ids: set, n_needed: int,
+                             context: Optional[RecommendationContext] = None) -> List[Song]:
         candidates = []
         added_ids = set()
+        context = context or RecommendationContext(playlist)
+        n_pool = n_needed * self.candidate_pool_factor
         
-        if self.collaborative_recommender.load_model():
-            cf_recs = self.collaborative_recommender.recommend_for_playlist(
-                playlist.id, n_recommendations=n_needed * 2
-            )
-            for song_id, _ in cf_recs[:n_needed]:
-                if song_id not in existing_ids and song_id not in added_ids:
-                    try:
-                        song = Song.objects.get(id=song_id)
-                        candidates.append(song)
-                        added_ids.add(song_id)
-                    except Song.DoesNotExist:
-                        pass
-        
-        content_recs = self.content_recommender.recommend_by_tags(playlist, n_recommendations=n_needed)
+        cf_ids = [song_id for song_id, _ in self._ranked(context, 'collaborative', n_pool)[:n_needed]]
+        cf_songs = Song.objects.in_bulk(cf_ids)
+        for song_id in cf_ids:
+            if song_id in cf_songs and song_id not in existing_ids and song_id not in added_ids:
+                candidates.append(cf_songs[song_id])
+                added_ids.add(song_id)
+        
+        content_recs = self._ranked(context, 'content_tags', n_pool)[:n_needed]
         for song, _ in content_recs:
             if song.id not in existing_ids and song.id not in added_ids:
                 candidates.append(song)
                 added_ids.add(song.id)
         
-        similar_recs = self.content_recommender.find_similar_by_lastfm_api(playlist, n_needed)
+        similar_recs = self._ranked(context, 'content_similar', n_pool)[:n_needed]
         for song, _ in similar_recs:
             if song.id not in existing_ids and song.id not in added_ids:
                 candidates.append(song)
@@ -305,35 +535,155 @@ class HybridRecommender:
         strategy (str, optional): Recommendation strategy, defaults to 'balanced'.
         n_recommendations (int, optional): Recommendations to generate, Defaults to 20.
     """
+        self.update_hybrid_recommendations_strategies(playlist_id, [strategy], n_recommendations)
+    
+    
+    def update_hybrid_recommendations_strategies(
+        self,
+        playlist_id: int,
+        strategies: Optional[List[str]] = None,
+        n_recommendations: int = 20
+    ):
+        """
+        update_hybrid_recommendations for several strategies from one
+        candidate generation and scoring pass.
+
+        Args:
+            playlist_id (int): The ID of the playlist to update.
+            strategies (List[str], optional): Strategies to update. Defaults to every strategy.
+            n_recommendations (int, optional): Recommendations to generate per strategy. Defaults to 20.
+        """
         try:
             playlist = Playlist.objects.get(id=playlist_id)
         except Playlist.DoesNotExist:
             logger.error(f"Playlist {playlist_id} not found")
             return
         
-        HybridRecommendation.objects.filter(
-            playlist_id=playlist_id,
-            strategy=strategy
-        ).delete()
+        strategies = list(strategies or self.strategies)
+        model_version = current_model_version()
+        context = RecommendationContext(playlist)
+        recommendations_by_strategy = self.recommend_hybrid_strategies(playlist, n_recommendations, strategies, context)
+        
+        # Tags of every recommended song in one query
+        songs = {song.id: song for recommendations in recommendations_by_strategy.values() for song, _, _ in recommendations}
+        prefetch_related_objects(list(songs.values()), 'song_tags__tag')
+        
+        now = timezone.now()
+        rows = {}
+        for strategy, recommendations in recommendations_by_strategy.items():
+            for song, score, components in recommendations:
+                rows[(song.id, strategy)] = {
+                    'hybrid_score': score,
+                    'collaborative_score': components.get('collaborative', 0),
+                    'content_audio_score': components.get('content_audio', 0),
+                    'content_mood_score': components.get('content_similar', 0),
+                    'popularity_score': components.get('popularity', 0),
+                    'explanation': {
+                        'components': components,
+                        'strategy': strategy,
+                        'degraded': sorted(context.degraded),
+                        'timestamp': now.isoformat(),
+                        'primary_tags': [[tag, weight] for tag, weight in song.top_tags[:3]]
+                    }
+                }
         
-        recommendations = self.recommend_hybrid(playlist, n_recommendations, strategy)
+        # Readers see either the old or the new set; only rows that changed are written
+        with transaction.atomic():
+            existing = {
+                (row.song_id, row.strategy): row
+                for row in HybridRecommendation.objects.select_for_update().filter(
+                    playlist_id=playlist_id,
+                    strategy__in=strategies
+                )
+            }
+            
+            stale_ids = [row.id for key, row in existing.items() if key not in rows]
+            new_rows, changed_rows = [], []
+            for (song_id, strategy), fields in rows.items():
+                row = existing.get((song_id, strategy))
+                if row is None:
+                    new_rows.append(HybridRecommendation(playlist=playlist, song=songs[song_id], strategy=strategy, **fields))
+                elif self._recommendation_changed(row, fields):
+                    for field, value in fields.items():
+                        setattr(row, field, value)
+                    row.updated_at = now
+                    changed_rows.append(row)
+            
+            HybridRecommendation.objects.filter(id__in=stale_ids).delete()
+            HybridRecommendation.objects.bulk_create(new_rows)
+            HybridRecommendation.objects.bulk_update(changed_rows, [*RECOMMENDATION_FIELDS, 'updated_at'])
+            
+            row_ids = {
+                (song_id, strategy): row_id
+                for song_id, strategy, row_id in HybridRecommendation.objects.filter(
+                    playlist_id=playlist_id,
+                    strategy__in=strategies
+                ).values_list('song_id', 'strategy', 'id')
+            }
+            self._save_snapshots(playlist, model_version, recommendations_by_strategy, row_ids, sorted(context.degraded))
         
-        for song, score, components in recommendations:
-            HybridRecommendation.objects.create(
+        logger.info(
+            f"Updated {', '.join(strategies)} recommendations for playlist {playlist_id}: "
+            f"{len(new_rows)} added, {len(changed_rows)} changed, {len(stale_ids)} removed"
+        )
+    
+    
+    def _save_snapshots(self, playlist: Playlist, model_version: str,
+                        recommendations_by_strategy: Dict[str, List[Tuple[Song, float, Dict[str, float]]]],
+                        row_ids: Dict[Tuple[int, str], int], degraded: List[str]):
+        """Replace the playlist's snapshots of the given strategies, recording model_version and the degraded components"""
+        snapshots = []
+        for strategy, recommendations in recommendations_by_strategy.items():
+            snapshots.append(RecommendationSnapshot(
+                key=RecommendationSnapshot.snapshot_key(playlist.id, strategy),
                 playlist=playlist,
-                song=song,
-                hybrid_score=score,
-                collaborative_score=components.get('collaborative', 0),
-                content_audio_score=components.get('content_tags', 0),
-                content_mood_score=components.get('content_similar', 0),
-                popularity_score=components.get('popularity', 0),
                 strategy=strategy,
-                explanation={
-                    'components': components,
-                    'strategy': strategy,
-                    'timestamp': timezone.now().isoformat(),
-                    'primary_tags': song.top_tags[:3] if hasattr(song, 'top_tags') else []
-                }
-            )
-        
-        logger.info(f"Updated {len(recommendations)} recommendations for playlist {playlist_id}")
\ No newline at end of file
+                model_version=model_version,
+                degraded=degraded,
+                song_ids=[song.id for song, _, _ in recommendations],
+                scores=[score for _, score, _ in recommendations],
+                components={
+                    component: [components[component] for _, _, components in recommendations]
+                    for component in COMPONENTS
+                },
+                payload=[
+                    {
+                        'id': row_ids.get((song.id, strategy)),
+                        'song': {
+                            'id': song.id,
+                            'name': song.name,
+                            'artist': song.artist,
+                            'album': song.album,
+                            'photo': song.photo,
+                            'spotify_id': song.spotify_id,
+                            'preview_url': song.preview_url,
+                            'year': song.year,
+                            'popularity': song.popularity,
+                            'primary_tags': [tag for tag, _ in song.top_tags[:3]],
+                            'lastfm_listeners': song.lastfm_listeners,
+                        },
+                        'score': score,
+                        'explanation': components,
+                        'degraded': degraded,
+                    }
+                    for song, score, components in recommendations
+                ]
+            ))
+        
+        RecommendationSnapshot.objects.filter(
+            playlist=playlist,
+            strategy__in=list(recommendations_by_strategy)
+        ).delete()
+        RecommendationSnapshot.objects.bulk_create(snapshots)
+    
+    
+    @staticmethod
+    def _recommendation_changed(row: HybridRecommendation, fields: Dict) -> bool:
+        """Whether a stored row differs from freshly computed fields, ignoring the explanation timestamp"""
+        def without_timestamp(explanation):
+            return {key: value for key, value in (explanation or {}).items() if key != 'timestamp'}
+        
+        return any(
+            getattr(row, field) != value
+            for field, value in fields.items() if field != 'explanation'
+        ) or without_timestamp(row.explanation) != without_timestamp(fields['explanation'])
@@ -0,0 +1,438 @@
+import hashlib
+import threading
+import numpy as np
+from typing import List, Dict, Tuple, Optional
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from music.models import Playlist, Song
+from .models import PlaylistRecommendation
+from .model_registry import model_registry
+from .quantization import dequantize, matmul, gram, row_norms
+from .utils import top_k_indices, top_k_rows, lookup_indices, get_cache_key, fold_in_vector
+
+# Upper bound on the cells of one dense (playlists x songs) score block
+MAX_SCORE_BLOCK_CELLS = 2 ** 24
+
+# Values derived from a model version once per process, {(version, name): value}
+_derived_cache = {}
+_derived_lock = threading.Lock()
+
+class InferenceRecommender:
+    """
+    Serve collaborative recommendations from the exported NumPy bundle.
+    Only needs NumPy, so web workers never have to import TensorFlow.
+    The arrays come from the process-wide model registry, so they are
+    loaded once per process and hot-swapped when a new version is published.
+    """
+
+    def __init__(self):
+        self.playlist_ids = None    # sorted, playlist_ids[index] = playlist_id
+        self.song_ids = None        # sorted, song_ids[index] = song_id
+        self.playlist_factors = None  # (n_playlists, n_factors)
+        self.song_factors = None      # (n_songs, n_factors)
+        self.playlist_biases = None   # (n_playlists,)
+        self.song_biases = None       # (n_songs,)
+        self.playlist_scales = None   # per-row scales when factors are stored as int8
+        self.song_scales = None
+        self.interaction_indptr = None   # training playlist x song matrix, CSR
+        self.interaction_indices = None
+        self.model_version = None
+        self.model_manifest = {}
+        self.fold_in_regularization = 0.1
+        self.fold_in_cache_timeout = 3600
+        self.ann_index = None
+        # Lists probed by approximate search, None scores the whole catalog exactly
+        self.default_n_probe = getattr(settings, 'RECOMMENDATION_SETTINGS', {}).get('ANN_N_PROBE')
+
+
+    def load_model(self) -> bool:
+        """
+        Take the current model version from the registry. Cheap to call
+        repeatedly, the arrays are only read from disk when a new version
+        is published.
+
+        Returns:
+            True if a model is available, False if not
+        """
+        model = model_registry.get()
+        if model is None:
+            print("No published recommendation model")
+            return False
+
+        if model.version != self.model_version:
+            for name, array in model.arrays.items():
+                setattr(self, name, array)
+            self.model_version = model.version
+            self.model_manifest = model.manifest
+            self.ann_index = model.ann_index
+        return True
+
+
+    def ensure_model(self) -> bool:
+        """Make sure a model is loaded before scoring, picking up newly published versions"""
+        return self.load_model()
+
+
+    def get_playlist_index(self, playlist_id: int) -> Optional[int]:
+        """Row of playlist_id in the playlist matrices, None if not in training data"""
+        positions, found = lookup_indices(self.playlist_ids, [playlist_id])
+        return int(positions[0]) if found[0] else None
+
+
+    def get_song_indices(self, song_ids) -> np.ndarray:
+        """Rows of the given songs in the song matrices, skipping unknown songs"""
+        positions, found = lookup_indices(self.song_ids, list(song_ids))
+        return positions[found]
+
+
+    def _derived(self, name: str, compute):
+        """Compute a value from the model arrays once per model version and process"""
+        if self.model_version is None:
+            return compute()
+        key = (self.model_version, name)
+        value = _derived_cache.get(key)
+        if value is None:
+            # Computed outside the lock, threads racing on a new version may both compute it
+            value = compute()
+            with _derived_lock:
+                for stale in [k for k in _derived_cache if k[0] != self.model_version]:
+                    del _derived_cache[stale]
+                _derived_cache[key] = value
+        return value
+
+
+    def song_vectors(self, rows) -> np.ndarray:
+        """Float32 song embeddings for the given rows, whatever precision they are stored in"""
+        scales = self.song_scales[rows] if self.song_scales is not None else None
+        return dequantize(self.song_factors[rows], scales)
+
+
+    def playlist_vector_row(self, playlist_idx: int) -> np.ndarray:
+        """Float32 embedding of a trained playlist"""
+        scales = self.playlist_scales[[playlist_idx]] if self.playlist_scales is not None else None
+        return dequantize(self.playlist_factors[[playlist_idx]], scales)[0]
+
+
+    def score_songs(self, query: np.ndarray, rows: Optional[np.ndarray]=None) -> np.ndarray:
+        """Inner products of the query with the given song rows, or with every song"""
+        if rows is None:
+            return matmul(self.song_factors, self.song_scales, query)
+        return self.song_vectors(rows) @ np.asarray(query, dtype=np.float32)
+
+
+    def get_playlist_song_indices(self, playlist_id: int) -> np.ndarray:
+        """Sorted rows of the songs currently in the playlist, skipping songs unknown to the model"""
+        song_ids = Playlist.songs.through.objects.filter(playlist_id=playlist_id).values_list('song_id', flat=True)
+        return np.sort(self.get_song_indices(song_ids))
+
+
+    def fold_in(self, song_indices: np.ndarray) -> np.ndarray:
+        """
+        Project a playlist into the model's latent space from the vectors of
+        its songs, without retraining. Solves the same regularized least
+        squares problem the trainer solves for a playlist row, keeping the
+        song vectors fixed.
+
+        Args:
+            song_indices (np.ndarray): Rows of the playlist's songs
+
+        Returns:
+            np.ndarray: Playlist vector
+        """
+        V = self.song_vectors(song_indices)
+
+        if self.model_manifest.get('engine') == 'als':
+            # Weighted ALS: (YtY + Yt (C - I) Y + reg I) u = Yt C p, observed songs have confidence 1 + alpha
+            return fold_in_vector(
+                V,
+                song_gram=self._derived('song_gram', lambda: gram(self.song_factors, self.song_scales)),
+                alpha=self.model_manifest.get('alpha', 40.0),
+                regularization=self.model_manifest.get('regularization', 0.01)
+            )
+        # Pointwise model: u . v_i + b_i should reach 1 for every song in the playlist
+        return fold_in_vector(V, song_biases=self.song_biases[song_indices], regularization=self.fold_in_regularization)
+
+
+    def get_playlist_vector(self, playlist_id: int, song_indices: np.ndarray) -> Optional[Tuple[np.ndarray, float]]:
+        """
+        Get the vector and bias used to score a playlist. Playlists whose
+        songs are unchanged since training use their trained embedding;
+        new playlists, and playlists whose songs changed, are folded in
+        from their current songs and cached per song set.
+
+        Args:
+            playlist_id (int): ID of the playlist
+            song_indices (np.ndarray): Sorted rows of the playlist's current songs
+
+        Returns:
+            Tuple[np.ndarray, float]: Playlist vector and bias, None if the playlist has no known songs
+        """
+        playlist_idx = self.get_playlist_index(playlist_id)
+
+        if playlist_idx is not None:
+            bias = float(self.playlist_biases[playlist_idx])
+            if self.interaction_indptr is None:
+                return self.playlist_vector_row(playlist_idx), bias
+            trained = self.interaction_indices[
+                self.interaction_indptr[playlist_idx]:self.interaction_indptr[playlist_idx + 1]
+            ]
+            if np.array_equal(trained, song_indices):
+                return self.playlist_vector_row(playlist_idx), bias
+        else:
+            bias = 0.0
+
+        if len(song_indices) == 0:
+            return None
+
+        songs_digest = hashlib.md5(np.asarray(song_indices, dtype=np.int64).tobytes()).hexdigest()
+        cache_key = get_cache_key('cf_fold_in', self.model_version, playlist_id, songs_digest)
+        vector = cache.get(cache_key)
+        if vector is None:
+            vector = self.fold_in(song_indices)
+            cache.set(cache_key, vector, self.fold_in_cache_timeout)
+        return vector, bias
+
+
+    def get_playlist_embedding(self, playlist_id: int) -> Optional[np.ndarray]:
+        """
+        Get the embedding vector for a specific playlist.
+
+        Args:
+            playlist_id (int): ID of the playlist
+
+        Returns:
+            np.ndarray: Embedding vector for the playlist, None if not found
+        """
+        if not self.ensure_model():
+            return None
+
+        playlist_vector = self.get_playlist_vector(playlist_id, self.get_playlist_song_indices(playlist_id))
+        if playlist_vector is None:
+            return None
+        return playlist_vector[0]
+
+
+    def recommend_for_playlist(self, playlist_id: int, n_recommendations: int=10, n_probe: Optional[int]=None) -> List[Tuple[int, float]]:
+        """
+        Generate song recommendations for playlist with playlist_id
+
+        Args:
+            playlist_id (int): ID of the playlist
+            n_recommendations (int, optional): Number of recommendations to return. Defaults to 10
+            n_probe (int, optional): ANN lists to search; more is slower but more accurate.
+                Defaults to RECOMMENDATION_SETTINGS['ANN_N_PROBE'], exact search if unset or 0
+
+        Returns:
+            List[Tuple[int, float]]:
+                List of tuples containing song IDs and their scores
+        """
+        if not self.ensure_model():
+            print("NEMA MODELA")
+            return []
+
+        song_indices = self.get_playlist_song_indices(playlist_id)
+        playlist_vector = self.get_playlist_vector(playlist_id, song_indices)
+        if playlist_vector is None:
+            print(f"Playlist {playlist_id} has no songs known to the model")
+            return []
+        vector, bias = playlist_vector
+
+        if n_probe is None:
+            n_probe = self.default_n_probe
+        if n_probe and self.ann_index is not None:
+            candidates = self.ann_index.probe(np.append(vector, 1.0).astype(np.float32), n_probe)
+            scores = self.score_songs(vector, candidates)
+        else:
+            candidates = np.arange(len(self.song_ids))
+            scores = self.score_songs(vector)
+
+        # u . V^T + song bias + playlist bias
+        scores += self.song_biases[candidates] + bias
+
+        exclude = np.isin(candidates, song_indices)
+
+        top_indices = top_k_indices(scores, n_recommendations, exclude=exclude)
+        return [(int(self.song_ids[candidates[idx]]), float(scores[idx])) for idx in top_indices]
+
+
+    def similar_songs(self, song_id: int, n_recommendations: int=10, n_probe: Optional[int]=None) -> List[Tuple[int, float]]:
+        """
+        Find the songs whose embeddings are closest (cosine) to a song's embedding
+
+        Args:
+            song_id (int): ID of the song
+            n_recommendations (int, optional): Number of songs to return. Defaults to 10
+            n_probe (int, optional): ANN lists to search, exact search if unset or 0
+
+        Returns:
+            List[Tuple[int, float]]: Song IDs and cosine similarities
+        """
+        if not self.ensure_model():
+            return []
+
+        song_indices = self.get_song_indices([song_id])
+        if len(song_indices) == 0:
+            return []
+        song_idx = song_indices[0]
+        vector = self.song_vectors([song_idx])[0]
+
+        if n_probe is None:
+            n_probe = self.default_n_probe
+        if n_probe and self.ann_index is not None:
+            candidates = self.ann_index.probe(np.append(vector, 0.0).astype(np.float32), n_probe)
+            dots = self.score_songs(vector, candidates)
+        else:
+            candidates = np.arange(len(self.song_ids))
+            dots = self.score_songs(vector)
+
+        song_norms = self._derived('song_norms', lambda: row_norms(self.song_factors, self.song_scales))
+        norms = song_norms[candidates] * np.linalg.norm(vector)
+        similarities = dots / np.maximum(norms, 1e-10)
+
+        top_indices = top_k_indices(similarities, n_recommendations, exclude=candidates == song_idx)
+        return [(int(self.song_ids[candidates[idx]]), float(similarities[idx])) for idx in top_indices]
+
+
+    def recommend_for_playlists(self, playlist_ids: List[int], n_recommendations: int=10) -> Dict[int, List[Tuple[int, float]]]:
+        """
+        Score a block of playlists at once with one dense U_block @ V.T
+        matmul and a top-k per row.
+
+        Args:
+            playlist_ids (List[int]): IDs of the playlists
+            n_recommendations (int, optional): Number of recommendations per playlist. Defaults to 10
+
+        Returns:
+            Dict[int, List[Tuple[int, float]]]: Song IDs and scores per playlist, playlists without known songs are left out
+        """
+        if not self.ensure_model():
+            return {}
+
+        block_ids = np.array(sorted(set(playlist_ids)), dtype=np.int64)
+        pairs = np.array(
+            list(Playlist.songs.through.objects.filter(playlist_id__in=block_ids.tolist()).values_list('playlist_id', 'song_id')),
+            dtype=np.int64
+        ).reshape(-1, 2)
+
+        rows = np.searchsorted(block_ids, pairs[:, 0])
+        song_positions, found = lookup_indices(self.song_ids, pairs[:, 1])
+        rows, song_positions = rows[found], song_positions[found]
+        order = np.lexsort((song_positions, rows))
+        rows, song_positions = rows[order], song_positions[order]
+        bounds = np.searchsorted(rows, np.arange(len(block_ids) + 1))
+
+        vectors, biases, scored = [], [], []
+        for row, playlist_id in enumerate(block_ids):
+            playlist_vector = self.get_playlist_vector(int(playlist_id), song_positions[bounds[row]:bounds[row + 1]])
+            if playlist_vector is not None:
+                vectors.append(playlist_vector[0])
+                biases.append(playlist_vector[1])
+                scored.append(row)
+
+        if not scored:
+            return {}
+
+        scores = matmul(self.song_factors, self.song_scales, np.asarray(vectors, dtype=np.float32).T).T
+        scores += self.song_biases[None, :]
+        scores += np.asarray(biases, dtype=np.float32)[:, None]
+
+        # Mask songs already in each playlist
+        block_rows = np.full(len(block_ids), -1)
+        block_rows[scored] = np.arange(len(scored))
+        in_scored = block_rows[rows] >= 0
+        scores[block_rows[rows[in_scored]], song_positions[in_scored]] = -np.inf
+
+        top = top_k_rows(scores, n_recommendations)
+        recommendations = {}
+        for i, row in enumerate(scored):
+            row_scores = scores[i, top[i]]
+            recommendations[int(block_ids[row])] = [
+                (int(self.song_ids[idx]), float(score))
+                for idx, score in zip(top[i], row_scores) if np.isfinite(score)
+            ]
+        return recommendations
+
+
+    def save_recommendations(self, recommendations: Dict[int, List[Tuple[int, float]]], chunk_size: int=1000) -> int:
+        """
+        Replace the stored collaborative recommendations of the given
+        playlists in one transaction, using chunked bulk_create.
+
+        Args:
+            recommendations (Dict[int, List[Tuple[int, float]]]): Song IDs and scores per playlist
+            chunk_size (int, optional): Rows per INSERT. Defaults to 1000
+
+        Returns:
+            int: Number of rows written
+        """
+        recommendations = {pid: recs for pid, recs in recommendations.items() if recs}
+        if not recommendations:
+            return 0
+
+        # Songs deleted since training must not be written
+        song_ids = {song_id for recs in recommendations.values() for song_id, _ in recs}
+        existing_songs = set(Song.objects.filter(id__in=song_ids).values_list('id', flat=True))
+
+        rows = [
+            PlaylistRecommendation(
+                playlist_id=playlist_id,
+                song_id=song_id,
+                score=score,
+                recommendation_type='collaborative'
+            )
+            for playlist_id, recs in recommendations.items()
+            for song_id, score in recs
+            if song_id in existing_songs
+        ]
+
+        with transaction.atomic():
+            PlaylistRecommendation.objects.filter(
+                playlist_id__in=list(recommendations.keys()),
+                recommendation_type='collaborative'
+            ).delete()
+            PlaylistRecommendation.objects.bulk_create(rows, batch_size=chunk_size)
+
+        return len(rows)
+
+
+    def update_playlist_recommendations(self, playlist_id: int, n_recommendations: int=10):
+        """
+        Update recommendations for a specific playlist
+
+        Args:
+            playlist_id (int): ID of the playlist
+            n_recommendations (int, optional): Number of recommendations to generate
+        """
+        self.save_recommendations(self.recommend_for_playlists([playlist_id], n_recommendations))
+
+
+    def update_all_recommendations(self, n_recommendations: int=10, block_size: int=256, chunk_size: int=1000):
+        """
+        Update recommendations for all playlists in the database, scoring
+        block_size playlists per matmul and writing each block in its own
+        transaction.
+
+        Args:
+            n_recommendations (int, optional): Number of recommendations to generate for each playlist
+            block_size (int, optional): Playlists scored together. Defaults to 256
+            chunk_size (int, optional): Rows per INSERT. Defaults to 1000
+
+        Returns:
+            int: Number of playlists updated
+        """
+        if not self.ensure_model():
+            return 0
+
+        block_size = max(1, min(block_size, MAX_SCORE_BLOCK_CELLS // max(len(self.song_ids), 1)))
+        playlist_ids = list(Playlist.objects.order_by('id').values_list('id', flat=True))
+
+        updated = 0
+        for start in range(0, len(playlist_ids), block_size):
+            block = playlist_ids[start:start + block_size]
+            recommendations = self.recommend_for_playlists(block, n_recommendations)
+            self.save_recommendations(recommendations, chunk_size=chunk_size)
+            updated += sum(1 for recs in recommendations.values() if recs)
+            print(f"Updated recommendations for playlists {start + 1}-{start + len(block)} of {len(playlist_ids)}")
+
+        return updated
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from recommendations.audio_embeddings import audio_index_store
+
+
+class Command(BaseCommand):
+    help = 'Encode the audio features of every song with the shipped encoder into the audio embedding index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=4096,
+            help='Songs encoded per encoder call'
+        )
+
+    def handle(self, *args, **options):
+        index = audio_index_store.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(f'Songs: {len(index)}, dimensions: {index.embeddings.shape[1]}')
+        self.stdout.write(self.style.SUCCESS('\nDONE'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from music.models import Song
+from recommendations.minhash import update_song_signature
+
+
+class Command(BaseCommand):
+    help = 'Compute MinHash signatures and LSH buckets of every tagged song'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Songs read from the database at a time'
+        )
+    
+    def handle(self, *args, **options):
+        songs = Song.objects.exclude(
+            lastfm_tags={}
+        ).exclude(
+            lastfm_tags__isnull=True
+        ).values_list('id', 'lastfm_tags')
+        
+        processed = 0
+        for song_id, tags in songs.iterator(chunk_size=options['batch_size']):
+            update_song_signature(song_id, tags)
+            processed += 1
+            if processed % options['batch_size'] == 0:
+                self.stdout.write(f'Signed {processed} songs')
+        
+        self.stdout.write(self.style.SUCCESS(f'\nDONE, signed {processed} songs'))
@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from music.models import Song
+from recommendations.models import SongNeighbor
+from recommendations.song_neighbors import init_worker, compute_block
+from recommendations.tag_matrix import tag_matrix_store
+import hashlib
+import json
+import multiprocessing
+import numpy as np
+import os
+
+
+class Command(BaseCommand):
+    help = 'Compute the most similar songs of every tagged song by weighted Jaccard over Last.fm tags'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--k',
+            type=int,
+            default=20,
+            help='Neighbours stored per song'
+        )
+        parser.add_argument(
+            '--block-size',
+            type=int,
+            default=256,
+            help='Songs handled per task'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Worker processes'
+        )
+        parser.add_argument(
+            '--rerank-factor',
+            type=int,
+            default=3,
+            help='Candidates rescored exactly per stored neighbour'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the progress of an interrupted run and start over'
+        )
+
+    def handle(self, *args, **options):
+        matrix = tag_matrix_store.get() or tag_matrix_store.rebuild()
+        n_songs = len(matrix)
+        k, block_size = options['k'], options['block_size']
+
+        # Blocks already written by an interrupted run over the same matrix and settings are skipped
+        progress_path = os.path.join(settings.MEDIA_ROOT, 'tag_index', 'neighbors_progress.json')
+        run = {
+            'songs': hashlib.md5(np.ascontiguousarray(matrix.song_ids).tobytes()).hexdigest(),
+            'k': k,
+            'block_size': block_size,
+        }
+        done = set()
+        if not options['restart'] and os.path.exists(progress_path):
+            with open(progress_path) as f:
+                progress = json.load(f)
+            if progress.get('run') == run:
+                done = set(progress['done'])
+                self.stdout.write(f'Resuming, {len(done)} blocks already done')
+
+        blocks = [
+            (start, min(start + block_size, n_songs), k, options['rerank_factor'])
+            for start in range(0, n_songs, block_size)
+            if start not in done
+        ]
+        self.stdout.write(f'Songs: {n_songs}, blocks left: {len(blocks)}')
+
+        with multiprocessing.Pool(options['processes'], initializer=init_worker, initargs=(matrix.weights,)) as pool:
+            for start, rows, cols, similarities in pool.imap_unordered(compute_block, blocks):
+                self._write_block(matrix.song_ids[start:start + block_size], matrix.song_ids[rows],
+                                  matrix.song_ids[cols], similarities, rows)
+                done.add(start)
+                self._save_progress(progress_path, run, done)
+                self.stdout.write(f'Block {len(done)} / {-(-n_songs // block_size)}')
+
+        # Songs that lost their tags keep no neighbours
+        SongNeighbor.objects.filter(song__lastfm_tags={}).delete()
+        if os.path.exists(progress_path):
+            os.remove(progress_path)
+        self.stdout.write(self.style.SUCCESS('\nDONE'))
+
+    def _write_block(self, block_song_ids, song_ids, neighbor_ids, similarities, rows):
+        """Replace the stored neighbours of the block's songs"""
+        ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        # Skip songs deleted since the tag matrix was built
+        existing = set(Song.objects.filter(
+            id__in=np.union1d(neighbor_ids, block_song_ids).tolist()
+        ).values_list('id', flat=True))
+
+        with transaction.atomic():
+            SongNeighbor.objects.filter(song_id__in=block_song_ids.tolist()).delete()
+            SongNeighbor.objects.bulk_create([
+                SongNeighbor(song_id=song_id, neighbor_id=neighbor_id, similarity=similarity, rank=rank)
+                for song_id, neighbor_id, similarity, rank in zip(
+                    song_ids.tolist(), neighbor_ids.tolist(), similarities.tolist(), ranks.tolist()
+                )
+                if song_id in existing and neighbor_id in existing
+            ], batch_size=1000)
+
+    def _save_progress(self, path, run, done):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'run': run, 'done': sorted(done)}, f)
+        os.replace(tmp_path, path)
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from django.db.models import Q
 from music.models import Song
 from lastfm.utils import batch_enrich_songs_with_lastfm
+from recommendations.tag_matrix import tag_matrix_store
 import time
 
 
@@ -25,6 +26,11 @@ class Command(BaseCommand):
             action='store_true',
             help='Force update every song'
         )
+        parser.add_argument(
+            '--rebuild-tag-matrix',
+            action='store_true',
+            help='Rebuild the tag matrix used by tag-based recommendations from scratch'
+        )
     
     def handle(self, *args, **options):
         batch_size = options['batch_size']
@@ -53,6 +59,7 @@ class Command(BaseCommand):
         
         processed = 0
         enriched = 0
+        enriched_ids = []
         
         for i in range(0, total_songs, batch_size):
             batch = list(songs[i:i+batch_size])
@@ -64,10 +71,20 @@ class Command(BaseCommand):
             
             self.stdout.write(f'Enriched {batch_enriched} / {len(batch)}')
             
+            if batch_enriched:
+                enriched_ids.extend(song.id for song in batch)
+            
             if i + batch_size < total_songs:
                 self.stdout.write('Wait 2 secondes')
                 time.sleep(2)
         
+        # One matrix rewrite for the whole run
+        if not options['rebuild_tag_matrix']:
+            tag_matrix_store.update_songs(enriched_ids)
+        if options['rebuild_tag_matrix'] or tag_matrix_store.get() is None:
+            matrix = tag_matrix_store.rebuild()
+            self.stdout.write(f'Tag matrix built: {len(matrix)} songs, {len(matrix.vocabulary)} tags')
+        
         self.stdout.write(self.style.SUCCESS('\nDONE'))
         
         songs_with_tags = Song.objects.exclude(lastfm_tags={}).count()
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from recommendations.model_registry import model_registry
+
+
+class Command(BaseCommand):
+    help = 'Publish the collaborative model saved before versioned bundles (model.keras + encoders.pkl) without retraining'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            type=str,
+            default=None,
+            help='Directory holding model.keras and encoders.pkl, defaults to MEDIA_ROOT/recommendation_model'
+        )
+        parser.add_argument(
+            '--precision',
+            type=str,
+            choices=['float32', 'float16', 'int8'],
+            default='float32',
+            help='Storage precision of the exported embeddings'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Publish even if a model is already published'
+        )
+
+    def handle(self, *args, **options):
+        if model_registry.read_manifest() and not options['force']:
+            self.stdout.write('A model is already published, use --force to replace it')
+            return
+
+        # TensorFlow is only imported when a Keras model is actually read
+        from recommendations.collaborative_recommender import PlaylistRecommender
+
+        recommender = PlaylistRecommender(precision=options['precision'])
+        recommender.import_legacy_model(options['path'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Published {len(recommender.playlist_ids)} playlists and {len(recommender.song_ids)} songs '
+            f'from the legacy model as version {model_registry.read_manifest()["version"]}'
+        ))
@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand
+from lastfm.queue import claim_tasks, enqueue_stale_playlist_songs, process_tasks
+from recommendations.tag_matrix import tag_matrix_store
+import time
+
+
+class Command(BaseCommand):
+    help = 'Drain the Last.fm enrichment queue filled by recommendation requests'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Number of songs claimed at a time'
+        )
+        parser.add_argument(
+            '--idle-sleep',
+            type=float,
+            default=10.0,
+            help='Seconds to wait when the queue is empty'
+        )
+        parser.add_argument(
+            '--matrix-interval',
+            type=float,
+            default=300.0,
+            help='Seconds between tag matrix updates, enriched songs are merged in together'
+        )
+        parser.add_argument(
+            '--sweep-interval',
+            type=float,
+            default=3600.0,
+            help='Seconds between queueing playlist songs whose Last.fm data went stale'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is empty instead of waiting for more work'
+        )
+    
+    def handle(self, *args, **options):
+        enriched_total = 0
+        # Songs enriched since the last tag matrix update, merged in together
+        # since every update rewrites the whole matrix file
+        pending_matrix_ids = []
+        last_matrix_update = time.monotonic()
+        last_sweep = None
+        
+        while True:
+            # Songs added to playlists are queued by the signals, songs
+            # already in playlists are picked up here once they age out
+            if last_sweep is None or time.monotonic() - last_sweep >= options['sweep_interval']:
+                enqueue_stale_playlist_songs()
+                last_sweep = time.monotonic()
+            
+            tasks = claim_tasks(options['batch_size'])
+            if not tasks:
+                self._update_matrix(pending_matrix_ids)
+                last_matrix_update = time.monotonic()
+                if options['once']:
+                    break
+                time.sleep(options['idle_sleep'])
+                continue
+            
+            enriched = process_tasks(tasks)
+            enriched_total += len(enriched)
+            pending_matrix_ids.extend(enriched)
+            self.stdout.write(f'Enriched {len(enriched)} / {len(tasks)}')
+            
+            if time.monotonic() - last_matrix_update >= options['matrix_interval']:
+                self._update_matrix(pending_matrix_ids)
+                last_matrix_update = time.monotonic()
+            
+            time.sleep(2)
+        
+        self.stdout.write(self.style.SUCCESS(f'\nDONE, enriched {enriched_total} songs'))
+    
+    def _update_matrix(self, song_ids):
+        if song_ids:
+            tag_matrix_store.update_songs(song_ids)
+            self.stdout.write(f'Tag matrix updated with {len(song_ids)} songs')
+            song_ids.clear()
@@ -1,5 +1,5 @@
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
-from recommendations.collaborative_recommender import PlaylistRecommender
 
 
 class Command(BaseCommand):
@@ -9,24 +9,62 @@ class Command(BaseCommand):
         parser.add_argument(
             '--model',
             type=str,
-            choices=['collaborative', 'content', 'all'],
+            choices=['collaborative', 'als', 'content', 'all'],
             default='all',
-            help='Which model to train'
+            help='Which model to train (collaborative = Keras, als = sparse implicit ALS)'
+        )
+        parser.add_argument(
+            '--precision',
+            type=str,
+            choices=['float32', 'float16', 'int8'],
+            default='float32',
+            help='Storage precision of the exported collaborative embeddings'
+        )
+        parser.add_argument(
+            '--skip-snapshots',
+            action='store_true',
+            help='Do not rebuild the recommendation snapshots computed with the previous model'
         )
     
     def handle(self, *args, **options):
         model_type = options['model']
+        published = False
         
         if model_type in ['collaborative', 'all']:
+            # TensorFlow is only imported when the Keras model is actually trained
+            from recommendations.collaborative_recommender import PlaylistRecommender
+            
             self.stdout.write('Training collaborative filtering model...')
-            cf_recommender = PlaylistRecommender()
+            cf_recommender = PlaylistRecommender(precision=options['precision'])
             history = cf_recommender.train()
             
             if history:
+                published = True
                 self.stdout.write(
                     self.style.SUCCESS('Collaborative model trained successfully!')
                 )
             else:
                 self.stdout.write(
                     self.style.ERROR('Failed to train collaborative model')
-                )
\ No newline at end of file
+                )
+        
+        if model_type == 'als':
+            from recommendations.als_recommender import ALSRecommender
+            
+            self.stdout.write('Training ALS collaborative filtering model...')
+            stats = ALSRecommender(precision=options['precision']).train()
+            
+            if stats:
+                published = True
+                self.stdout.write(
+                    self.style.SUCCESS(f"ALS model trained successfully in {stats['seconds']:.1f}s!")
+                )
+            else:
+                self.stdout.write(
+                    self.style.ERROR('Failed to train ALS model')
+                )
+        
+        # Snapshots of the previous model are served until they are rebuilt
+        if published and not options['skip_snapshots']:
+            self.stdout.write('Rebuilding recommendation snapshots...')
+            call_command('update_recommendations', stale=True, stdout=self.stdout)
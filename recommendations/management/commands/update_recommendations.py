@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from music.models import Playlist
-from recommendations.hybrid_recommender import HybridRecommender
+from recommendations.hybrid_recommender import HybridRecommender, current_model_version
+from recommendations.models import RecommendationSnapshot
 
 
 class Command(BaseCommand):
@@ -15,19 +16,37 @@ class Command(BaseCommand):
         parser.add_argument(
             '--strategy',
             type=str,
-            default='balanced',
-            choices=['balanced', 'discovery', 'similarity', 'popular'],
-            help='Recommendation strategy'
+            default='all',
+            choices=['all', 'balanced', 'discovery', 'similarity', 'popular'],
+            help='Recommendation strategy, all strategies are computed in one pass'
+        )
+        parser.add_argument(
+            '--collaborative',
+            action='store_true',
+            help='Refresh stored collaborative recommendations for every playlist in batches'
+        )
+        parser.add_argument(
+            '--stale',
+            action='store_true',
+            help='Only playlists whose snapshots were computed with another collaborative model version'
         )
     
     def handle(self, *args, **options):
         playlist_id = options.get('playlist_id')
-        strategy = options['strategy']
+        strategies = None if options['strategy'] == 'all' else [options['strategy']]
+        
+        if options['collaborative']:
+            from recommendations.inference_recommender import InferenceRecommender
+            updated = InferenceRecommender().update_all_recommendations(n_recommendations=20)
+            self.stdout.write(self.style.SUCCESS(f'Updated collaborative recommendations for {updated} playlists'))
+            return
         
         recommender = HybridRecommender()
         
         if playlist_id:
             playlists = Playlist.objects.filter(id=playlist_id)
+        elif options['stale']:
+            playlists = Playlist.objects.filter(id__in=RecommendationSnapshot.stale_playlist_ids(current_model_version()))
         else:
             playlists = Playlist.objects.filter(songs__isnull=False).distinct()
         
@@ -35,9 +54,9 @@ class Command(BaseCommand):
         
         for playlist in playlists:
             try:
-                recommender.update_hybrid_recommendations(
+                recommender.update_hybrid_recommendations_strategies(
                     playlist.id,
-                    strategy=strategy,
+                    strategies=strategies,
                     n_recommendations=20
                 )
                 self.stdout.write(f'Updated: {playlist.name}')
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+PROFILE_MIN_TAG_WEIGHT = 0.3
+
+
+def backfill_tag_profiles(apps, schema_editor):
+    Playlist = apps.get_model('music', 'Playlist')
+    SongTag = apps.get_model('music', 'SongTag')
+    PlaylistTagProfile = apps.get_model('recommendations', 'PlaylistTagProfile')
+
+    for playlist_id in Playlist.objects.values_list('id', flat=True).iterator():
+        tag_totals = {}
+        tagged_songs = set()
+        for song_id, tag, weight in SongTag.objects.filter(song__playlists=playlist_id).values_list('song_id', 'tag__name', 'weight'):
+            tagged_songs.add(song_id)
+            if weight >= PROFILE_MIN_TAG_WEIGHT:
+                weight_sum, count = tag_totals.get(tag, [0.0, 0])
+                tag_totals[tag] = [weight_sum + weight, count + 1]
+        PlaylistTagProfile.objects.create(
+            playlist_id=playlist_id,
+            tag_totals=tag_totals,
+            n_songs_with_tags=len(tagged_songs)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0003_tag_songtag'),
+        ('recommendations', '0002_recommendationfeedback_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaylistTagProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag_totals', models.JSONField(blank=True, default=dict)),
+                ('n_songs_with_tags', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('playlist', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='tag_profile', to='music.playlist')),
+            ],
+        ),
+        migrations.RunPython(backfill_tag_profiles, migrations.RunPython.noop),
+    ]
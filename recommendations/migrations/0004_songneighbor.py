@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0004_song_match_key'),
+        ('recommendations', '0003_playlisttagprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('similarity', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='music.song')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_neighbors', to='music.song')),
+            ],
+            options={
+                'ordering': ['song', 'rank'],
+                'unique_together': {('song', 'neighbor')},
+                'indexes': [
+                    models.Index(fields=['song', 'rank'], name='recommendat_song_id_46fe21_idx'),
+                    models.Index(fields=['neighbor'], name='recommendat_neighbo_8addd0_idx'),
+                ],
+            },
+        ),
+    ]
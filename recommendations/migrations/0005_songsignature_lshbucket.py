@@ -0,0 +1,36 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0004_song_match_key'),
+        ('recommendations', '0004_songneighbor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongSignature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signature', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='tag_signature', to='music.song')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LSHBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lsh_buckets', to='music.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['band', 'bucket'], name='recommendat_band_c94462_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0004_song_match_key'),
+        ('recommendations', '0005_songsignature_lshbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationSnapshot',
+            fields=[
+                ('key', models.CharField(max_length=128, primary_key=True, serialize=False)),
+                ('strategy', models.CharField(max_length=50)),
+                ('model_version', models.CharField(blank=True, max_length=32)),
+                ('song_ids', models.JSONField(default=list)),
+                ('scores', models.JSONField(default=list)),
+                ('components', models.JSONField(default=dict)),
+                ('payload', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendation_snapshots', to='music.playlist')),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def rekey_snapshots(apps, schema_editor):
+    """Key snapshots by playlist and strategy only, keeping the newest of each"""
+    RecommendationSnapshot = apps.get_model('recommendations', 'RecommendationSnapshot')
+    newest = {}
+    for snapshot in RecommendationSnapshot.objects.order_by('updated_at'):
+        snapshot.key = f"{snapshot.playlist_id}:{snapshot.strategy}"
+        newest[snapshot.key] = snapshot
+    RecommendationSnapshot.objects.all().delete()
+    RecommendationSnapshot.objects.bulk_create(newest.values())
+
+
+def restore_version_keys(apps, schema_editor):
+    RecommendationSnapshot = apps.get_model('recommendations', 'RecommendationSnapshot')
+    snapshots = list(RecommendationSnapshot.objects.all())
+    for snapshot in snapshots:
+        snapshot.key = f"{snapshot.playlist_id}:{snapshot.strategy}:{snapshot.model_version}"
+    RecommendationSnapshot.objects.all().delete()
+    RecommendationSnapshot.objects.bulk_create(snapshots)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommendations', '0006_recommendationsnapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(rekey_snapshots, restore_version_keys),
+    ]
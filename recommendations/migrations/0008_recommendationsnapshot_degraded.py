@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommendations', '0007_rekey_recommendationsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recommendationsnapshot',
+            name='degraded',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -0,0 +1,120 @@
+import hashlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+from .models import SongSignature, LSHBucket
+
+# Signature length and its split into LSH bands; songs share a bucket with
+# probability ~ 1 - (1 - J^ROWS)^BANDS, so the S-curve centres on J ~ (1/BANDS)^(1/ROWS) = 0.5
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+
+def _stable_hash(*parts) -> int:
+    """Signed 63-bit hash, stable across processes (unlike hash())"""
+    digest = hashlib.md5('|'.join(str(part) for part in parts).encode()).digest()
+    return int.from_bytes(digest[:8], 'little') >> 1
+
+
+@lru_cache(maxsize=50000)
+def _tag_randomness(tag: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """Per-tag r, c ~ Gamma(2, 1) and beta ~ U(0, 1) for every permutation, the same in every process"""
+    rng = np.random.default_rng(_stable_hash('icws', tag))
+    return rng.gamma(2.0, 1.0, NUM_PERM), rng.gamma(2.0, 1.0, NUM_PERM), rng.uniform(0.0, 1.0, NUM_PERM), _stable_hash('tag', tag)
+
+
+def weighted_minhash(tags: Dict[str, float]) -> Optional[np.ndarray]:
+    """
+    Improved consistent weighted sampling (Ioffe 2010) signature of a tag
+    profile: two profiles agree at a position with probability equal to
+    their weighted Jaccard similarity, as computed by calculate_tag_similarity.
+
+    Returns:
+        np.ndarray: NUM_PERM int64 hashes, None if the song has no positive weights
+    """
+    tags = {tag: weight for tag, weight in (tags or {}).items() if weight > 0}
+    if not tags:
+        return None
+
+    randomness = [_tag_randomness(tag) for tag in tags]
+    r = np.stack([item[0] for item in randomness])
+    c = np.stack([item[1] for item in randomness])
+    beta = np.stack([item[2] for item in randomness])
+    tag_ids = np.asarray([item[3] for item in randomness], dtype=np.int64)
+    log_weights = np.log(np.asarray(list(tags.values()), dtype=np.float64))[:, None]
+
+    t = np.floor(log_weights / r + beta)
+    a = c / (np.exp(r * (t - beta)) * np.exp(r))
+    chosen = np.argmin(a, axis=0)
+    chosen_t = t[chosen, np.arange(NUM_PERM)].astype(np.int64)
+
+    # One hash of (tag, t) per permutation
+    mixed = tag_ids[chosen] * np.int64(1000003) + chosen_t * np.int64(2654435761)
+    return mixed.astype(np.int64)
+
+
+def band_hashes(signature: np.ndarray) -> List[int]:
+    """Bucket of the signature in each band"""
+    return [
+        _stable_hash(band, signature[band * ROWS:(band + 1) * ROWS].tobytes().hex())
+        for band in range(BANDS)
+    ]
+
+
+def estimate_similarity(signature: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Estimated weighted Jaccard of a signature against rows of signatures"""
+    return (others == signature).mean(axis=1)
+
+
+def update_song_signature(song_id: int, tags: Dict[str, float]):
+    """Store a song's signature and LSH buckets, removing both if it has no tags"""
+    signature = weighted_minhash(tags)
+    with transaction.atomic():
+        LSHBucket.objects.filter(song_id=song_id).delete()
+        if signature is None:
+            SongSignature.objects.filter(song_id=song_id).delete()
+            return
+        SongSignature.objects.update_or_create(song_id=song_id, defaults={'signature': signature.tobytes()})
+        LSHBucket.objects.bulk_create([
+            LSHBucket(song_id=song_id, band=band, bucket=bucket)
+            for band, bucket in enumerate(band_hashes(signature))
+        ])
+
+
+def find_similar_songs(tags: Dict[str, float], max_distance: float = 0.5,
+                       exclude_song_id: Optional[int] = None) -> List[Tuple[int, float]]:
+    """
+    Songs whose tag profile is likely within weighted Jaccard distance
+    max_distance of tags, read from the LSH buckets; candidates are
+    filtered by their estimated similarity.
+
+    Args:
+        tags (Dict[str, float]): Tag profile to look up
+        max_distance (float, optional): Largest 1 - similarity returned. Defaults to 0.5.
+        exclude_song_id (int, optional): Song left out of the result, usually the query song.
+
+    Returns:
+        List[Tuple[int, float]]: (song_id, estimated similarity), most similar first
+    """
+    signature = weighted_minhash(tags)
+    if signature is None:
+        return []
+
+    buckets = Q()
+    for band, bucket in enumerate(band_hashes(signature)):
+        buckets |= Q(band=band, bucket=bucket)
+    candidate_ids = set(LSHBucket.objects.filter(buckets).values_list('song_id', flat=True))
+    candidate_ids.discard(exclude_song_id)
+    if not candidate_ids:
+        return []
+
+    song_ids, signatures = zip(*SongSignature.objects.filter(song_id__in=candidate_ids).values_list('song_id', 'signature'))
+    similarities = estimate_similarity(signature, np.stack([np.frombuffer(s, dtype=np.int64) for s in signatures]))
+
+    results = [(song_id, float(similarity)) for song_id, similarity in zip(song_ids, similarities)
+               if similarity >= 1.0 - max_distance]
+    results.sort(key=lambda x: x[1], reverse=True)
+    return results
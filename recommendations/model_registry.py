@@ -0,0 +1,267 @@
+import json
+import os
+import shutil
+import threading
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from .ann_index import IVFIndex, augment_with_bias
+from .quantization import quantize, quantization_report
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+VERSIONS_DIR = 'versions'
+# Model saved by the trainer before versioned bundles, published with import_legacy_model
+LEGACY_MODEL = 'model.keras'
+
+
+# Arrays making up a collaborative model on disk, one .npy file each so they can be memory-mapped
+MODEL_ARRAYS = (
+    'playlist_ids', 'song_ids',
+    'playlist_factors', 'song_factors',
+    'playlist_biases', 'song_biases',
+    'interaction_indptr', 'interaction_indices',
+)
+# Per-row scales, only written for int8 embeddings
+OPTIONAL_ARRAYS = ('playlist_scales', 'song_scales')
+
+
+def export_inference_bundle(
+    path: str,
+    playlist_ids: np.ndarray,
+    song_ids: np.ndarray,
+    playlist_factors: np.ndarray,
+    song_factors: np.ndarray,
+    playlist_biases: np.ndarray,
+    song_biases: np.ndarray,
+    interaction_indptr: np.ndarray,
+    interaction_indices: np.ndarray,
+    precision: str = 'float32',
+    held_out: List[np.ndarray] = (),
+    fold_in: Optional[Dict] = None
+) -> Dict[str, Dict[str, float]]:
+    """
+    Write embeddings, biases, id arrays and training interactions of a
+    collaborative model to disk. Ids must be sorted (as produced by
+    load_interactions) so lookups can use searchsorted instead of pickled dicts.
+
+    Args:
+        path (str): Directory to write the bundle to
+        playlist_ids (np.ndarray): Sorted, playlist_ids[index] = playlist_id
+        song_ids (np.ndarray): Sorted, song_ids[index] = song_id
+        playlist_factors (np.ndarray): Playlist embedding matrix
+        song_factors (np.ndarray): Song embedding matrix
+        playlist_biases (np.ndarray): Playlist bias vector
+        song_biases (np.ndarray): Song bias vector
+        interaction_indptr (np.ndarray): CSR row pointers of the training playlist x song matrix
+        interaction_indices (np.ndarray): CSR song indices of the training playlist x song matrix
+        precision (str, optional): Storage precision of the embeddings, see quantization.PRECISIONS.
+            Defaults to 'float32'.
+        held_out (List[np.ndarray], optional): Song rows of each playlist left out of training,
+            the quantization report is measured on them
+        fold_in (Dict, optional): Fold-in settings of the trainer, see quantization.top_k_overlap
+
+    Returns:
+        Dict[str, Dict[str, float]]: Top-k overlap against full precision and size for every precision
+    """
+    if np.any(np.diff(playlist_ids) <= 0) or np.any(np.diff(song_ids) <= 0):
+        raise ValueError("Playlist and song ids must be sorted and unique")
+    
+    arrays = {
+        'playlist_ids': np.asarray(playlist_ids, dtype=np.int64),
+        'song_ids': np.asarray(song_ids, dtype=np.int64),
+        'playlist_factors': np.asarray(playlist_factors, dtype=np.float32),
+        'song_factors': np.asarray(song_factors, dtype=np.float32),
+        'playlist_biases': np.asarray(playlist_biases, dtype=np.float32).ravel(),
+        'song_biases': np.asarray(song_biases, dtype=np.float32).ravel(),
+        'interaction_indptr': np.asarray(interaction_indptr, dtype=np.int64),
+        'interaction_indices': np.asarray(interaction_indices, dtype=np.int32),
+    }
+    report = quantization_report(
+        arrays['playlist_factors'], arrays['song_factors'], arrays['song_biases'], held_out=held_out, fold_in=fold_in
+    )
+    
+    # ANN index over full precision [v, b], so biased scores are a plain inner product search
+    IVFIndex.build(augment_with_bias(arrays['song_factors'], arrays['song_biases'])).save(path)
+    
+    arrays['playlist_factors'], playlist_scales = quantize(arrays['playlist_factors'], precision)
+    arrays['song_factors'], song_scales = quantize(arrays['song_factors'], precision)
+    if precision == 'int8':
+        arrays['playlist_scales'] = playlist_scales
+        arrays['song_scales'] = song_scales
+    
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(array))
+    
+    return report
+
+
+def load_inference_bundle(path: str, mmap_mode: Optional[str] = 'r') -> Dict[str, np.ndarray]:
+    """
+    Open the arrays of an exported collaborative model. With mmap_mode='r'
+    the arrays are memory-mapped, so every worker shares one page-cache copy.
+
+    Args:
+        path (str): Directory the bundle was written to
+        mmap_mode (str, optional): Passed to np.load. Defaults to 'r'.
+
+    Returns:
+        Dict[str, np.ndarray]: Arrays keyed by MODEL_ARRAYS and OPTIONAL_ARRAYS names
+    """
+    arrays = {
+        name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+        for name in MODEL_ARRAYS
+    }
+    for name in OPTIONAL_ARRAYS:
+        array_path = os.path.join(path, f'{name}.npy')
+        arrays[name] = np.load(array_path, mmap_mode=mmap_mode) if os.path.exists(array_path) else None
+    return arrays
+
+
+class ModelVersion:
+    """One published collaborative model version, loaded and kept warm"""
+
+    def __init__(self, version: str, path: str, arrays: Dict[str, np.ndarray], manifest: Dict):
+        self.version = version
+        self.path = path
+        self.arrays = arrays
+        self.manifest = manifest
+        self.ann_index = IVFIndex.load(path)
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of the collaborative model.
+
+    Training writes every model into its own directory under versions/ and
+    only then points manifest.json at it, so readers never see a
+    half-written model. The registry loads the version named by the
+    manifest once, re-checks the manifest at most every check_interval
+    seconds and swaps a new version in with a single reference assignment.
+    """
+
+    def __init__(self, check_interval: float = 5.0, keep_versions: int = 3):
+        self.check_interval = check_interval
+        self.keep_versions = keep_versions
+        self._current = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._warned_legacy = False
+
+    @property
+    def base_path(self) -> str:
+        return os.path.join(settings.MEDIA_ROOT, 'recommendation_model')
+
+    def reset(self):
+        """Forget the loaded version, the next get() reads the manifest again"""
+        with self._lock:
+            self._current = None
+            self._last_check = 0.0
+            self._warned_legacy = False
+
+    def read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self.base_path, MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def version_path(self, version: str) -> str:
+        return os.path.join(self.base_path, VERSIONS_DIR, version)
+
+    def current_version_path(self) -> Optional[str]:
+        """Directory of the version the manifest points at, None if nothing was published"""
+        manifest = self.read_manifest()
+        if not manifest:
+            return None
+        return self.version_path(manifest['version'])
+
+    def get(self) -> Optional[ModelVersion]:
+        """
+        Get the current model version, loading it if the manifest changed.
+
+        Returns:
+            ModelVersion: Current model, None if no model was published
+        """
+        current = self._current
+        if current is not None and time.monotonic() - self._last_check < self.check_interval:
+            return current
+
+        with self._lock:
+            self._last_check = time.monotonic()
+            manifest = self.read_manifest()
+            if not manifest:
+                self._warn_unpublished_legacy_model()
+                return self._current
+            if self._current and self._current.version == manifest['version']:
+                return self._current
+
+            path = self.version_path(manifest['version'])
+            try:
+                arrays = load_inference_bundle(path)
+            except Exception as e:
+                logger.error(f"Error loading model version {manifest['version']}: {e}")
+                return self._current
+
+            self._current = ModelVersion(manifest['version'], path, arrays, manifest)
+            logger.info(f"Loaded recommendation model version {manifest['version']}")
+            return self._current
+
+    def _warn_unpublished_legacy_model(self):
+        if not self._warned_legacy and os.path.exists(os.path.join(self.base_path, LEGACY_MODEL)):
+            logger.warning(
+                "No published recommendation model, but a legacy model.keras exists; "
+                "run `manage.py import_legacy_model` to serve it"
+            )
+            self._warned_legacy = True
+
+    def create_version(self) -> Tuple[str, str]:
+        """
+        Create an empty directory for a new model version.
+
+        Returns:
+            Tuple[str, str]: Version name and its directory
+        """
+        version = timezone.now().strftime('%Y%m%d%H%M%S%f')
+        path = self.version_path(version)
+        os.makedirs(path, exist_ok=True)
+        return version, path
+
+    def publish(self, version: str, **metadata):
+        """
+        Atomically point the manifest at a fully written version and
+        remove old versions beyond keep_versions.
+
+        Args:
+            version (str): Version created by create_version
+            **metadata: Extra fields stored in the manifest
+        """
+        manifest = {
+            'version': version,
+            'published_at': timezone.now().isoformat(),
+            **metadata
+        }
+        tmp_path = os.path.join(self.base_path, MANIFEST + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.base_path, MANIFEST))
+
+        # Make the next get() in this process pick up the new version
+        self._last_check = 0.0
+        self._prune_versions(keep=version)
+
+    def _prune_versions(self, keep: str):
+        versions_dir = os.path.join(self.base_path, VERSIONS_DIR)
+        versions = sorted(os.listdir(versions_dir), reverse=True)
+        for version in versions[self.keep_versions:]:
+            if version != keep:
+                shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+
+
+model_registry = ModelRegistry()
@@ -1,5 +1,9 @@
 from django.db import models
-from music.models import Song, Playlist, User
+from typing import Dict
+from music.models import Song, Playlist, User, SongTag
+
+# Tags below this weight do not count towards a playlist's tag profile
+PROFILE_MIN_TAG_WEIGHT = 0.3
 
 class PlaylistRecommendation(models.Model):
     """"Store precomputed scores, to not have to compute them every time."""
@@ -94,4 +98,169 @@ class RecommendationFeedback(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
-        unique_together = ['user', 'recommendation', 'action']
\ No newline at end of file
+        unique_together = ['user', 'recommendation', 'action']
+
+
+def song_tags_by_song(song_ids) -> Dict[int, Dict[str, float]]:
+    """{song_id: {tag: weight}} for the given songs (ids or an id subquery), songs without tags left out"""
+    tags = {}
+    for song_id, tag, weight in SongTag.objects.filter(song_id__in=song_ids).values_list('song_id', 'tag__name', 'weight'):
+        tags.setdefault(song_id, {})[tag] = weight
+    return tags
+
+
+class PlaylistTagProfile(models.Model):
+    """
+    Running per-tag sums of a playlist's songs, kept up to date by the
+    Playlist.songs m2m_changed signal so the tag profile never has to be
+    recomputed from the songs.
+    """
+    playlist = models.OneToOneField(Playlist, on_delete=models.CASCADE, related_name='tag_profile')
+    tag_totals = models.JSONField(default=dict, blank=True)  # {tag: [weight_sum, song_count]}
+    n_songs_with_tags = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    @classmethod
+    def build(cls, playlist_id: int) -> 'PlaylistTagProfile':
+        """Create or reset the profile of a playlist from its current songs"""
+        profile, _ = cls.objects.get_or_create(playlist_id=playlist_id)
+        profile.tag_totals = {}
+        profile.n_songs_with_tags = 0
+        for song_tags in song_tags_by_song(
+            Playlist.songs.through.objects.filter(playlist_id=playlist_id).values('song_id')
+        ).values():
+            profile.apply(song_tags)
+        profile.save()
+        return profile
+    
+    def apply(self, song_tags: Dict[str, float], sign: int = 1):
+        """Add (sign=1) or remove (sign=-1) one song's tags"""
+        if not song_tags:
+            return
+        
+        self.n_songs_with_tags += sign
+        for tag, weight in song_tags.items():
+            if weight < PROFILE_MIN_TAG_WEIGHT:
+                continue
+            weight_sum, count = self.tag_totals.get(tag, [0.0, 0])
+            weight_sum, count = weight_sum + sign * weight, count + sign
+            if count > 0:
+                self.tag_totals[tag] = [weight_sum, count]
+            else:
+                self.tag_totals.pop(tag, None)
+    
+    def profile(self, top_n: int = 20) -> Dict[str, float]:
+        """Normalized tag profile, the top_n tags by weight"""
+        if not self.n_songs_with_tags:
+            return {}
+        
+        avg_tag_profile = {}
+        for tag, (weight_sum, count) in self.tag_totals.items():
+            avg_weight = weight_sum / self.n_songs_with_tags
+            
+            frequency_boost = min(count / self.n_songs_with_tags, 1.0)
+            avg_tag_profile[tag] = avg_weight * (0.7 + 0.3 * frequency_boost)
+        
+        total_weight = sum(avg_tag_profile.values())
+        if total_weight > 0:
+            avg_tag_profile = {tag: weight / total_weight for tag, weight in avg_tag_profile.items()}
+        
+        return dict(sorted(avg_tag_profile.items(), key=lambda x: x[1], reverse=True)[:top_n])
+    
+    def __str__(self):
+        return f"{self.playlist.name} tag profile ({self.n_songs_with_tags} tagged songs)"
+
+
+
+class SongNeighbor(models.Model):
+    """One of a song's top-K most similar songs by weighted Jaccard over Last.fm tags"""
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='tag_neighbors')
+    neighbor = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='+')
+    similarity = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+    
+    class Meta:
+        unique_together = ['song', 'neighbor']
+        ordering = ['song', 'rank']
+        indexes = [
+            models.Index(fields=['song', 'rank']),
+            models.Index(fields=['neighbor']),
+        ]
+    
+    def __str__(self):
+        return f"{self.song} ~ {self.neighbor} ({self.similarity:.2f})"
+
+
+
+class SongSignature(models.Model):
+    """Weighted MinHash signature of a song's Last.fm tags, see recommendations.minhash"""
+    song = models.OneToOneField(Song, on_delete=models.CASCADE, related_name='tag_signature')
+    signature = models.BinaryField()  # NUM_PERM int64 hashes
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.song} signature"
+
+
+class LSHBucket(models.Model):
+    """Bucket of one band of a song's signature; songs sharing any bucket are similarity candidates"""
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='lsh_buckets')
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['band', 'bucket']),
+        ]
+    
+    def __str__(self):
+        return f"{self.song} band {self.band}"
+
+
+class RecommendationSnapshot(models.Model):
+    """
+    Ranked hybrid recommendations of one playlist and strategy, stored as
+    a single row. payload is the response as served, so reading
+    recommendations is one primary-key lookup with no joins or
+    serialization. A snapshot stays served after the collaborative model
+    is retrained until it is rebuilt, model_version records which model
+    computed it. A snapshot computed while components were degraded is
+    recomputed by the next read that can afford it. HybridRecommendation
+    rows are still written alongside for analytics.
+    """
+    key = models.CharField(max_length=128, primary_key=True)  # snapshot_key(playlist_id, strategy)
+    playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE, related_name='recommendation_snapshots')
+    strategy = models.CharField(max_length=50)
+    model_version = models.CharField(max_length=32, blank=True)  # '' when no collaborative model is published
+    song_ids = models.JSONField(default=list)    # Ranked, best first
+    scores = models.JSONField(default=list)      # Hybrid score per song
+    components = models.JSONField(default=dict)  # {component: [score per song]}
+    payload = models.JSONField(default=list)
+    degraded = models.JSONField(default=list)    # Components that failed or missed their deadline
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    @staticmethod
+    def snapshot_key(playlist_id: int, strategy: str) -> str:
+        return f"{playlist_id}:{strategy}"
+    
+    @classmethod
+    def get_payload(cls, playlist_id: int, strategy: str, include_degraded: bool = False):
+        """
+        Served recommendations of the snapshot, whatever model version
+        computed them. None if there is none, or if it was computed with
+        degraded components and include_degraded is False.
+        """
+        snapshot = cls.objects.filter(
+            key=cls.snapshot_key(playlist_id, strategy)
+        ).values_list('payload', 'degraded').first()
+        if snapshot is None or (snapshot[1] and not include_degraded):
+            return None
+        return snapshot[0]
+    
+    @classmethod
+    def stale_playlist_ids(cls, model_version: str):
+        """IDs of playlists with a snapshot computed by another model version"""
+        return cls.objects.exclude(model_version=model_version).values_list('playlist_id', flat=True).distinct()
+    
+    def __str__(self):
+        return f"{self.playlist} {self.strategy} ({self.model_version or 'no model'})"
@@ -0,0 +1,197 @@
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from .utils import fold_in_vector
+
+PRECISIONS = ('float32', 'float16', 'int8')
+
+# Rows dequantized at a time when scoring, small enough to stay in cache
+SCORE_BLOCK_ROWS = 16384
+
+
+def quantize(matrix: np.ndarray, precision: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Store an embedding matrix at lower precision.
+
+    Args:
+        matrix (np.ndarray): Full precision matrix, one embedding per row
+        precision (str): One of PRECISIONS
+
+    Returns:
+        Tuple[np.ndarray, Optional[np.ndarray]]: Stored values and per-row scales (int8 only)
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+
+    if precision == 'float32':
+        return matrix, None
+    if precision == 'float16':
+        return matrix.astype(np.float16), None
+    if precision == 'int8':
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        values = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return values, scales.astype(np.float32)
+
+    raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+
+
+def dequantize(values: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """Float32 copy of stored rows; pass the matching rows of scales for int8"""
+    matrix = np.array(values, dtype=np.float32)
+    if scales is not None:
+        matrix *= np.asarray(scales, dtype=np.float32)[:, None]
+    return matrix
+
+
+def matmul(values: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+    """
+    Compute dequantize(values) @ query block by block, so low precision rows
+    are only widened to float32 a cache-sized block at a time.
+
+    Args:
+        values (np.ndarray): Stored rows (n, dim)
+        scales (np.ndarray, optional): Per-row scales (n,) for int8
+        query (np.ndarray): Vector (dim,) or matrix (dim, m)
+
+    Returns:
+        np.ndarray: Scores (n,) or (n, m)
+    """
+    query = np.asarray(query, dtype=np.float32)
+    if values.dtype == np.float32:
+        return np.asarray(values) @ query
+
+    scores = np.empty((len(values),) + query.shape[1:], dtype=np.float32)
+    for start in range(0, len(values), SCORE_BLOCK_ROWS):
+        end = start + SCORE_BLOCK_ROWS
+        block_scales = scales[start:end] if scales is not None else None
+        scores[start:end] = dequantize(values[start:end], block_scales) @ query
+    return scores
+
+
+def gram(values: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    """dequantize(values).T @ dequantize(values) in float64, accumulated block by block"""
+    result = np.zeros((values.shape[1], values.shape[1]), dtype=np.float64)
+    for start in range(0, len(values), SCORE_BLOCK_ROWS):
+        end = start + SCORE_BLOCK_ROWS
+        block = dequantize(values[start:end], scales[start:end] if scales is not None else None).astype(np.float64)
+        result += block.T @ block
+    return result
+
+
+def row_norms(values: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    """L2 norm of every dequantized row, computed block by block"""
+    norms = np.empty(len(values), dtype=np.float32)
+    for start in range(0, len(values), SCORE_BLOCK_ROWS):
+        end = start + SCORE_BLOCK_ROWS
+        block = dequantize(values[start:end], scales[start:end] if scales is not None else None)
+        norms[start:end] = np.linalg.norm(block, axis=1)
+    return norms
+
+
+def fold_in_playlists(song_factors: np.ndarray, song_biases: np.ndarray,
+                      held_out: List[np.ndarray], fold_in: Dict) -> np.ndarray:
+    """Vectors of the held-out playlists folded in against song_factors the way the trainer's engine serves them"""
+    song_gram = gram(song_factors, None) if fold_in.get('engine') == 'als' else None
+    return np.stack([
+        fold_in_vector(
+            song_factors[rows],
+            song_biases=song_biases[rows],
+            song_gram=song_gram,
+            alpha=fold_in.get('alpha', 40.0),
+            regularization=fold_in.get('regularization', 0.1)
+        )
+        for rows in held_out
+    ])
+
+
+def top_k_overlap(
+    song_factors: np.ndarray,
+    song_biases: np.ndarray,
+    held_out: List[np.ndarray],
+    fold_in: Dict,
+    precision: str,
+    k: int = 20
+) -> Optional[float]:
+    """
+    Mean overlap between full precision and quantized top-k songs of
+    playlists held out of training. Each playlist is folded in from its
+    songs against the song factors being scored, as playlists the model
+    was not trained on are served, so quantization error reaches both the
+    playlist vector and the scores. The playlist's own songs are left out.
+
+    Args:
+        song_factors (np.ndarray): Full precision song embeddings
+        song_biases (np.ndarray): Song biases
+        held_out (List[np.ndarray]): Song rows of each held-out playlist
+        fold_in (Dict): Fold-in settings of the trainer: engine, and alpha and regularization
+        precision (str): Precision to evaluate
+        k (int, optional): Recommendations compared per playlist. Defaults to 20.
+
+    Returns:
+        Optional[float]: Mean |top-k full ∩ top-k quantized| / k, 1.0 is lossless.
+            None without held-out playlists.
+    """
+    if not held_out:
+        return None
+    k = min(k, len(song_factors) - max(len(rows) for rows in held_out))
+    if k <= 0:
+        return 1.0
+
+    song_factors = np.asarray(song_factors, dtype=np.float32)
+    song_biases = np.asarray(song_biases, dtype=np.float32)
+    song_values, song_scales = quantize(song_factors, precision)
+    exact_vectors = fold_in_playlists(song_factors, song_biases, held_out, fold_in)
+    approx_vectors = fold_in_playlists(dequantize(song_values, song_scales), song_biases, held_out, fold_in)
+
+    overlaps = []
+    for start in range(0, len(held_out), 16):
+        block = slice(start, start + 16)
+        exact = (song_factors @ exact_vectors[block].T).T + song_biases
+        approx = matmul(song_values, song_scales, approx_vectors[block].T).T + song_biases
+        for row, songs in enumerate(held_out[block]):
+            exact[row, songs] = -np.inf
+            approx[row, songs] = -np.inf
+
+        exact_top = np.argpartition(-exact, k - 1, axis=1)[:, :k]
+        approx_top = np.argpartition(-approx, k - 1, axis=1)[:, :k]
+        overlaps.extend(len(np.intersect1d(e, a)) / k for e, a in zip(exact_top, approx_top))
+
+    return float(np.mean(overlaps))
+
+
+def quantization_report(
+    playlist_factors: np.ndarray,
+    song_factors: np.ndarray,
+    song_biases: np.ndarray,
+    held_out: List[np.ndarray] = (),
+    fold_in: Optional[Dict] = None,
+    k: int = 20
+) -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    Top-k overlap on held-out playlists and embedding storage size for
+    every precision. float32 is the reference, its overlap is 1.0 by
+    definition and its size is the baseline for the others.
+    """
+    report = {}
+    for precision in PRECISIONS:
+        song_values, song_scales = quantize(song_factors, precision)
+        playlist_values, playlist_scales = quantize(playlist_factors, precision)
+        n_bytes = sum(a.nbytes for a in (song_values, song_scales, playlist_values, playlist_scales) if a is not None)
+        if precision == 'float32':
+            overlap = 1.0
+        else:
+            overlap = top_k_overlap(song_factors, song_biases, list(held_out), fold_in or {}, precision, k=k)
+        report[precision] = {
+            'top_k_overlap': overlap,
+            'megabytes': n_bytes / 2 ** 20,
+        }
+    return report
+
+
+def format_report(report: Dict[str, Dict[str, Optional[float]]]) -> str:
+    """One line per precision, for training output"""
+    lines = []
+    for precision, stats in report.items():
+        overlap = stats['top_k_overlap']
+        overlap = 'n/a, no held-out playlists' if overlap is None else f"{overlap:.3f}"
+        lines.append(f"{precision}: top-k overlap {overlap}, {stats['megabytes']:.1f} MB")
+    return '\n'.join(lines)
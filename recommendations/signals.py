@@ -0,0 +1,94 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+from music.models import Playlist, Song
+from lastfm.queue import enqueue_songs, stale_songs_q
+from music.signals import song_tags_changed
+from .models import PlaylistTagProfile, song_tags_by_song
+from .minhash import update_song_signature
+
+
+def update_tag_profiles(playlist_ids, song_tags, sign: int):
+    """
+    Add (sign=1) or remove (sign=-1) songs from the tag profiles of the
+    given playlists. A playlist without a profile gets one built from its
+    current songs instead.
+
+    Args:
+        playlist_ids: Playlists to update
+        song_tags (Dict[int, Dict[str, float]]): Tags of the added or removed songs
+        sign (int): 1 for added songs, -1 for removed ones
+    """
+    for playlist_id in playlist_ids:
+        with transaction.atomic():
+            profile = PlaylistTagProfile.objects.select_for_update().filter(playlist_id=playlist_id).first()
+            if profile is None:
+                PlaylistTagProfile.build(playlist_id)
+                continue
+            for tags in song_tags.values():
+                profile.apply(tags, sign)
+            profile.save()
+
+
+@receiver(m2m_changed, sender=Playlist.songs.through)
+def playlist_songs_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep tag profiles in step with Playlist.songs, from either side of the relation"""
+    if action in ('pre_remove', 'pre_clear'):
+        # remove() reports every id it was given, remember the ones that are actually linked
+        if reverse:
+            linked = sender.objects.filter(song_id=instance.pk).values_list('playlist_id', flat=True)
+            if pk_set is not None:
+                linked = linked.filter(playlist_id__in=pk_set)
+        else:
+            linked = sender.objects.filter(playlist_id=instance.pk).values_list('song_id', flat=True)
+            if pk_set is not None:
+                linked = linked.filter(song_id__in=pk_set)
+        instance._tag_profile_unlinked = set(linked)
+        return
+    
+    if action in ('post_remove', 'post_clear'):
+        pk_set = getattr(instance, '_tag_profile_unlinked', set())
+        sign = -1
+    elif action == 'post_add':
+        sign = 1
+        # Added songs without fresh Last.fm tags are enriched in the background
+        if pk_set:
+            added = [instance.pk] if reverse else pk_set
+            enqueue_songs(Song.objects.filter(stale_songs_q(), id__in=added).values_list('id', flat=True))
+    else:
+        return
+    
+    if not pk_set:
+        return
+    if reverse:
+        update_tag_profiles(pk_set, song_tags_by_song([instance.pk]), sign)
+    else:
+        update_tag_profiles([instance.pk], song_tags_by_song(pk_set), sign)
+
+
+@receiver(pre_delete, sender=Song)
+def song_deleted(sender, instance, **kwargs):
+    """Remove a deleted song from its playlists' tag profiles, the cascade does not send m2m_changed"""
+    # Playlists without a profile build one on first read, without the song
+    playlist_ids = instance.playlists.filter(tag_profile__isnull=False).values_list('id', flat=True)
+    update_tag_profiles(list(playlist_ids), song_tags_by_song([instance.pk]), -1)
+
+
+@receiver(song_tags_changed)
+def song_tags_updated(sender, song, old_tags, new_tags, **kwargs):
+    """Swap a re-tagged song's old tags for its new ones in every playlist containing it"""
+    for playlist_id in song.playlists.values_list('id', flat=True):
+        with transaction.atomic():
+            profile = PlaylistTagProfile.objects.select_for_update().filter(playlist_id=playlist_id).first()
+            if profile is None:
+                PlaylistTagProfile.build(playlist_id)
+                continue
+            profile.apply(old_tags, -1)
+            profile.apply(new_tags, 1)
+            profile.save()
+
+
+@receiver(song_tags_changed)
+def song_signature_updated(sender, song, old_tags, new_tags, **kwargs):
+    """Re-sign a re-tagged song and move it to its new LSH buckets"""
+    update_song_signature(song.id, new_tags)
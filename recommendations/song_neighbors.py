@@ -0,0 +1,92 @@
+import numpy as np
+import scipy.sparse as sp
+from typing import Tuple
+
+# Weight levels of the quantized candidate pass, min(a, b) ~ #levels both reach / LEVELS
+LEVELS = 10
+
+# Set in every worker process by init_worker
+_weights = None
+_level_matrices = None
+_row_sums = None
+
+
+def level_matrices(weights: sp.csr_matrix, levels: int = LEVELS) -> list:
+    """
+    Binary matrices B_l = [w >= l / levels] for l = 1..levels, so that
+    sum_l B_l[i] . B_l[j] / levels approximates sum_t min(w_it, w_jt)
+    with plain sparse products.
+    """
+    matrices = []
+    for level in range(1, levels + 1):
+        reached = weights.copy()
+        reached.data = (reached.data >= level / levels).astype(np.float32)
+        reached.eliminate_zeros()
+        matrices.append(reached)
+    return matrices
+
+
+def init_worker(weights: sp.csr_matrix):
+    global _weights, _level_matrices, _row_sums
+    _weights = weights
+    _level_matrices = [(matrix, matrix.T.tocsr()) for matrix in level_matrices(weights)]
+    _row_sums = np.asarray(weights.sum(axis=1)).ravel()
+
+
+def exact_weighted_jaccard(weights: sp.csr_matrix, row_sums: np.ndarray,
+                           rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """calculate_tag_similarity for every (rows[i], cols[i]) pair of matrix rows"""
+    intersection = np.asarray(weights[rows].minimum(weights[cols]).sum(axis=1)).ravel()
+    union = row_sums[rows] + row_sums[cols] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-10), 0.0)
+
+
+def compute_block(args: Tuple[int, int, int, int]) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Top-k neighbours of rows start..end of the tag matrix, run in a worker.
+
+    Candidates come from the quantized intersections of the block against
+    every row (one sparse product per level); the best k * rerank_factor
+    of each row are rescored with the exact weighted Jaccard.
+
+    Returns:
+        Tuple: (start, rows, neighbour rows, similarities), pairs grouped by row, best first
+    """
+    start, end, k, rerank_factor = args
+    block = slice(start, end)
+
+    intersection = None
+    for reached, reached_t in _level_matrices:
+        product = reached[block] @ reached_t
+        intersection = product if intersection is None else intersection + product
+    intersection = sp.csr_matrix(intersection / LEVELS)
+
+    pair_rows, pair_cols = [], []
+    for i in range(end - start):
+        row = start + i
+        cols = intersection.indices[intersection.indptr[i]:intersection.indptr[i + 1]]
+        approx = intersection.data[intersection.indptr[i]:intersection.indptr[i + 1]]
+        not_self = cols != row
+        cols, approx = cols[not_self], approx[not_self]
+        if not len(cols):
+            continue
+        approx = approx / (_row_sums[row] + _row_sums[cols] - approx)
+
+        n_candidates = min(k * rerank_factor, len(cols))
+        pair_cols.append(cols[np.argpartition(-approx, n_candidates - 1)[:n_candidates]])
+        pair_rows.append(np.full(n_candidates, row))
+
+    if not pair_rows:
+        empty = np.array([], dtype=np.int64)
+        return start, empty, empty, np.array([], dtype=np.float32)
+
+    # Exact rerank of every candidate pair of the block at once
+    rows = np.concatenate(pair_rows)
+    cols = np.concatenate(pair_cols)
+    exact = exact_weighted_jaccard(_weights, _row_sums, rows, cols)
+
+    order = np.lexsort((-exact, rows))
+    rows, cols, exact = rows[order], cols[order], exact[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = (rank < k) & (exact > 0)
+    return start, rows[keep], cols[keep], exact[keep].astype(np.float32)
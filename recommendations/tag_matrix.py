@@ -0,0 +1,240 @@
+import os
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import scipy.sparse as sp
+from music.models import Song
+from .utils import FileStore
+
+TAG_MATRIX_FILE = 'tag_matrix.npz'
+# Songs read per query by TagMatrix.update_songs
+UPDATE_CHUNK_SIZE = 900
+
+
+class TagMatrix:
+    """
+    Last.fm tags of every tagged song as a sparse songs x tag-vocabulary
+    matrix, with listener counts and artist codes alongside so a playlist
+    profile can be scored against the whole catalog without loading Song rows.
+
+    The transpose is kept as an inverted index: posting list of tag t is
+    posting_rows[posting_indptr[t]:posting_indptr[t + 1]], the rows tagged
+    with t ordered by descending weight, so retrieval can stop early.
+    """
+
+    def __init__(self, song_ids: np.ndarray, vocabulary: np.ndarray, weights: sp.csr_matrix,
+                 listeners: np.ndarray, artist_codes: np.ndarray, artists: np.ndarray,
+                 postings: Optional[tuple] = None):
+        self.song_ids = song_ids          # sorted, song_ids[row] = song_id
+        self.vocabulary = vocabulary      # vocabulary[column] = tag
+        self.weights = weights            # CSR (n_songs, n_tags), explicit entries are the song's tags
+        self.listeners = listeners        # Last.fm listeners per row, 0 if unknown
+        self.artist_codes = artist_codes  # artists[artist_codes[row]] = artist
+        self.artists = artists
+        self.tag_columns = {tag: column for column, tag in enumerate(vocabulary)}
+        self.posting_indptr, self.posting_rows, self.posting_weights = postings or self._build_postings(weights)
+        self._boosts = {}
+
+    def __len__(self) -> int:
+        return len(self.song_ids)
+
+    @staticmethod
+    def _build_postings(weights: sp.csr_matrix) -> tuple:
+        """Posting lists of every tag, sorted by descending weight"""
+        columns = weights.tocsc()
+        column_of_entry = np.repeat(np.arange(columns.shape[1]), np.diff(columns.indptr))
+        order = np.lexsort((-columns.data, column_of_entry))
+        return (
+            columns.indptr.astype(np.int64),
+            columns.indices[order].astype(np.int32),
+            columns.data[order].astype(np.float32)
+        )
+
+    def posting_list(self, column: int) -> tuple:
+        """(rows, weights) tagged with the column's tag, highest weight first"""
+        start, end = self.posting_indptr[column], self.posting_indptr[column + 1]
+        return self.posting_rows[start:end], self.posting_weights[start:end]
+
+    @classmethod
+    def from_rows(cls, rows: Iterable) -> 'TagMatrix':
+        """
+        Build the matrix from (id, artist, lastfm_listeners, lastfm_tags) rows sorted by id.
+        """
+        song_ids, listeners, artist_codes = [], [], []
+        indptr, indices, data = [0], [], []
+        tag_columns, artist_codes_by_name = {}, {}
+
+        for song_id, artist, song_listeners, tags in rows:
+            if not tags:
+                continue
+            song_ids.append(song_id)
+            listeners.append(song_listeners or 0)
+            artist_codes.append(artist_codes_by_name.setdefault(artist, len(artist_codes_by_name)))
+            for tag, weight in tags.items():
+                indices.append(tag_columns.setdefault(tag, len(tag_columns)))
+                data.append(weight)
+            indptr.append(len(indices))
+
+        weights = sp.csr_matrix(
+            (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+            shape=(len(song_ids), len(tag_columns))
+        )
+        return cls(
+            np.asarray(song_ids, dtype=np.int64),
+            np.asarray(list(tag_columns), dtype=str),
+            weights,
+            np.asarray(listeners, dtype=np.float32),
+            np.asarray(artist_codes, dtype=np.int32),
+            np.asarray(list(artist_codes_by_name), dtype=str)
+        )
+
+    @classmethod
+    def build(cls, chunk_size: int = 2000) -> 'TagMatrix':
+        """Build the matrix from every tagged song in the database"""
+        return cls.from_rows(_tagged_song_rows(Song.objects.all(), chunk_size))
+
+    def update_songs(self, song_ids: List[int]) -> 'TagMatrix':
+        """
+        Matrix with the rows of the given songs re-read from the database.
+        Songs that lost their tags or were deleted are dropped, new tags
+        extend the vocabulary.
+        """
+        song_ids = sorted(set(song_ids))
+        # Chunked so large batches stay under the database's query parameter limit
+        changed = TagMatrix.from_rows(
+            row
+            for start in range(0, len(song_ids), UPDATE_CHUNK_SIZE)
+            for row in _tagged_song_rows(Song.objects.filter(id__in=song_ids[start:start + UPDATE_CHUNK_SIZE]))
+        )
+        keep = ~np.isin(self.song_ids, np.asarray(song_ids, dtype=np.int64))
+
+        vocabulary = list(self.vocabulary)
+        tag_columns = dict(self.tag_columns)
+        for tag in changed.vocabulary:
+            tag_columns.setdefault(tag, len(tag_columns))
+        vocabulary.extend(list(tag_columns)[len(vocabulary):])
+
+        artists = list(self.artists)
+        artist_codes_by_name = {artist: code for code, artist in enumerate(artists)}
+        for artist in changed.artists:
+            artist_codes_by_name.setdefault(artist, len(artist_codes_by_name))
+        artists.extend(list(artist_codes_by_name)[len(artists):])
+
+        # Re-map the changed rows' columns and artist codes into the merged vocabularies
+        changed_columns = np.asarray([tag_columns[tag] for tag in changed.vocabulary], dtype=np.int32)
+        changed_weights = sp.csr_matrix(
+            (changed.weights.data, changed_columns[changed.weights.indices], changed.weights.indptr),
+            shape=(len(changed), len(vocabulary))
+        )
+        changed_artists = np.asarray([artist_codes_by_name[artist] for artist in changed.artists], dtype=np.int32)
+
+        kept_weights = self.weights[keep]
+        kept_weights.resize((kept_weights.shape[0], len(vocabulary)))
+
+        song_ids = np.concatenate([self.song_ids[keep], changed.song_ids])
+        order = np.argsort(song_ids, kind='stable')
+        return TagMatrix(
+            song_ids[order],
+            np.asarray(vocabulary, dtype=str),
+            sp.vstack([kept_weights, changed_weights], format='csr')[order],
+            np.concatenate([self.listeners[keep], changed.listeners])[order],
+            np.concatenate([self.artist_codes[keep], changed_artists[changed.artist_codes]])[order],
+            np.asarray(artists, dtype=str)
+        )
+
+    def boost_vector(self, boost_factors: Dict[str, float]) -> np.ndarray:
+        """Per-column boost, 1.0 for tags without a boost factor"""
+        key = tuple(sorted(boost_factors.items()))
+        if key not in self._boosts:
+            boosts = np.ones(len(self.vocabulary), dtype=np.float32)
+            for tag, boost in boost_factors.items():
+                if tag in self.tag_columns:
+                    boosts[self.tag_columns[tag]] = boost
+            self._boosts[key] = boosts
+        return self._boosts[key]
+
+    def artist_mask(self, artists: Iterable[str]) -> np.ndarray:
+        """True for rows whose artist is in artists"""
+        return np.isin(self.artists[self.artist_codes], list(artists))
+
+    def save(self, path: str):
+        """Write the matrix to one .npz file, replacing any previous one atomically"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                song_ids=self.song_ids,
+                vocabulary=self.vocabulary,
+                data=self.weights.data,
+                indices=self.weights.indices,
+                indptr=self.weights.indptr,
+                listeners=self.listeners,
+                artist_codes=self.artist_codes,
+                artists=self.artists,
+                posting_indptr=self.posting_indptr,
+                posting_rows=self.posting_rows,
+                posting_weights=self.posting_weights
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'TagMatrix':
+        with np.load(path) as arrays:
+            weights = sp.csr_matrix(
+                (arrays['data'], arrays['indices'], arrays['indptr']),
+                shape=(len(arrays['song_ids']), len(arrays['vocabulary']))
+            )
+            return cls(
+                arrays['song_ids'], arrays['vocabulary'], weights,
+                arrays['listeners'], arrays['artist_codes'], arrays['artists'],
+                postings=(arrays['posting_indptr'], arrays['posting_rows'], arrays['posting_weights'])
+            )
+
+
+def _tagged_song_rows(queryset, chunk_size: int = 2000):
+    return queryset.exclude(
+        lastfm_tags={}
+    ).exclude(
+        lastfm_tags__isnull=True
+    ).order_by('id').values_list(
+        'id', 'artist', 'lastfm_listeners', 'lastfm_tags'
+    ).iterator(chunk_size=chunk_size)
+
+
+class TagMatrixStore(FileStore):
+    """Process-wide access to the persisted tag matrix"""
+
+    def __init__(self, check_interval: float = 5.0):
+        super().__init__(os.path.join('tag_index', TAG_MATRIX_FILE), TagMatrix.load, check_interval)
+
+    def rebuild(self) -> TagMatrix:
+        """Build the matrix from scratch and persist it"""
+        with self.write_lock():
+            matrix = TagMatrix.build()
+            self.publish(matrix)
+        return matrix
+
+    def update_songs(self, song_ids: List[int]) -> Optional[TagMatrix]:
+        """
+        Re-read the given songs into the persisted matrix. Does nothing if
+        the matrix was never built, the next rebuild picks the songs up.
+        
+        Merges into the file as it is on disk under the write lock, so
+        concurrent writers keep each other's rows. Every call rebuilds the
+        posting lists and rewrites the whole file, so callers should
+        collect songs and update them in large batches.
+        """
+        if not song_ids:
+            return self.get()
+        with self.write_lock():
+            matrix = self.load_latest()
+            if matrix is None:
+                return None
+            matrix = matrix.update_songs(song_ids)
+            self.publish(matrix)
+        return matrix
+
+
+tag_matrix_store = TagMatrixStore()
@@ -1,17 +1,59 @@
 import unittest
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import tensorflow as tf
-from django.test import TestCase
-from recommendations.models import PlaylistRecommendation
+from django.test import TestCase, override_settings
+from recommendations.models import PlaylistRecommendation, PlaylistTagProfile, HybridRecommendation, RecommendationSnapshot, SongNeighbor
 from music.models import Playlist, Song
-from recommendations.colaborative_recommender import PlaylistRecommender
+from music.utils import song_match_key, resolve_match_keys, BoundedExecutor
+from recommendations.collaborative_recommender import PlaylistRecommender
+from recommendations.utils import top_k_indices, hold_out_playlists
+from recommendations.inference_recommender import InferenceRecommender, _derived_cache
+from recommendations.model_registry import model_registry
+from recommendations.als_recommender import ALSRecommender
+from recommendations.ann_index import IVFIndex
+from recommendations.tag_matrix import TagMatrix, tag_matrix_store
+from recommendations.song_neighbors import init_worker, compute_block
+from recommendations.audio_embeddings import audio_index_store, AudioEmbeddingIndex, feature_matrix, audio_feature_rows
+from recommendations.context import RecommendationContext
+from recommendations.hybrid_recommender import HybridRecommender, COMPONENTS, RANKED_COMPONENTS, current_model_version
+from recommendations.minhash import weighted_minhash, estimate_similarity, find_similar_songs
+from lastfm.utils import calculate_tag_similarity
+from lastfm.models import EnrichmentTask
+from recommendations.content_recommender import LastFMContentRecommender
+from recommendations.quantization import quantize, dequantize, top_k_overlap, quantization_report
 from django.conf import settings
 import os
 from accounts.models import User
 
-class TestPlaylistRecommender(TestCase):
+
+class IsolatedMediaMixin:
+    """Run against a temporary MEDIA_ROOT, so models and indexes written by tests never replace the served ones."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        for store in (model_registry, tag_matrix_store, audio_index_store):
+            store.reset()
+            self.addCleanup(store.reset)
+        # Cached by model version, which a fresh registry may hand out again
+        _derived_cache.clear()
+        self.addCleanup(_derived_cache.clear)
+        super().setUp()
+
+
+class TestPlaylistRecommender(IsolatedMediaMixin, TestCase):
     def setUp(self):
         """Set up test data and recommender instance."""
+        super().setUp()
         self.recommender = PlaylistRecommender(n_factors=10, n_epochs=5, batch_size=32)
         
         self.song1 = Song.objects.create(
@@ -96,14 +138,16 @@ class TestPlaylistRecommender(TestCase):
         self.recommender.train()
         self.recommender.save_model()
         
-        self.assertTrue(os.path.exists(os.path.join(self.recommender.model_path, 'model.keras')), "Model not saved")
-        self.assertTrue(os.path.exists(os.path.join(self.recommender.model_path, 'encoders.pkl')), "Encoders not saved")
+        self.assertTrue(os.path.exists(os.path.join(self.recommender.version_path, 'model.keras')), "Model not saved")
+        self.assertTrue(os.path.exists(os.path.join(self.recommender.version_path, 'playlist_ids.npy')), "Id arrays not saved")
+        self.assertEqual(model_registry.current_version_path(), self.recommender.version_path, "Version not published")
         
         new_recommender = PlaylistRecommender()
         success = new_recommender.load_model()
         self.assertTrue(success, "Failed to load model")
         
-        self.assertEqual(new_recommender.playlist_encoder, self.recommender.playlist_encoder, "Playlist encoder mismatch")
+        self.assertTrue(np.array_equal(new_recommender.playlist_ids, self.recommender.playlist_ids), "Playlist ids mismatch")
+        self.assertTrue(np.all(np.diff(new_recommender.playlist_ids) > 0), "Playlist ids not sorted")
 
     def test_recommend_for_playlist(self):
         """Test recommendation generation."""
@@ -138,5 +182,556 @@ class TestPlaylistRecommender(TestCase):
         embedding = self.recommender.get_playlist_embedding(9999)
         self.assertIsNone(embedding, "Embedding should be None for invalid playlist")
 
+    def test_recommend_matches_model_predict(self):
+        """Test NumPy scoring agrees with Keras predictions."""
+        self.recommender.train()
+        recommendations = self.recommender.recommend_for_playlist(self.playlist1.id, n_recommendations=1)
+        song_id, score = recommendations[0]
+        
+        prediction = self.recommender.model.predict([
+            np.array([self.recommender.playlist_encoder[self.playlist1.id]]),
+            np.array([self.recommender.song_encoder[song_id]])
+        ]).flatten()[0]
+        self.assertAlmostEqual(score, float(prediction), places=4)
+
+
+    def test_inference_bundle(self):
+        """Test the NumPy bundle serves the same recommendations as the Keras model."""
+        self.recommender.train()
+        
+        inference = InferenceRecommender()
+        self.assertTrue(inference.load_model(), "Failed to load inference bundle")
+        self.assertEqual(
+            inference.recommend_for_playlist(self.playlist1.id, n_recommendations=2),
+            self.recommender.recommend_for_playlist(self.playlist1.id, n_recommendations=2)
+        )
+    
+    def test_zero_probe_forces_exact_search(self):
+        """Test n_probe=0 skips the ANN index even when a default is configured."""
+        self.recommender.train()
+        
+        inference = InferenceRecommender()
+        self.assertTrue(inference.load_model(), "Failed to load inference bundle")
+        exact = inference.recommend_for_playlist(self.playlist1.id, n_recommendations=2)
+        
+        inference.default_n_probe = 1
+        self.assertIsNotNone(inference.ann_index)
+        inference.ann_index.probe = lambda *args: self.fail("n_probe=0 searched the ANN index")
+        self.assertEqual(inference.recommend_for_playlist(self.playlist1.id, n_recommendations=2, n_probe=0), exact)
+
+    def test_als_train(self):
+        """Test the ALS engine publishes a model the inference recommender can serve."""
+        als = ALSRecommender(n_factors=4, n_iterations=3)
+        stats = als.train()
+        self.assertIsNotNone(stats, "ALS training failed")
+        
+        inference = InferenceRecommender()
+        recommendations = inference.recommend_for_playlist(self.playlist1.id, n_recommendations=2)
+        self.assertEqual([song_id for song_id, _ in recommendations], [self.song3.id])
+
+    def test_fold_in_new_playlist(self):
+        """Test playlists created after training are folded in instead of skipped."""
+        ALSRecommender(n_factors=4, n_iterations=3).train()
+        
+        playlist3 = Playlist.objects.create(name="Playlist 3", user=User.objects.create(username="testuser3"))
+        playlist3.songs.add(self.song1)
+        
+        inference = InferenceRecommender()
+        recommendations = inference.recommend_for_playlist(playlist3.id, n_recommendations=2)
+        self.assertEqual(len(recommendations), 2, "New playlist should get recommendations")
+        self.assertNotIn(self.song1.id, [song_id for song_id, _ in recommendations])
+        self.assertIsNotNone(inference.get_playlist_embedding(playlist3.id))
+
+    def test_update_all_recommendations(self):
+        """Test batched refresh stores the same songs as per-playlist scoring."""
+        ALSRecommender(n_factors=4, n_iterations=3).train()
+        
+        inference = InferenceRecommender()
+        updated = inference.update_all_recommendations(n_recommendations=2, block_size=1)
+        self.assertEqual(updated, 2)
+        
+        stored = PlaylistRecommendation.objects.filter(
+            playlist=self.playlist1, recommendation_type='collaborative'
+        ).values_list('song_id', flat=True)
+        expected = [song_id for song_id, _ in inference.recommend_for_playlist(self.playlist1.id, n_recommendations=2)]
+        self.assertEqual(sorted(stored), sorted(expected))
+
+    def test_similar_songs(self):
+        """Test similar-song lookup never returns the song itself."""
+        ALSRecommender(n_factors=4, n_iterations=3).train()
+        
+        similar = InferenceRecommender().similar_songs(self.song1.id, n_recommendations=5)
+        self.assertEqual(sorted(song_id for song_id, _ in similar), sorted([self.song2.id, self.song3.id]))
+
+
+class TestTopKIndices(TestCase):
+    def test_top_k_order(self):
+        """Test top-k returns best indices first."""
+        scores = np.array([0.1, 0.9, 0.5, 0.7])
+        self.assertEqual(list(top_k_indices(scores, 2)), [1, 3])
+    
+    def test_top_k_exclude(self):
+        """Test masked indices are never returned."""
+        scores = np.array([0.1, 0.9, 0.5, 0.7])
+        exclude = np.array([False, True, False, True])
+        self.assertEqual(list(top_k_indices(scores, 5, exclude=exclude)), [2, 0])
+
+
+class TestIVFIndex(TestCase):
+    def test_full_probe_is_exact(self):
+        """Test probing every list returns every indexed row."""
+        vectors = np.random.default_rng(0).standard_normal((200, 8)).astype(np.float32)
+        index = IVFIndex.build(vectors, n_lists=10)
+        self.assertEqual(sorted(index.probe(vectors[0], n_probe=10)), list(range(200)))
+
+
+class TestQuantization(TestCase):
+    def test_int8_round_trip(self):
+        """Test int8 rows dequantize to within half a quantization step."""
+        matrix = np.random.default_rng(0).standard_normal((50, 16)).astype(np.float32)
+        values, scales = quantize(matrix, 'int8')
+        self.assertEqual(values.dtype, np.int8)
+        error = np.abs(dequantize(values, scales) - matrix)
+        self.assertTrue(np.all(error <= scales[:, None] / 2 + 1e-6))
+    
+    def test_float32_overlap_is_exact(self):
+        """Test held-out playlists folded in at full precision overlap the reference completely."""
+        rng = np.random.default_rng(0)
+        songs = rng.standard_normal((100, 8)).astype(np.float32)
+        held_out = [np.sort(rng.choice(100, size=5, replace=False)) for _ in range(30)]
+        for fold_in in ({'engine': 'keras', 'regularization': 0.1}, {'engine': 'als', 'alpha': 40.0, 'regularization': 0.01}):
+            self.assertEqual(top_k_overlap(songs, np.zeros(100, dtype=np.float32), held_out, fold_in, 'float32', k=10), 1.0)
+    
+    def test_report_keeps_float32_baseline(self):
+        """Test the report has a float32 row with overlap 1.0 and smaller quantized sizes."""
+        rng = np.random.default_rng(0)
+        playlists = rng.standard_normal((30, 8)).astype(np.float32)
+        songs = rng.standard_normal((100, 8)).astype(np.float32)
+        held_out = [np.sort(rng.choice(100, size=5, replace=False)) for _ in range(10)]
+        report = quantization_report(playlists, songs, np.zeros(100, dtype=np.float32),
+                                     held_out=held_out, fold_in={'engine': 'keras'}, k=10)
+        
+        self.assertEqual(report['float32']['top_k_overlap'], 1.0)
+        self.assertLess(report['int8']['megabytes'], report['float16']['megabytes'])
+        self.assertLess(report['float16']['megabytes'], report['float32']['megabytes'])
+        self.assertGreater(report['int8']['top_k_overlap'], 0.5)
+        self.assertIsNone(quantization_report(playlists, songs, np.zeros(100, dtype=np.float32))['int8']['top_k_overlap'])
+    
+    def test_held_out_playlists_leave_training(self):
+        """Test held-out playlists are removed from the training interactions with their songs kept aside."""
+        playlist_ids = np.arange(100, 200, dtype=np.int64)
+        playlist_indices = np.repeat(np.arange(100, dtype=np.int32), 3)
+        song_indices = np.tile(np.arange(3, dtype=np.int32), 100)
+        
+        train_ids, train_playlists, train_songs, held_out = hold_out_playlists(
+            playlist_ids, playlist_indices, song_indices, fraction=0.1
+        )
+        self.assertEqual(len(train_ids), 90)
+        self.assertEqual(len(held_out), 10)
+        self.assertEqual(train_playlists.max(), 89)
+        self.assertEqual(len(train_songs), 270)
+        for rows in held_out:
+            self.assertEqual(rows.tolist(), [0, 1, 2])
+
+
+class TestTagMatrix(IsolatedMediaMixin, TestCase):
+    def setUp(self):
+        """Set up tagged songs."""
+        super().setUp()
+        self.tags = {
+            1: {'rock': 1.0, 'indie': 0.6, 'pop': 0.2},
+            2: {'jazz': 0.9, 'rock': 0.4},
+            3: {'classical': 1.0},
+        }
+        self.songs = {
+            song_id: Song.objects.create(
+                name=f"Song {song_id}",
+                artist=f"Artist {song_id}",
+                spotify_id=f"spotify:track:{song_id}",
+                lastfm_tags=tags
+            )
+            for song_id, tags in self.tags.items()
+        }
+    
+    def test_song_tags_sync(self):
+        """Test SongTag rows follow lastfm_tags and back top_tags and with_tag."""
+        song = self.songs[1]
+        song.sync_tags()
+        self.assertEqual(song.top_tags, [('rock', 1.0), ('indie', 0.6), ('pop', 0.2)])
+        self.assertEqual(list(Song.objects.with_tag('indie', min_weight=0.5)), [song])
+        
+        song.lastfm_tags = {'jazz': 0.7}
+        song.sync_tags()
+        self.assertEqual(song.top_tags, [('jazz', 0.7)])
+        self.assertFalse(Song.objects.with_tag('indie').exists())
+    
+    def test_playlist_tag_profile_follows_songs(self):
+        """Test signal-maintained tag sums match a rebuild after adds, removes and re-tagging."""
+        for song in self.songs.values():
+            song.sync_tags()
+        playlist = Playlist.objects.create(name="Tagged", user=User.objects.create(username="tagger"))
+        playlist.songs.add(self.songs[1], self.songs[2])
+        self.songs[3].playlists.add(playlist)
+        playlist.songs.remove(self.songs[2], self.songs[2])
+        self.songs[1].lastfm_tags = {'rock': 0.5, 'folk': 0.9}
+        self.songs[1].sync_tags()
+        
+        profile = PlaylistTagProfile.objects.get(playlist=playlist)
+        rebuilt = PlaylistTagProfile.build(playlist.id)
+        self.assertEqual(profile.n_songs_with_tags, 2)
+        self.assertEqual(profile.profile().keys(), rebuilt.profile().keys())
+        for tag, weight in rebuilt.profile().items():
+            self.assertAlmostEqual(profile.profile()[tag], weight)
+    
+    def test_deleting_song_removes_its_tags(self):
+        """Test deleting a tagged song takes its tags out of the profiles of its playlists."""
+        for song in self.songs.values():
+            song.sync_tags()
+        playlist = Playlist.objects.create(name="Deleted", user=User.objects.create(username="deleter"))
+        playlist.songs.add(self.songs[1], self.songs[2])
+        self.songs[2].delete()
+        
+        profile = PlaylistTagProfile.objects.get(playlist=playlist)
+        self.assertEqual(profile.n_songs_with_tags, 1)
+        self.assertNotIn('jazz', profile.profile())
+        self.assertEqual(profile.profile().keys(), PlaylistTagProfile.build(playlist.id).profile().keys())
+    
+    def test_explanation_lists_mutual_neighbours_once(self):
+        """Test a playlist song that is a neighbour in both directions is listed once with its best similarity."""
+        for other_name in ("Other 1", "Other 2"):
+            Playlist.objects.create(name=other_name, user=User.objects.create(username=other_name)).songs.add(self.songs[1], self.songs[2])
+        playlist = Playlist.objects.create(name="Explained", user=User.objects.create(username="explainer"))
+        playlist.songs.add(self.songs[2])
+        SongNeighbor.objects.create(song=self.songs[1], neighbor=self.songs[2], similarity=0.7, rank=0)
+        SongNeighbor.objects.create(song=self.songs[2], neighbor=self.songs[1], similarity=0.8, rank=0)
+        
+        explanation = LastFMContentRecommender().explain_recommendation(self.songs[1], playlist)
+        self.assertEqual(explanation['similar_to_songs'], [{'song': "Song 2 - Artist 2", 'similarity': 0.8}])
+    
+    def test_adding_untagged_song_queues_it(self):
+        """Test songs added without Last.fm tags are queued for enrichment and tagged ones are not."""
+        untagged = Song.objects.create(name="Untagged", artist="Artist", spotify_id="spotify:track:untagged")
+        playlist = Playlist.objects.create(name="Queue", user=User.objects.create(username="queuer"))
+        playlist.songs.add(untagged, self.songs[1])
+        self.assertEqual(list(EnrichmentTask.objects.values_list('song_id', flat=True)), [untagged.id])
+    
+    def test_matrix_scores_match_row_scoring(self):
+        """Test vectorized scoring matches calculate_song_playlist_similarity."""
+        recommender = LastFMContentRecommender()
+        profile = {'rock': 0.5, 'indie': 0.3, 'jazz': 0.2}
+        matrix = TagMatrix.build()
+        scores = recommender.score_tag_matrix(matrix, profile)
+        for row, song_id in enumerate(matrix.song_ids):
+            song = Song.objects.get(id=song_id)
+            self.assertAlmostEqual(scores[row], recommender.calculate_song_playlist_similarity(song, profile), places=5)
+    
+    def test_retrieval_matches_full_scan(self):
+        """Test posting list retrieval with early termination returns the full scan's best rows."""
+        recommender = LastFMContentRecommender()
+        recommender.posting_block = 1
+        profile = {'rock': 0.5, 'indie': 0.3, 'jazz': 0.2}
+        matrix = TagMatrix.build()
+        no_rows = np.zeros(len(matrix), dtype=bool)
+        
+        rows, scores = recommender.retrieve_by_tags(matrix, profile, no_rows, no_rows, n_recommendations=2)
+        
+        all_rows = np.arange(len(matrix))
+        expected = recommender._final_tag_scores(matrix, all_rows, recommender.score_tag_matrix(matrix, profile), no_rows)
+        expected_rows = [row for row in top_k_indices(expected, 2) if expected[row] > 0.3]
+        self.assertEqual(list(rows), expected_rows)
+    
+    def test_song_neighbors_match_tag_similarity(self):
+        """Test neighbour blocks hold the exact weighted Jaccard of calculate_tag_similarity."""
+        matrix = TagMatrix.build()
+        init_worker(matrix.weights)
+        _, rows, cols, similarities = compute_block((0, len(matrix), 5, 3))
+        
+        tags = {song.id: song.lastfm_tags for song in self.songs.values()}
+        self.assertEqual(len(rows), 2)  # Songs 1 and 2 share 'rock', song 3 shares nothing
+        for row, col, similarity in zip(rows, cols, similarities):
+            expected = calculate_tag_similarity(tags[matrix.song_ids[row]], tags[matrix.song_ids[col]])
+            self.assertAlmostEqual(similarity, expected, places=5)
+    
+    def test_update_songs(self):
+        """Test updated songs are re-read and new tags extend the vocabulary."""
+        matrix = TagMatrix.build()
+        song = self.songs[3]
+        song.lastfm_tags = {'ambient': 0.8}
+        song.save()
+        Song.objects.filter(id=self.songs[2].id).update(lastfm_tags={})
+        
+        matrix = matrix.update_songs([song.id, self.songs[2].id])
+        self.assertEqual(list(matrix.song_ids), sorted([self.songs[1].id, song.id]))
+        self.assertIn('ambient', matrix.tag_columns)
+        row = int(np.searchsorted(matrix.song_ids, song.id))
+        self.assertEqual(matrix.weights[row, matrix.tag_columns['ambient']], np.float32(0.8))
+
+
+class TestSongMatchKey(TestCase):
+    def test_spellings_share_a_key(self):
+        """Test case, accents and featured artists do not change the key."""
+        self.assertEqual(
+            song_match_key('Beyoncé feat. Jay-Z', 'Crazy In Love (feat. JAY-Z)'),
+            song_match_key('beyonce', 'crazy in love')
+        )
+    
+    def test_resolve_match_keys(self):
+        """Test saved songs resolve by key and unknown keys are left out."""
+        song = Song.objects.create(name="Crazy In Love", artist="Beyoncé", spotify_id="spotify:track:cil")
+        key = song_match_key('BEYONCE', 'Crazy in Love')
+        self.assertEqual(resolve_match_keys([key, 'nobody|nothing']), {key: (song.id,)})
+
+
+class TestWeightedMinHash(TestCase):
+    def test_agreement_estimates_weighted_jaccard(self):
+        """Test signature agreement is 1 for equal profiles and tracks calculate_tag_similarity otherwise."""
+        a = {'rock': 1.0, 'indie': 0.6, 'pop': 0.2}
+        b = {'rock': 0.8, 'indie': 0.6, 'folk': 0.4}
+        self.assertEqual(estimate_similarity(weighted_minhash(a), weighted_minhash(dict(a))[None, :])[0], 1.0)
+        estimate = estimate_similarity(weighted_minhash(a), weighted_minhash(b)[None, :])[0]
+        self.assertAlmostEqual(estimate, calculate_tag_similarity(a, b), delta=0.25)
+    
+    def test_lsh_lookup_follows_tag_changes(self):
+        """Test songs are found through their buckets after their tags are synced."""
+        song = Song.objects.create(name="Song", artist="Artist", spotify_id="spotify:track:lsh", lastfm_tags={'rock': 1.0, 'indie': 0.6})
+        song.sync_tags()
+        self.assertEqual([song_id for song_id, _ in find_similar_songs({'rock': 1.0, 'indie': 0.6})], [song.id])
+        
+        song.lastfm_tags = {'jazz': 1.0}
+        song.sync_tags()
+        self.assertEqual(find_similar_songs({'rock': 1.0, 'indie': 0.6}), [])
+
+
+class TestAudioEmbeddings(TestCase):
+    def test_feature_matrix_fills_missing_values(self):
+        """Test songs without any audio feature are skipped and missing columns get the defaults."""
+        song = Song.objects.create(name="Song", artist="Artist", spotify_id="spotify:track:audio", tempo=100.0, energy=0.9)
+        Song.objects.create(name="Silent", artist="Artist", spotify_id="spotify:track:silent")
+        song_ids, features = feature_matrix(audio_feature_rows(Song.objects.all()))
+        self.assertEqual(song_ids.tolist(), [song.id])
+        np.testing.assert_allclose(features[0], [0.5, 0.9, 0.5, 0.5, 0.5, 0.0])
+    
+    def test_top_k_is_cosine_order(self):
+        """Test top_k ranks by cosine similarity and honours exclusions and candidates."""
+        index = AudioEmbeddingIndex(np.array([1, 2, 3, 4]), np.array([[1, 0], [2, 0.2], [0, 1], [1, 1]], dtype=np.float32))
+        query = index.query_vector([1])
+        self.assertEqual([song_id for song_id, _ in index.top_k(query, 3, exclude_ids=[1])], [2, 4, 3])
+        self.assertEqual([song_id for song_id, _ in index.top_k(query, 3, candidate_ids=[3, 4, 99])], [4, 3])
+        self.assertEqual(list(index.rows([4, 99])), [3, -1])
+
+
+class TestDerivedValues(IsolatedMediaMixin, TestCase):
+    def test_values_are_kept_per_model_version(self):
+        """Test derived values are computed once per version and concurrent version swaps never lose one."""
+        def derive(version):
+            recommender = InferenceRecommender()
+            recommender.model_version = version
+            return recommender._derived('norms', lambda: np.full(3, float(len(version))))
+        
+        calls = []
+        recommender = InferenceRecommender()
+        recommender.model_version = 'v1'
+        recommender._derived('norms', lambda: calls.append(1) or np.ones(3))
+        recommender._derived('norms', lambda: calls.append(1) or np.ones(3))
+        self.assertEqual(len(calls), 1)
+        
+        versions = [f"v{'x' * (i % 4)}" for i in range(200)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(derive, versions))
+        for version, result in zip(versions, results):
+            self.assertEqual(result[0], len(version))
+        self.assertLessEqual(len(_derived_cache), 4)
+
+
+class TestRecommendationContext(TestCase):
+    def test_values_are_computed_once(self):
+        """Test memoized values and playlist songs are computed on first use only."""
+        playlist = Playlist.objects.create(name="Context", user=User.objects.create(username="contextuser"))
+        song = Song.objects.create(name="Song", artist="Artist", spotify_id="spotify:track:context")
+        playlist.songs.add(song)
+        context = RecommendationContext(playlist)
+        calls = []
+        self.assertEqual(context.memo('component', lambda: calls.append(1) or 'ranked'), 'ranked')
+        self.assertEqual(context.memo('component', lambda: calls.append(1) or 'other'), 'ranked')
+        self.assertEqual(len(calls), 1)
+        
+        self.assertEqual(context.existing_ids, {song.id})
+        with self.assertNumQueries(0):
+            self.assertEqual(context.existing_artists, {'Artist'})
+
+
+class TestRankedComponents(TestCase):
+    def setUp(self):
+        """Set up a playlist and a way to hold slow components until the test ends."""
+        self.context = RecommendationContext(
+            Playlist.objects.create(name="Ranked", user=User.objects.create(username="rankeduser"))
+        )
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+    
+    def run_components(self, compute):
+        """Run the ranked components with compute(component) as their output and 0.5 s deadlines."""
+        class StubRecommender(HybridRecommender):
+            def _compute_ranked(self, context, component, n):
+                return compute(component)
+        
+        recommender = StubRecommender()
+        recommender.component_deadlines = dict.fromkeys(RANKED_COMPONENTS, 0.5)
+        recommender._run_ranked_components(self.context, 10)
+    
+    def ranked(self, component):
+        return self.context.memo(('ranked', component), lambda: self.fail(f"{component} was not set"))[1]
+    
+    def test_ranked_grows_when_more_is_asked(self):
+        """Test a ranked output is recomputed for a larger n and reused for a smaller one."""
+        calls = []
+        
+        class CountingRecommender(HybridRecommender):
+            def _compute_ranked(self, context, component, n):
+                calls.append(n)
+                return [(song_id, 1.0) for song_id in range(min(n, 15))]
+        
+        recommender = CountingRecommender()
+        self.assertEqual(len(recommender._ranked(self.context, 'collaborative', 5)), 5)
+        self.assertEqual(len(recommender._ranked(self.context, 'collaborative', 3)), 5)
+        self.assertEqual(len(recommender._ranked(self.context, 'collaborative', 20)), 15)
+        self.assertEqual(len(recommender._ranked(self.context, 'collaborative', 30)), 15)
+        self.assertEqual(calls, [5, 20])
+    
+    def test_slow_component_is_degraded(self):
+        """Test a component missing its deadline ranks nothing while the others are kept."""
+        def compute(component):
+            if component == 'content_similar':
+                self.release.wait(5)
+            return [(component, 1.0)]
+        
+        self.run_components(compute)
+        self.assertEqual(self.context.degraded, {'content_similar'})
+        self.assertEqual(self.ranked('content_similar'), [])
+        self.assertEqual(self.ranked('collaborative'), [('collaborative', 1.0)])
+    
+    def test_failing_component_is_degraded(self):
+        """Test a component raising an error ranks nothing while the others are kept."""
+        def compute(component):
+            if component == 'content_tags':
+                raise RuntimeError("Last.fm is down")
+            return [(component, 1.0)]
+        
+        self.run_components(compute)
+        self.assertEqual(self.context.degraded, {'content_tags'})
+        self.assertEqual(self.ranked('content_tags'), [])
+        self.assertEqual(self.ranked('content_similar'), [('content_similar', 1.0)])
+    
+    def test_saturated_executor_degrades_without_waiting(self):
+        """Test components that find every executor slot busy are degraded at once instead of queued."""
+        executor = BoundedExecutor(1)
+        busy = executor.submit(self.release.wait, 5)
+        
+        with mock.patch('recommendations.hybrid_recommender._executor', executor):
+            start = time.monotonic()
+            self.run_components(lambda component: [(component, 1.0)])
+            self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(self.context.degraded, set(RANKED_COMPONENTS))
+        self.release.set()
+        busy.result()
+
+
+class TestHybridStrategies(IsolatedMediaMixin, TestCase):
+    def test_weight_matrix_matches_per_strategy_score(self):
+        """Test one component x strategy product gives every strategy's calculate_hybrid_score."""
+        recommender = HybridRecommender()
+        strategies = list(recommender.strategies)
+        component_matrix = np.random.default_rng(0).random((5, len(COMPONENTS)))
+        hybrid_scores = np.minimum(component_matrix @ recommender.strategy_weights(strategies), 1.0)
+        
+        for row in range(len(component_matrix)):
+            for column, strategy in enumerate(strategies):
+                self.assertAlmostEqual(
+                    hybrid_scores[row, column],
+                    recommender.calculate_hybrid_score(None, None, dict(zip(COMPONENTS, component_matrix[row])), strategy)
+                )
+    
+    def test_update_only_writes_changed_rows(self):
+        """Test a refresh keeps unchanged rows, updates changed ones and removes songs no longer recommended."""
+        playlist = Playlist.objects.create(name="Hybrid", user=User.objects.create(username="hybriduser"))
+        songs = [Song.objects.create(name=f"Song {i}", artist="Artist", spotify_id=f"spotify:track:hybrid{i}") for i in range(3)]
+        components = dict.fromkeys(COMPONENTS, 0.5)
+        
+        class FixedRecommender(HybridRecommender):
+            results = []
+            
+            def recommend_hybrid_strategies(self, playlist, n_recommendations=20, strategies=None, context=None):
+                return {'balanced': self.results}
+        
+        recommender = FixedRecommender()
+        recommender.results = [(songs[0], 0.9, components), (songs[1], 0.8, components)]
+        recommender.update_hybrid_recommendations(playlist.id)
+        kept = HybridRecommendation.objects.get(playlist=playlist, song=songs[0])
+        
+        recommender.results = [(songs[0], 0.9, components), (songs[2], 0.7, components)]
+        recommender.update_hybrid_recommendations(playlist.id)
+        rows = HybridRecommendation.objects.filter(playlist=playlist, strategy='balanced')
+        self.assertEqual(sorted(rows.values_list('song_id', flat=True)), [songs[0].id, songs[2].id])
+        self.assertEqual(rows.get(song=songs[0]).updated_at, kept.updated_at)
+        
+        payload = RecommendationSnapshot.get_payload(playlist.id, 'balanced')
+        self.assertEqual([entry['song']['id'] for entry in payload], [songs[0].id, songs[2].id])
+        self.assertEqual(payload[1]['id'], rows.get(song=songs[2]).id)
+    
+    def test_snapshot_is_served_until_rebuilt(self):
+        """Test a snapshot of an older model version is still served and is found as stale."""
+        playlist = Playlist.objects.create(name="Stale", user=User.objects.create(username="staleuser"))
+        song = Song.objects.create(name="Song", artist="Artist", spotify_id="spotify:track:stale")
+        
+        class FixedRecommender(HybridRecommender):
+            def recommend_hybrid_strategies(self, playlist, n_recommendations=20, strategies=None, context=None):
+                return {'balanced': [(song, 0.9, dict.fromkeys(COMPONENTS, 0.5))]}
+        
+        FixedRecommender().update_hybrid_recommendations(playlist.id)
+        RecommendationSnapshot.objects.filter(playlist=playlist).update(model_version='previous')
+        
+        payload = RecommendationSnapshot.get_payload(playlist.id, 'balanced')
+        self.assertEqual([entry['song']['id'] for entry in payload], [song.id])
+        self.assertEqual(list(RecommendationSnapshot.stale_playlist_ids(current_model_version())), [playlist.id])
+        
+        FixedRecommender().update_hybrid_recommendations(playlist.id)
+        self.assertFalse(RecommendationSnapshot.stale_playlist_ids(current_model_version()).exists())
+        self.assertEqual(RecommendationSnapshot.objects.filter(playlist=playlist).count(), 1)
+    
+    def test_degraded_snapshot_is_flagged(self):
+        """Test degraded components are stored with the snapshot and its entries, and only served on request."""
+        playlist = Playlist.objects.create(name="Degraded", user=User.objects.create(username="degradeduser"))
+        song = Song.objects.create(name="Song", artist="Artist", spotify_id="spotify:track:degraded")
+        
+        class DegradedRecommender(HybridRecommender):
+            def recommend_hybrid_strategies(self, playlist, n_recommendations=20, strategies=None, context=None):
+                context.degraded.add('content_similar')
+                return {'balanced': [(song, 0.9, dict.fromkeys(COMPONENTS, 0.5))]}
+        
+        DegradedRecommender().update_hybrid_recommendations(playlist.id)
+        self.assertEqual(RecommendationSnapshot.objects.get(playlist=playlist).degraded, ['content_similar'])
+        self.assertIsNone(RecommendationSnapshot.get_payload(playlist.id, 'balanced'))
+        payload = RecommendationSnapshot.get_payload(playlist.id, 'balanced', include_degraded=True)
+        self.assertEqual(payload[0]['degraded'], ['content_similar'])
+    
+    def test_row_scores_come_from_their_components(self):
+        """Test each stored score column holds its own component."""
+        playlist = Playlist.objects.create(name="Columns", user=User.objects.create(username="columnsuser"))
+        song = Song.objects.create(name="Song", artist="Artist", spotify_id="spotify:track:columns")
+        components = dict(zip(COMPONENTS, [0.1, 0.2, 0.3, 0.4, 0.5]))
+        
+        class FixedRecommender(HybridRecommender):
+            def recommend_hybrid_strategies(self, playlist, n_recommendations=20, strategies=None, context=None):
+                return {'balanced': [(song, 0.9, components)]}
+        
+        FixedRecommender().update_hybrid_recommendations(playlist.id)
+        row = HybridRecommendation.objects.get(playlist=playlist, song=song)
+        self.assertEqual(row.collaborative_score, components['collaborative'])
+        self.assertEqual(row.content_audio_score, components['content_audio'])
+        self.assertEqual(row.content_mood_score, components['content_similar'])
+        self.assertEqual(row.popularity_score, components['popularity'])
+        self.assertEqual(row.explanation['components'], components)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
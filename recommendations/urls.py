@@ -6,6 +6,7 @@ app_name = 'recommendations'
 urlpatterns = [
     path('playlist/<int:playlist_id>/', views.get_playlist_recommendations, name='playlist_recommendations'),
     path('playlist/<int:playlist_id>/song/<int:song_id>/explanation/', views.get_recommendation_explanation, name='recommendation_explanation'),
+    path('song/<int:song_id>/similar/', views.get_similar_songs, name='similar_songs'),
     path('feedback/<int:recommendation_id>/', views.record_recommendation_feedback, name='recommendation_feedback' ),
     path('stats/', views.get_recommendation_stats, name='recommendation_stats'),
 ]
\ No newline at end of file
@@ -1,8 +1,22 @@
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Tuple
 from music.models import Song, Playlist
+from django.conf import settings
 from django.core.cache import cache
 import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+try:
+    import fcntl
+except ImportError:  # Windows, where only one writer process may run at a time
+    fcntl = None
+
+logger = logging.getLogger(__name__)
 
 
 def calculate_cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
@@ -78,4 +92,242 @@ def normalize_scores(scores: Dict[int, float]) -> Dict[int, float]:
     return {
         k: (v - min_score) / (max_score - min_score)
         for k, v in scores.items()
-    }
\ No newline at end of file
+    }
+
+def top_k_indices(scores: np.ndarray, k: int, exclude: np.ndarray = None) -> np.ndarray:
+    """Indices of the k highest scores, best first, skipping masked entries"""
+    if exclude is not None:
+        scores = np.where(exclude, -np.inf, scores)
+    
+    k = min(k, int(np.isfinite(scores).sum()))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k highest scores in every row, best first"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def lookup_indices(sorted_ids: np.ndarray, ids) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Map ids to their positions in a sorted id array with searchsorted.
+    Returns the positions and a boolean mask of which ids were found.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    
+    positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return positions, sorted_ids[positions] == ids
+
+
+def load_interactions(chunk_size: int = 10000) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Stream (playlist_id, song_id) pairs straight from the Playlist.songs
+    through table into preallocated arrays and factorize them, without
+    materializing Playlist or Song instances.
+
+    Args:
+        chunk_size (int, optional): Rows fetched per database round trip. Defaults to 10000.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: Tuple containing:
+            - playlist ids: Sorted unique playlist ids (int64).
+            - song ids: Sorted unique song ids (int64).
+            - playlist indices: Row of each interaction's playlist in playlist ids (int32).
+            - song indices: Row of each interaction's song in song ids (int32).
+    """
+    pairs = Playlist.songs.through.objects.order_by().values_list('playlist_id', 'song_id')
+    total = pairs.count()
+    
+    raw = np.empty((total, 2), dtype=np.int64)
+    filled = 0
+    rows = pairs.iterator(chunk_size=chunk_size)
+    while filled < total:
+        chunk = list(islice(rows, min(chunk_size, total - filled)))
+        if not chunk:
+            break
+        raw[filled:filled + len(chunk)] = chunk
+        filled += len(chunk)
+    raw = raw[:filled]
+    
+    playlist_ids, playlist_indices = np.unique(raw[:, 0], return_inverse=True)
+    song_ids, song_indices = np.unique(raw[:, 1], return_inverse=True)
+    
+    return (
+        playlist_ids,
+        song_ids,
+        playlist_indices.astype(np.int32).ravel(),
+        song_indices.astype(np.int32).ravel(),
+    )
+
+
+def hold_out_playlists(
+    playlist_ids: np.ndarray,
+    playlist_indices: np.ndarray,
+    song_indices: np.ndarray,
+    fraction: float = 0.02,
+    max_playlists: int = 200,
+    seed: int = 42
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[np.ndarray]]:
+    """
+    Set a random sample of playlists aside from the output of
+    load_interactions, to evaluate the model on playlists it was not
+    trained on. Held-out playlists are served by fold-in like new ones.
+
+    Args:
+        playlist_ids (np.ndarray): Sorted unique playlist ids
+        playlist_indices (np.ndarray): Row of each interaction's playlist in playlist_ids
+        song_indices (np.ndarray): Row of each interaction's song
+        fraction (float, optional): Share of playlists held out. Defaults to 0.02.
+        max_playlists (int, optional): Playlists held out at most. Defaults to 200.
+        seed (int, optional): Random seed for the sample. Defaults to 42.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, List[np.ndarray]]: Tuple containing:
+            - playlist ids: Sorted ids of the training playlists.
+            - playlist indices: Row of each training interaction's playlist, renumbered.
+            - song indices: Row of each training interaction's song, unchanged.
+            - held out: Sorted song rows of each held-out playlist.
+    """
+    n_held_out = min(max_playlists, int(len(playlist_ids) * fraction))
+    if n_held_out == 0:
+        return playlist_ids, playlist_indices, song_indices, []
+    
+    held = np.zeros(len(playlist_ids), dtype=bool)
+    held[np.random.default_rng(seed).choice(len(playlist_ids), size=n_held_out, replace=False)] = True
+    in_training = ~held[playlist_indices]
+    
+    indptr, held_songs = build_interaction_csr(playlist_indices[~in_training], song_indices[~in_training], len(playlist_ids))
+    held_out = [held_songs[indptr[row]:indptr[row + 1]] for row in np.flatnonzero(held)]
+    renumbered = (np.cumsum(~held) - 1)[playlist_indices[in_training]]
+    
+    return playlist_ids[~held], renumbered.astype(np.int32), song_indices[in_training], held_out
+
+
+def fold_in_vector(V: np.ndarray, song_biases: np.ndarray = None, song_gram: np.ndarray = None,
+                   alpha: float = 40.0, regularization: float = 0.1) -> np.ndarray:
+    """
+    Playlist vector for the vectors V of its songs with the song vectors
+    fixed, solving the trainer's regularized least squares problem for one
+    playlist row.
+
+    With song_gram (YtY over every song) this is the weighted ALS row,
+    (YtY + alpha VtV + reg I) u = (1 + alpha) Vt 1. Otherwise it is the
+    pointwise row where u . v_i + b_i should reach 1 for every song,
+    (VtV + reg I) u = Vt (1 - b).
+    """
+    V = np.asarray(V, dtype=np.float64)
+    A = V.T @ V
+    if song_gram is not None:
+        A = song_gram + alpha * A
+        b = (1.0 + alpha) * V.sum(axis=0)
+    else:
+        biases = np.zeros(len(V)) if song_biases is None else np.asarray(song_biases, dtype=np.float64)
+        b = V.T @ (1.0 - biases)
+    A += regularization * np.eye(V.shape[1])
+    return np.linalg.solve(A, b).astype(np.float32)
+
+
+def build_interaction_csr(playlist_indices: np.ndarray, song_indices: np.ndarray, n_playlists: int) -> Tuple[np.ndarray, np.ndarray]:
+    """CSR row pointers and sorted song indices of each playlist's interactions"""
+    order = np.lexsort((song_indices, playlist_indices))
+    counts = np.bincount(playlist_indices, minlength=n_playlists)
+    indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return indptr, np.asarray(song_indices)[order].astype(np.int32)
+
+
+class FileStore:
+    """
+    Process-wide access to an index persisted as one file under MEDIA_ROOT.
+    The object is loaded once and reloaded when the file changes on disk,
+    checked at most every check_interval seconds. Objects are published
+    through their save(path), which must replace the file atomically.
+    
+    Writers that derive the new object from the current one must do so
+    under write_lock() and start from load_latest(), so writers in other
+    processes do not overwrite each other's changes.
+    """
+
+    def __init__(self, relative_path: str, loader: Callable, check_interval: float = 5.0):
+        self.relative_path = relative_path
+        self.loader = loader
+        self.check_interval = check_interval
+        self._value = None
+        self._mtime = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(settings.MEDIA_ROOT, self.relative_path)
+
+    def get(self):
+        """Current object, None if it was never published"""
+        if self._value is not None and time.monotonic() - self._last_check < self.check_interval:
+            return self._value
+
+        with self._lock:
+            self._last_check = time.monotonic()
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                return self._value
+            if mtime != self._mtime:
+                try:
+                    self._value = self.loader(self.path)
+                    self._mtime = mtime
+                except Exception as e:
+                    logger.error(f"Error loading {self.relative_path}: {e}")
+            return self._value
+
+    def reset(self):
+        """Forget the loaded object, the next get() reads the file again"""
+        with self._lock:
+            self._value = None
+            self._mtime = None
+            self._last_check = 0.0
+
+    def load_latest(self):
+        """Current object as on disk now, ignoring check_interval"""
+        self._last_check = 0.0
+        return self.get()
+
+    @contextmanager
+    def write_lock(self):
+        """Exclusive lock on the file across processes, held for a read-modify-write"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def publish(self, value):
+        """Persist value and make it the current object of this process"""
+        with self._lock:
+            value.save(self.path)
+            self._value = value
+            self._mtime = os.path.getmtime(self.path)
+            self._last_check = time.monotonic()
@@ -4,9 +4,11 @@ from django.views.decorators.cache import cache_page
 from django.http import JsonResponse
 from django.core.cache import cache
 from music.models import Playlist, Song
-from .models import HybridRecommendation, RecommendationFeedback
+from .models import HybridRecommendation, RecommendationFeedback, RecommendationSnapshot
 from .hybrid_recommender import HybridRecommender
-from .serializers import (HybridRecommendationSerializer, RecommendationExplanationSerializer)
+from .inference_recommender import InferenceRecommender
+from .audio_embeddings import audio_index_store
+from .serializers import (HybridRecommendationSerializer, RecommendationExplanationSerializer, SongSerializer)
 import logging
 
 logger = logging.getLogger(__name__)
@@ -28,10 +30,8 @@ def get_playlist_recommendations(request, playlist_id):
         if cached_data:
             return JsonResponse(cached_data)
     
-    recommendations = HybridRecommendation.objects.filter(
-        playlist=playlist,
-        strategy=strategy
-    ).select_related('song').order_by('-hybrid_score')[:20]
+    # Missing and degraded snapshots are recomputed
+    recommendations = RecommendationSnapshot.get_payload(playlist_id, strategy)
     
     if not recommendations or refresh:
         recommender = HybridRecommender()
@@ -41,19 +41,20 @@ def get_playlist_recommendations(request, playlist_id):
             n_recommendations=20
         )
         
-        recommendations = HybridRecommendation.objects.filter(
-            playlist=playlist,
-            strategy=strategy
-        ).select_related('song').order_by('-hybrid_score')[:20]
+        recommendations = RecommendationSnapshot.get_payload(playlist_id, strategy, include_degraded=True)
     
-    serializer = HybridRecommendationSerializer(recommendations, many=True)
+    recommendations = recommendations or []
+    degraded = recommendations[0].get('degraded', []) if recommendations else []
     data = {
-        'recommendations': serializer.data,
+        'recommendations': recommendations,
+        'degraded': degraded,
         'strategy': strategy,
         'playlist_id': playlist_id
     }
     
-    cache.set(cache_key, data, 1800)
+    # Degraded results are not cached so the next request tries again
+    if not degraded:
+        cache.set(cache_key, data, 1800)
     
     return JsonResponse(data)
 
@@ -99,6 +100,32 @@ def get_recommendation_explanation(request, playlist_id, song_id):
     return JsonResponse(data)
 
 
+@login_required
+def get_similar_songs(request, song_id):
+    song = get_object_or_404(Song, id=song_id)
+    
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    
+    similar = InferenceRecommender().similar_songs(song.id, n_recommendations=limit)
+    songs = Song.objects.in_bulk([song_id for song_id, _ in similar])
+    
+    data = {
+        'song_id': song.id,
+        'similar_songs': [
+            {
+                'song': SongSerializer(songs[similar_id]).data,
+                'similarity': round(similarity, 4)
+            }
+            for similar_id, similarity in similar if similar_id in songs
+        ]
+    }
+    
+    return JsonResponse(data)
+
+
 @login_required
 def record_recommendation_feedback(request, recommendation_id):
     if request.method != 'POST':
@@ -127,43 +154,32 @@ def record_recommendation_feedback(request, recommendation_id):
 
 
 def _get_similar_songs_in_playlist(playlist, target_song):
-    from .content_recommender import ContentBasedRecommender
-    
-    recommender = ContentBasedRecommender()
-    target_features = recommender.get_song_features(target_song)
+    index = audio_index_store.get()
+    if index is None:
+        return []
     
-    if not target_features:
+    query = index.query_vector([target_song.id])
+    if query is None:
         return []
     
-    similar_songs = []
+    playlist_song_ids = playlist.songs.values_list('id', flat=True)
+    similar = [
+        (song_id, similarity)
+        for song_id, similarity in index.top_k(query, 3, exclude_ids=[target_song.id], candidate_ids=playlist_song_ids)
+        if similarity > 0.7
+    ]
+    songs = Song.objects.in_bulk([song_id for song_id, _ in similar])
     
-    for song in playlist.songs.all():
-        if song.id == target_song.id:
-            continue
-        
-        song_features = recommender.get_song_features(song)
-        if song_features:
-            # Simple similarity calculation
-            similarity = 0
-            common_features = 0
-            
-            for feature in ['energy', 'valence', 'danceability', 'acousticness']:
-                if feature in target_features and feature in song_features:
-                    diff = abs(target_features[feature] - song_features[feature])
-                    similarity += (1 - diff)
-                    common_features += 1
-            
-            if common_features > 0:
-                similarity = similarity / common_features
-                if similarity > 0.7:
-                    similar_songs.append({
-                        'id': song.id,
-                        'name': song.name,
-                        'artist': song.artist,
-                        'similarity': round(similarity, 2)
-                    })
-    
-    return sorted(similar_songs, key=lambda x: x['similarity'], reverse=True)[:3]
+    return [
+        {
+            'id': song_id,
+            'name': songs[song_id].name,
+            'artist': songs[song_id].artist,
+            'similarity': round(similarity, 2)
+        }
+        for song_id, similarity in similar
+        if song_id in songs
+    ]
 
 
 @login_required
@@ -278,7 +278,7 @@ def create_song_from_spotify_track(track_data, fetch_audio_features=False):
         fetch_audio_features: Whether to fetch audio features (default False for recommendations)
     """
     from music.models import Song
-    from lastfm.utils import enrich_song_with_lastfm_data
+    from lastfm.queue import enqueue_songs
     
     track_id = track_data.get('id')
     if not track_id:
@@ -304,10 +304,8 @@ def create_song_from_spotify_track(track_data, fetch_audio_features=False):
     )
     
     if created or not song.lastfm_tags:
-        try:
-            enrich_song_with_lastfm_data(song)
-        except Exception as e:
-            logger.warning(f"Could not enrich song {song.id} with Last.fm data: {e}")
+        # Tags are fetched by the process_enrichment_queue worker, not while the user waits
+        enqueue_songs([song.id])
     
     return song
 
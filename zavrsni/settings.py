@@ -142,6 +142,8 @@ RECOMMENDATION_SETTINGS = {
     'CACHE_TIMEOUT': 1800,
     'BATCH_SIZE': 128,
     'TRAINING_EPOCHS': 50,
+    'ANN_N_PROBE': None,  # ANN lists searched per query, None = exact search over all songs
+    'COMPONENT_DEADLINES': {},  # Seconds per hybrid component, e.g. {'content_similar': 4.0}, see HybridRecommender
 }
 
 LOGGING = {